@@ -1,10 +1,49 @@
-from fastapi import FastAPI
-import base64
+import re
+import sys
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Tuple
+
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from app.schemas import GenerateCardRequest, GenerateCardResponse
 
-app = FastAPI()
+# 原型直接用 backend 的合成服務（services 是 backend 底下的套件）
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from services.compose_service import (  # noqa: E402
+    MAX_CANVAS_SIDE,
+    MIN_CANVAS_SIDE,
+    ComposeService,
+    base_theme,
+    is_supported_theme,
+)
+from services.llm_service import LLMService  # noqa: E402
+from services.renditions import FULL  # noqa: E402
+
+FONT_PATH = BACKEND_DIR / "assets" / "fonts" / "edukai-5.0.ttf"
+BACKGROUND_BASE_DIR = BACKEND_DIR / "assets" / "backgrounds"
+
+# 目前只有背景圖庫（+ 程式產生的配色背景），還沒有接 AI 繪圖
+BACKGROUND_MODES = {"auto"}
+
+compose_service = ComposeService(
+    background_base_dir=str(BACKGROUND_BASE_DIR),
+    font_path=str(FONT_PATH),
+)
+llm_service = LLMService()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 字型、背景清單、貼紙、背景分析索引先載好，第一張卡不用等
+    await run_in_threadpool(compose_service.warm_up)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 簡單開 CORS 給前端 localhost:5173
 app.add_middleware(
@@ -16,6 +55,32 @@ app.add_middleware(
 )
 
 
+def resolve_theme(theme: str, subtype: str | None) -> str:
+    """
+    theme + subtype 組成 backend 的主題名稱，例如 festival + christmas -> festival_christmas。
+    跟 backend 用同一份主題清單（彩蛋主題、_retro 後綴也可以）。
+    """
+    name = f"{theme}_{subtype}" if subtype else theme
+    if not is_supported_theme(name):
+        raise HTTPException(status_code=400, detail=f"Unknown theme: {name}")
+    return name
+
+
+def split_custom_text(text: str) -> Tuple[str, str]:
+    """
+    使用者自己打的字拆成標題 / 副標：
+    有換行就第一行當標題；沒有的話在第一個標點後面切開（「早安～祝你...」-> 「早安～」+「祝你...」）。
+    """
+    lines = [line.strip() for line in text.strip().splitlines() if line.strip()]
+    if len(lines) > 1:
+        return lines[0], " ".join(lines[1:])
+    text = lines[0] if lines else ""
+    match = re.match(r"^(.+?[，。！？!?,～~])\s*(.+)$", text)
+    if match:
+        return match.group(1).rstrip("，,"), match.group(2)
+    return text, ""
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
@@ -23,18 +88,45 @@ def health():
 
 @app.post("/api/generate-card", response_model=GenerateCardResponse)
 def generate_card(req: GenerateCardRequest):
-    # TODO 這裡先用固定圖片替代
-    img_path = Path(__file__).parent / "assets" / "sample.png"
-    with open(img_path, "rb") as f:
-        img_bytes = f.read()
+    # 同步函式，FastAPI 會丟到 threadpool 跑，不卡 event loop
+    if req.background_mode not in BACKGROUND_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported background_mode: {req.background_mode}",
+        )
+    for side in (req.width, req.height):
+        if not MIN_CANVAS_SIDE <= side <= MAX_CANVAS_SIDE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"width / height must be between {MIN_CANVAS_SIDE} and {MAX_CANVAS_SIDE}",
+            )
+    theme = resolve_theme(req.theme, req.subtype)
 
-    image_base64 = base64.b64encode(img_bytes).decode("utf-8")
+    # 有自訂文字就完全不呼叫 LLM（最便宜的路）
+    if req.custom_text and req.custom_text.strip():
+        title, subtitle = split_custom_text(req.custom_text)
+        footer = ""
+    else:
+        # *_retro 只是換畫風，文案照原本的主題
+        elder_text = llm_service.generate_text(base_theme(theme))
+        title, subtitle, footer = elder_text.title, elder_text.subtitle, elder_text.footer
 
-    text = req.custom_text or "早安～祝你今天心情愉快，平安健康！"
+    # seed 固定背景、layout、貼紙 / 雪花；width / height 直接決定畫布大小
+    result = compose_service.compose_renditions(
+        theme=theme,
+        title=title,
+        subtitle=subtitle,
+        footer=footer,
+        width=req.width,
+        height=req.height,
+        renditions=[FULL],
+        seed=req.seed,
+    )
+    full = result["full"]
 
     return GenerateCardResponse(
-        text=text,
-        background_prompt_used="demo fixed image",
-        image_mime="image/png",
-        image_base64=image_base64,
+        text="\n".join(part for part in (title, subtitle) if part),
+        background_prompt_used=f"{theme} background library ({result.layout} layout)",
+        image_mime=f"image/{full.format.lower()}",
+        image_base64=full.to_base64(),
     )
@@ -0,0 +1,55 @@
+"""
+動畫版本計時 / 檔案大小，跟同一張卡的靜態原圖比較：
+
+    cd backend
+    python -m benchmarks.bench_animation [--repeat 5]
+
+每個主題用同一組文字合成：靜態 FULL（PNG）、animated_webp、animated_gif，
+各跑 N 次取中位數，並列出檔案大小。
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+from services.compose_service import ComposeService
+from services.renditions import ANIMATED_GIF, ANIMATED_WEBP, FULL
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BACKGROUND_BASE_DIR = BACKEND_DIR / "assets" / "backgrounds"
+
+CASES = {
+    "festival_christmas": ("聖誕快樂", "願燈火照亮笑容", "把聖誕祝福分享給家人"),
+    "festival_lantern": ("元宵節快樂", "吃碗湯圓甜蜜蜜", "一起提燈賞燈去"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    service = ComposeService(background_base_dir=str(BACKGROUND_BASE_DIR))
+    service.warm_up()
+
+    for theme, (title, subtitle, footer) in CASES.items():
+        print(theme)
+        for spec in (FULL, ANIMATED_WEBP, ANIMATED_GIF):
+            samples = []
+            size = 0
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                result = service.compose_renditions(
+                    theme, title, subtitle, footer,
+                    layout="center", renditions=[spec],
+                )
+                samples.append((time.perf_counter() - start) * 1000)
+                size = len(result[spec.name].data)
+            print(
+                f"  {spec.name:14s} median {statistics.median(samples):7.1f} ms  "
+                f"{size / 1024:7.1f} KB"
+            )
+
+
+if __name__ == "__main__":
+    main()
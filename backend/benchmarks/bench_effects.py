@@ -0,0 +1,73 @@
+"""
+特效個別計時：
+
+    cd backend
+    python -m benchmarks.bench_effects [--size 1024] [--repeat 20]
+
+每個註冊在 EFFECT_REGISTRY 的特效都會在同一張背景上各跑 N 次，
+另外附上舊版「三次 ImageEnhance」電子包漿當對照組。
+"""
+import argparse
+import glob
+import os
+import statistics
+import time
+from pathlib import Path
+
+from PIL import Image, ImageEnhance
+
+from services.effects import EFFECT_REGISTRY, EffectContext
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BACKGROUND_BASE_DIR = BACKEND_DIR / "assets" / "backgrounds"
+STICKER_DIR = BACKEND_DIR / "assets" / "stickers"
+
+
+def legacy_deep_fry(img: Image.Image) -> Image.Image:
+    img = ImageEnhance.Color(img).enhance(3.0)
+    img = ImageEnhance.Contrast(img).enhance(2.0)
+    img = ImageEnhance.Sharpness(img).enhance(10.0)
+    return img
+
+
+def load_sample(size: int) -> Image.Image:
+    candidates = sorted(glob.glob(str(BACKGROUND_BASE_DIR / "morning" / "*.*")))
+    if not candidates:
+        return Image.new("RGBA", (size, size), (255, 240, 220, 255))
+    return Image.open(candidates[0]).convert("RGBA").resize((size, size))
+
+
+def time_fn(fn, base: Image.Image, repeat: int) -> list:
+    samples = []
+    for _ in range(repeat):
+        img = base.copy()
+        start = time.perf_counter()
+        fn(img)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    base = load_sample(args.size)
+    ctx = EffectContext(sticker_dir=str(STICKER_DIR))
+
+    cases = {name: (lambda img, fn=fn: fn(img, ctx))
+             for name, fn in EFFECT_REGISTRY.items()}
+    cases["deep_fry (legacy ImageEnhance)"] = legacy_deep_fry
+
+    print(f"canvas {args.size}x{args.size}, repeat {args.repeat}")
+    for name, fn in cases.items():
+        samples = time_fn(fn, base, args.repeat)
+        print(
+            f"{name:32s} median {statistics.median(samples):7.2f} ms  "
+            f"min {min(samples):7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+LINE 關鍵字路由的吞吐量：
+
+    cd backend
+    python -m benchmarks.bench_intent_router [--messages 200000]
+
+用隨機組出來的訊息（大約 1/3 有關鍵字、長度 2~40 字）比較
+舊版「any() 掃關鍵字 + if/elif」跟 IntentRouter 單次掃描的速度。
+計時之前先確認兩邊對每則訊息給出一樣的 (theme, retro, layout)，不一樣就直接結束。
+"""
+import argparse
+import random
+import time
+from pathlib import Path
+
+from services.intent_router import IntentRouter
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+FILLER = "今天天氣很好大家一起出去走走吃飯喝茶聊天看看風景謝謝你們的照顧晚安午安"
+KEYWORDS = ["早安", "健康", "新年", "聖誕節", "雪", "厭世", "bug", "躺平", "炸", "節慶"]
+
+LEGACY_TRIGGERS = ["健康", "生活格言", "早安", "節慶", "新年", "聖誕節",
+                   "壞了", "爛", "老了", "失敗", "地獄", "負能量", "厭世", "開", "炸", "retro",
+                   "bug", "code", "coding", "debug", "工程師", "程式",
+                   "雪", "下雪", "躺平", "不想努力", "rebel"]
+
+
+def legacy_route(user_text: str):
+    """原本 handle_message 裡的判斷邏輯。"""
+    user_text_lower = user_text.lower()
+    if not any(k in user_text_lower for k in LEGACY_TRIGGERS):
+        return None
+    target_theme = "life"
+    if any(k in user_text for k in ["壞了", "爛", "老了", "失敗"]):
+        target_theme = "broken_egg"
+    elif any(k in user_text for k in ["地獄", "負能量", "厭世", "煩"]):
+        target_theme = "dark_humor"
+    elif any(k in user_text_lower for k in ["bug", "code", "coding", "debug", "工程師", "程式"]):
+        target_theme = "programmer"
+    elif any(k in user_text_lower for k in ["雪", "下雪"]):
+        target_theme = "festival_christmas"
+    elif any(k in user_text_lower for k in ["躺平", "不想努力", "rebel"]):
+        target_theme = "rebel"
+    elif "早" in user_text:
+        target_theme = "morning"
+    elif "健康" in user_text:
+        target_theme = "health"
+    elif "生活格言" in user_text:
+        target_theme = "life"
+    elif "節慶" in user_text:
+        target_theme = "festival_common"
+    elif "聖誕節" in user_text:
+        target_theme = "festival_christmas"
+    elif "新年" in user_text:
+        target_theme = "festival_newyear"
+    if any(k in user_text for k in ["開", "炸", "retro"]):
+        target_theme += "_retro"
+    return target_theme
+
+
+def legacy_intent(user_text: str):
+    """舊版邏輯換算成 (theme, retro, layout)；layout 跟原本 handle_message 一樣只有地獄梗置中。"""
+    target_theme = legacy_route(user_text)
+    if target_theme is None:
+        return None
+    layout = "center" if target_theme == "dark_humor" else "auto"
+    return target_theme.replace("_retro", ""), target_theme.endswith("_retro"), layout
+
+
+def router_intent(router: IntentRouter, user_text: str):
+    intent = router.route(user_text)
+    if intent is None:
+        return None
+    return intent.base_theme, intent.theme.endswith("_retro"), intent.layout
+
+
+def make_messages(n: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(n):
+        length = rng.randint(2, 40)
+        text = "".join(rng.choice(FILLER) for _ in range(length))
+        if rng.random() < 0.33:
+            pos = rng.randint(0, len(text))
+            text = text[:pos] + rng.choice(KEYWORDS) + text[pos:]
+        messages.append(text)
+    return messages
+
+
+def run(fn, messages) -> float:
+    start = time.perf_counter()
+    for m in messages:
+        fn(m)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200_000)
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    router = IntentRouter(str(BACKEND_DIR / "config" / "intents.json"))
+
+    mismatches = [
+        (m, legacy_intent(m), router_intent(router, m))
+        for m in messages
+        if legacy_intent(m) != router_intent(router, m)
+    ]
+    if mismatches:
+        for text, old, new in mismatches[:10]:
+            print(f"  {text!r}: legacy {old} != IntentRouter {new}")
+        raise SystemExit(f"{len(mismatches)} of {len(messages)} messages routed differently")
+    routed = sum(1 for m in messages if legacy_intent(m) is not None)
+    print(f"both routers agree on all {len(messages)} messages ({routed} routed)")
+
+    for name, fn in (("legacy any()/if-elif", legacy_route),
+                     ("IntentRouter", router.route)):
+        elapsed = run(fn, messages)
+        print(
+            f"{name:22s} {len(messages) / elapsed:12,.0f} msg/s  "
+            f"({elapsed * 1e6 / len(messages):.2f} µs/msg)"
+        )
+
+
+if __name__ == "__main__":
+    main()
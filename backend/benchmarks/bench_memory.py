@@ -0,0 +1,223 @@
+"""
+每張卡的記憶體尖峰，依 layout / 特效分開列，用來估每個 worker 要給多少記憶體：
+
+    cd backend
+    python -m benchmarks.bench_memory [--size 1024] [--repeat 3] [--renditions full preview]
+
+用 tracemalloc 量。Python 這邊（PNG bytes、base64 字串...）本來就會被追蹤；
+Pillow 的像素是 C 裡 malloc 的，tracemalloc 看不到，這裡把每張 Pillow 影像的像素大小
+用 PyTraceMalloc_Track 登記到另一個 domain，兩邊一起算進 peak。
+Pillow C 函式內部的暫存（例如 resize 的中間結果）和字型點陣不會被算到，
+所以數字是下限，實際設定 worker 上限時再多留一點。
+"""
+import argparse
+import ctypes
+import gc
+import tracemalloc
+import weakref
+from collections import defaultdict
+from pathlib import Path
+
+from PIL import Image
+
+from services.compose_service import ComposeService
+from services.renditions import RENDITION_PRESETS
+from services.shared_pool import format_rss, read_rss
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BACKGROUND_BASE_DIR = BACKEND_DIR / "assets" / "backgrounds"
+FONT_PATH = BACKEND_DIR / "assets" / "fonts" / "edukai-5.0.ttf"
+
+EFFECT_SETS = {
+    "none": [],
+    "sticker": ["sticker"],
+    "snow": ["snow"],
+    "deep_fry": ["deep_fry"],
+    "all": ["sticker", "snow", "deep_fry"],
+}
+
+# tracemalloc 的 domain 0 是 Python 自己的配置，Pillow 的像素另外記一個
+PIL_DOMAIN = 0x50494C
+
+_track = ctypes.pythonapi.PyTraceMalloc_Track
+_track.argtypes = (ctypes.c_uint, ctypes.c_size_t, ctypes.c_size_t)
+_untrack = ctypes.pythonapi.PyTraceMalloc_Untrack
+_untrack.argtypes = (ctypes.c_uint, ctypes.c_size_t)
+
+
+def pixel_bytes(core) -> int:
+    """Pillow 的 RGB 也是每個像素 4 bytes（跟 RGBA 一樣），L / P / 1 是 1 byte。"""
+    width, height = core.size
+    mode = core.mode
+    if mode in ("1", "L", "P"):
+        per_pixel = 1
+    elif mode.startswith("I;16"):
+        per_pixel = 2
+    else:
+        per_pixel = 4
+    return width * height * per_pixel
+
+
+class PillowTracker:
+    """
+    攔截 Image.im 的 setter，影像物件拿到像素時登記、物件回收時取消。
+    同一個 core 可能被好幾個 Image 物件共用，用參考計數。
+    """
+
+    def __init__(self):
+        self._refs: dict[int, list] = {}   # id(core) -> [參考數, bytes]
+        self.current = 0
+        self.peak = 0
+        self.full_canvases = 0
+        self.canvas_bytes = 0
+        self._original = Image.Image.im
+
+    def install(self) -> None:
+        tracker = self
+
+        def setter(img, core):
+            cell = img.__dict__.get("_bench_cell")
+            if cell is None:
+                cell = img._bench_cell = [None]
+                weakref.finalize(img, tracker._drop, cell)
+            tracker._drop(cell)
+            img._im = core
+            cell[0] = tracker._add(core)
+
+        Image.Image.im = property(self._original.fget, setter)
+
+    def uninstall(self) -> None:
+        Image.Image.im = self._original
+
+    def reset(self, canvas_bytes: int) -> None:
+        self.peak = self.current
+        self.full_canvases = 0
+        self.canvas_bytes = canvas_bytes
+
+    def _add(self, core) -> int:
+        key = id(core)
+        entry = self._refs.get(key)
+        if entry is not None:
+            entry[0] += 1
+            return key
+        size = pixel_bytes(core)
+        self._refs[key] = [1, size]
+        _track(PIL_DOMAIN, key, size)
+        self.current += size
+        self.peak = max(self.peak, self.current)
+        if size >= self.canvas_bytes:
+            self.full_canvases += 1
+        return key
+
+    def _drop(self, cell) -> None:
+        key = cell[0]
+        if key is None:
+            return
+        cell[0] = None
+        entry = self._refs.get(key)
+        if entry is None:
+            return
+        entry[0] -= 1
+        if entry[0] == 0:
+            del self._refs[key]
+            _untrack(PIL_DOMAIN, key)
+            self.current -= entry[1]
+
+
+def measure_card(service, tracker, args, layout, effects, seed, specs) -> tuple:
+    """回傳 (整體 peak, 像素 peak, 整張大小的影像數)，都是這張卡多用的部分。"""
+    gc.collect()
+    tracker.reset(args.size * args.size * 4)
+    base_pixels = tracker.current
+    base_traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+
+    result = service.compose_renditions(
+        args.theme, args.title, args.subtitle, "",
+        layout=layout, effects=effects,
+        width=args.size, height=args.size,
+        renditions=specs, seed=seed,
+    )
+    # API 回應會再轉一次 base64，也算進去
+    encoded = [rendition.to_base64() for rendition in result.renditions.values()]
+
+    peak = tracemalloc.get_traced_memory()[1] - base_traced
+    pixels = tracker.peak - base_pixels
+    full_canvases = tracker.full_canvases
+    del result, encoded
+    return peak, pixels, full_canvases
+
+
+def mb(value: int) -> str:
+    return f"{value / 1024 / 1024:7.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--theme", default="morning")
+    parser.add_argument("--title", default="早安平安喜樂")
+    parser.add_argument("--subtitle", default="祝你天天開心，身體健康！")
+    parser.add_argument(
+        "--renditions", nargs="+", default=["full"], choices=sorted(RENDITION_PRESETS))
+    parser.add_argument("--buffer-blocks", type=int, default=4,
+                        help="Pillow 保留幾塊釋放的影像記憶體重用（同 IMAGE_BUFFER_BLOCKS）")
+    parser.add_argument("--font", default=str(FONT_PATH))
+    args = parser.parse_args()
+
+    service = ComposeService(
+        background_base_dir=str(BACKGROUND_BASE_DIR),
+        font_path=args.font,
+        image_buffer_blocks=args.buffer_blocks,
+    )
+    service.warm_up()
+    specs = [RENDITION_PRESETS[name] for name in args.renditions]
+
+    tracker = PillowTracker()
+    tracker.install()
+    tracemalloc.start()
+    # 先畫一張把各種快取（placement plan、斜字圖層、字型）暖好，量到的才是穩定狀態
+    for layout in service.available_layouts:
+        service.compose_renditions(
+            args.theme, args.title, args.subtitle, "", layout=layout,
+            effects=EFFECT_SETS["all"], width=args.size, height=args.size,
+            renditions=specs, seed=0,
+        )
+    Image.core.reset_stats()
+
+    print(
+        f"canvas {args.size}x{args.size}, renditions {', '.join(args.renditions)}, "
+        f"repeat {args.repeat} (max of repeats)"
+    )
+    print(f"{'layout':12s} {'effects':9s} {'peak MB':>8s} {'pixels MB':>10s} {'full canvases':>14s}")
+    worst = defaultdict(int)
+    for layout in service.available_layouts:
+        for effect_name, effects in EFFECT_SETS.items():
+            samples = [
+                measure_card(service, tracker, args, layout, effects, seed, specs)
+                for seed in range(1, args.repeat + 1)
+            ]
+            peak = max(s[0] for s in samples)
+            pixels = max(s[1] for s in samples)
+            canvases = max(s[2] for s in samples)
+            worst[layout] = max(worst[layout], peak)
+            print(f"{layout:12s} {effect_name:9s} {mb(peak):>8s} {mb(pixels):>10s} {canvases:14d}")
+
+    tracemalloc.stop()
+    tracker.uninstall()
+
+    stats = Image.core.get_stats()
+    print()
+    print("worst case per layout:", ", ".join(f"{k} {mb(v).strip()} MB" for k, v in worst.items()))
+    print(f"worst card: {mb(max(worst.values())).strip()} MB")
+    print(
+        f"pillow blocks: allocated {stats['allocated_blocks']}, "
+        f"reused {stats['reused_blocks']}, cached {stats['blocks_cached']}"
+    )
+    print("process:", format_rss(read_rss()))
+    print("worker 上限大約抓：上面 process RSS + MAX_CONCURRENT_RENDERS x worst card")
+
+
+if __name__ == "__main__":
+    main()
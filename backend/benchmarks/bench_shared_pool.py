@@ -0,0 +1,85 @@
+"""
+比較「每個 process 自己解碼背景」跟「attach 共用池」的記憶體用量：
+
+    cd backend
+    python -m benchmarks.bench_shared_pool --themes morning life --cards 200
+
+會先發佈一份共用池（只含指定主題），再分別模擬一個 worker 連續合成 N 張卡
+需要的背景，印出前後的 RSS。共用池的頁面記在 RssShmem，
+多個 worker 共用同一份實體記憶體。
+"""
+import argparse
+import os
+import random
+import tempfile
+from pathlib import Path
+
+from PIL import ImageOps
+
+from services.background_library import BackgroundLibrary
+from services.shared_pool import (
+    SharedBackgroundPool,
+    format_rss,
+    publish_pool,
+    read_rss,
+)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SIZE = (1024, 1024)
+
+
+def private_cache(library, picks):
+    """沒有共用池時，每個 worker 自己解碼並快取 RGB 背景。"""
+    cache = {}
+    for theme, name in picks:
+        if (theme, name) not in cache:
+            with library.open(theme, name) as src:
+                cache[(theme, name)] = ImageOps.fit(
+                    src.convert("RGB"), SIZE)
+        cache[(theme, name)].copy()
+    return cache
+
+
+def shared(pool, picks):
+    for theme, name in picks:
+        pool.get(theme, name).convert("RGB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--themes", nargs="+", default=["morning"])
+    parser.add_argument("--cards", type=int, default=200)
+    parser.add_argument("--pool", default=None)
+    args = parser.parse_args()
+
+    library = BackgroundLibrary(str(BACKEND_DIR / "assets" / "backgrounds"))
+    picks = [
+        (theme, random.choice(library.names(theme)))
+        for theme in random.choices(args.themes, k=args.cards)
+    ]
+
+    pool_path = args.pool or os.path.join(tempfile.gettempdir(), "bench.pool")
+    count = publish_pool(library, pool_path, SIZE, themes=args.themes)
+    print(f"published {count} backgrounds -> {pool_path}")
+
+    before = read_rss()
+    pool = SharedBackgroundPool(pool_path)
+    shared(pool, picks)
+    after = read_rss()
+    print("[shared pool]")
+    print("  before:", format_rss(before))
+    print("  after: ", format_rss(after))
+
+    before = read_rss()
+    cache = private_cache(library, picks)
+    after = read_rss()
+    print(f"[private decode cache, {len(cache)} backgrounds]")
+    print("  before:", format_rss(before))
+    print("  after: ", format_rss(after))
+
+    if not args.pool:
+        os.remove(pool_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+量測冷啟動時間（每次都開新的 python process）：
+
+    cd backend
+    python -m benchmarks.bench_startup [--runs 5]
+
+- import: `import main` 花的時間（沒設定 LINE / Gemini 金鑰時不會載入 SDK）
+- warm_up: 字型、背景清單、貼紙等快取暖機時間
+- ready: process 開始到可以接流量的總時間
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+main.warm_up()
+t2 = time.perf_counter()
+heavy = [m for m in ("linebot", "google.genai") if m in sys.modules]
+print(json.dumps({"import": t1 - t0, "warm_up": t2 - t1, "ready": t2 - t0,
+                  "sdk_loaded": heavy}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    for _ in range(args.runs):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE],
+            cwd=BACKEND_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    for key in ("import", "warm_up", "ready"):
+        values = [r[key] * 1000 for r in results]
+        print(
+            f"{key:8s} median {statistics.median(values):8.1f} ms  "
+            f"max {max(values):8.1f} ms"
+        )
+    print("SDKs imported at startup:", results[-1]["sdk_loaded"] or "none")
+
+
+if __name__ == "__main__":
+    main()
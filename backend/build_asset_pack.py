@@ -0,0 +1,75 @@
+"""
+把 assets/backgrounds/<theme>/*.jpg 打包成一個 mmap 用的 pack 檔：
+
+    cd backend
+    python build_asset_pack.py                      # 原檔直接打包
+    python build_asset_pack.py --size 1024          # 先正規化成 1024x1024 JPEG 再打包
+
+服務啟動時如果找到 assets/backgrounds.pack（或環境變數 BACKGROUND_PACK），
+就會改從 pack 讀背景，不再列目錄、開檔。
+"""
+import argparse
+import io
+import os
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from services.asset_pack import write_pack
+from services.background_library import BACKGROUND_EXTENSIONS
+
+BACKEND_DIR = Path(__file__).resolve().parent
+DEFAULT_SRC = BACKEND_DIR / "assets" / "backgrounds"
+DEFAULT_OUT = BACKEND_DIR / "assets" / "backgrounds.pack"
+
+
+def normalize(data: bytes, size: int, quality: int) -> bytes:
+    """裁切縮放成 size x size，重新存成不帶 metadata 的 JPEG。"""
+    with Image.open(io.BytesIO(data)) as src:
+        img = ImageOps.fit(src.convert("RGB"), (size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build background asset pack")
+    parser.add_argument("--src", default=str(DEFAULT_SRC))
+    parser.add_argument("--out", default=str(DEFAULT_OUT))
+    parser.add_argument(
+        "--size", type=int, default=None,
+        help="正規化成指定邊長（預設不處理，直接打包原檔）",
+    )
+    parser.add_argument("--quality", type=int, default=90)
+    args = parser.parse_args()
+
+    themes = {}
+    total_bytes = 0
+    for theme in sorted(os.listdir(args.src)):
+        theme_dir = os.path.join(args.src, theme)
+        if not os.path.isdir(theme_dir):
+            continue
+
+        items = []
+        for name in sorted(os.listdir(theme_dir)):
+            if not name.lower().endswith(BACKGROUND_EXTENSIONS):
+                continue
+            with open(os.path.join(theme_dir, name), "rb") as f:
+                data = f.read()
+            if args.size:
+                data = normalize(data, args.size, args.quality)
+                name = os.path.splitext(name)[0] + ".jpg"
+            items.append((name, data))
+            total_bytes += len(data)
+
+        if items:
+            themes[theme] = items
+            print(f"{theme}: {len(items)} 張")
+
+    write_pack(args.out, themes)
+    count = sum(len(items) for items in themes.values())
+    print(f"完成：{count} 張、{total_bytes / 1024 / 1024:.1f} MB -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+固定的一組（主題、layout、文字、seed）畫成圖，跟存好的參考圖比對，重構後檢查畫面有沒有跑掉：
+
+    cd backend
+    python golden_images.py record                  # 產生 / 更新參考圖（assets/golden/）
+    python golden_images.py check                   # 比對，有差異的案例輸出 diff 圖，exit code 1
+    python golden_images.py check --only morning_center --diff-dir /tmp/golden
+
+tests/test_golden_images.py 會跑同一組案例：每個 seed 畫兩次要完全相同，
+有參考圖的話也做一次 check（python -m pytest tests）。
+
+案例在 config/golden.json。比對是「看起來一樣」而不是逐位元組相同：
+兩張都先輕微模糊（吸收反鋸齒 / 重新取樣的 1px 差異），
+再看平均差異和「差很多的像素」佔多少比例。
+參考圖跟字型、Pillow 版本有關，manifest.json 會記下來，環境不同時會先警告。
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import PIL
+from PIL import Image, ImageFilter
+
+from services.compose_service import ComposeService
+
+BACKEND_DIR = Path(__file__).resolve().parent
+CASES_PATH = BACKEND_DIR / "config" / "golden.json"
+GOLDEN_DIR = BACKEND_DIR / "assets" / "golden"
+BACKGROUND_BASE_DIR = BACKEND_DIR / "assets" / "backgrounds"
+FONT_PATH = BACKEND_DIR / "assets" / "fonts" / "edukai-5.0.ttf"
+
+# 預設容許範圍
+BLUR_RADIUS = 1.0
+PIXEL_TOLERANCE = 24      # 單一像素任一通道差超過這個才算「不一樣」
+MAX_BAD_RATIO = 0.002     # 不一樣的像素最多 0.2%
+MAX_MEAN_DIFF = 1.0       # 全圖平均差異（0~255）
+
+
+def load_cases(path: Path = CASES_PATH) -> tuple[list[dict], tuple[int, int]]:
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    return raw["cases"], tuple(raw.get("size", (512, 512)))
+
+
+def render(service: ComposeService, case: dict, default_size: tuple[int, int]) -> Image.Image:
+    width, height = case.get("size", default_size)
+    layout = case.get("layout", "auto")
+    canvas, _ = service.render_canvas(
+        case["theme"],
+        case["title"],
+        case["subtitle"],
+        case.get("footer", ""),
+        layout=None if layout == "auto" else layout,
+        effects=case.get("effects"),
+        width=width,
+        height=height,
+        seed=case["seed"],
+    )
+    return canvas
+
+
+def compare(reference: Image.Image, actual: Image.Image, blur: float) -> np.ndarray | None:
+    """模糊後每個像素三個通道裡最大的差異（0~255）；尺寸不同回傳 None。"""
+    if reference.size != actual.size:
+        return None
+    a = reference.convert("RGB")
+    b = actual.convert("RGB")
+    if blur:
+        a = a.filter(ImageFilter.GaussianBlur(blur))
+        b = b.filter(ImageFilter.GaussianBlur(blur))
+    diff = np.abs(
+        np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16)
+    ).max(axis=2)
+    return diff
+
+
+def score(
+    reference: Image.Image,
+    actual: Image.Image,
+    blur: float = BLUR_RADIUS,
+    pixel_tolerance: int = PIXEL_TOLERANCE,
+) -> tuple[float, float, np.ndarray] | None:
+    """回傳 (平均差異, 差很多的像素比例, 每個像素的差異)；尺寸不同回傳 None。"""
+    diff = compare(reference, actual, blur)
+    if diff is None:
+        return None
+    return float(diff.mean()), float((diff > pixel_tolerance).mean()), diff
+
+
+def within_limits(
+    mean: float,
+    bad_ratio: float,
+    max_mean: float = MAX_MEAN_DIFF,
+    max_bad_ratio: float = MAX_BAD_RATIO,
+) -> bool:
+    return mean <= max_mean and bad_ratio <= max_bad_ratio
+
+
+def create_service(font_path: str = str(FONT_PATH)) -> ComposeService:
+    """不用共用池 / pack：只看背景資料夾，結果才不會因為部署方式不同而改變。"""
+    service = ComposeService(
+        background_base_dir=str(BACKGROUND_BASE_DIR), font_path=font_path
+    )
+    service.warm_up()
+    return service
+
+
+def diff_image(reference: Image.Image, diff: np.ndarray, tolerance: int) -> Image.Image:
+    """灰階參考圖上，超出容許的像素標紅色。"""
+    base = np.asarray(reference.convert("L").convert("RGB"), dtype=np.uint8).copy() // 2
+    bad = diff > tolerance
+    base[bad] = (255, 0, 0)
+    return Image.fromarray(base)
+
+
+def environment(service: ComposeService) -> dict:
+    return {
+        "pillow": PIL.__version__,
+        "fonts": [Path(source.path).name for source in service.font_chain.sources],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Golden image record / check")
+    parser.add_argument("command", choices=("record", "check"))
+    parser.add_argument("--cases", default=str(CASES_PATH))
+    parser.add_argument("--golden-dir", default=str(GOLDEN_DIR))
+    parser.add_argument("--diff-dir", default=None, help="check 失敗時 diff 圖放哪（預設 golden-dir/diff）")
+    parser.add_argument("--only", nargs="*", help="只跑這些案例名稱")
+    parser.add_argument("--font", default=str(FONT_PATH))
+    parser.add_argument("--blur", type=float, default=BLUR_RADIUS)
+    parser.add_argument("--pixel-tolerance", type=int, default=PIXEL_TOLERANCE)
+    parser.add_argument("--max-bad-ratio", type=float, default=MAX_BAD_RATIO)
+    parser.add_argument("--max-mean", type=float, default=MAX_MEAN_DIFF)
+    args = parser.parse_args()
+
+    cases, default_size = load_cases(Path(args.cases))
+    if args.only:
+        cases = [case for case in cases if case["name"] in set(args.only)]
+    golden_dir = Path(args.golden_dir)
+    diff_dir = Path(args.diff_dir) if args.diff_dir else golden_dir / "diff"
+    manifest_path = golden_dir / "manifest.json"
+
+    service = create_service(args.font)
+    env = environment(service)
+
+    if args.command == "record":
+        golden_dir.mkdir(parents=True, exist_ok=True)
+        for case in cases:
+            render(service, case, default_size).save(golden_dir / f"{case['name']}.png")
+            print(f"  recorded {case['name']}")
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(env, f, ensure_ascii=False, indent=2)
+        print(f"{len(cases)} references in {golden_dir}")
+        return
+
+    if manifest_path.exists():
+        with open(manifest_path, encoding="utf-8") as f:
+            recorded = json.load(f)
+        if recorded != env:
+            print(f"WARNING: references were recorded with {recorded}, running with {env}")
+
+    failures = []
+    for case in cases:
+        ref_path = golden_dir / f"{case['name']}.png"
+        if not ref_path.exists():
+            print(f"  MISSING {case['name']} (run record first)")
+            failures.append(case["name"])
+            continue
+        actual = render(service, case, default_size)
+        with Image.open(ref_path) as ref:
+            reference = ref.convert("RGB")
+        scored = score(reference, actual, args.blur, args.pixel_tolerance)
+        if scored is None:
+            print(f"  FAIL {case['name']}: size {actual.size} != {reference.size}")
+            failures.append(case["name"])
+            continue
+        mean, bad_ratio, diff = scored
+        ok = within_limits(mean, bad_ratio, args.max_mean, args.max_bad_ratio)
+        print(
+            f"  {'ok  ' if ok else 'FAIL'} {case['name']:24s} "
+            f"mean {mean:5.2f}  bad {bad_ratio * 100:6.3f}%"
+        )
+        if not ok:
+            failures.append(case["name"])
+            diff_dir.mkdir(parents=True, exist_ok=True)
+            actual.save(diff_dir / f"{case['name']}.actual.png")
+            diff_image(reference, diff, args.pixel_tolerance).save(
+                diff_dir / f"{case['name']}.diff.png"
+            )
+
+    if failures:
+        print(f"{len(failures)} / {len(cases)} failed: {', '.join(failures)} (diffs in {diff_dir})")
+        sys.exit(1)
+    print(f"all {len(cases)} cases match")
+
+
+if __name__ == "__main__":
+    main()
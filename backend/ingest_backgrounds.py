@@ -0,0 +1,409 @@
+"""
+把原始背景圖匯入 assets/backgrounds/<theme>/（取代以前手動改路徑的 rename.py）：
+
+    cd backend
+    python ingest_backgrounds.py --src ~/incoming            # incoming/<theme>/*.jpg
+    python ingest_backgrounds.py --src ~/incoming --theme festival --dry-run
+    python ingest_backgrounds.py --renumber                  # 只把現有檔案重新編號成連號
+
+每張新圖會（多核心平行處理）：
+- 裁切縮放成渲染尺寸（預設 1024x1024），請求時不用再放大
+- 去掉 EXIF / ICC 等 metadata
+- 重新存成 baseline JPEG（非漸進式、4:2:0），解碼最快
+- 算感知雜湊（dHash），跟同主題已有的圖太像就當重複略過
+- 算亮度 / 各 layout 文字區複雜度，直接寫進 backgrounds.index.json
+
+已匯入過的原檔（用內容 SHA-1 判斷）會記在 backgrounds.ingest.json，
+之後只處理新加的圖。新檔先寫成暫存檔，全部寫好再一次改名成
+<theme>_NN.jpg，服務不會讀到寫一半的檔案。
+匯入完如果有用 pack，記得再跑一次 build_asset_pack.py。
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageOps
+
+from services.background_index import (
+    BackgroundStats,
+    analyze_image,
+    load_index_cache,
+    save_index_cache,
+)
+from services.background_library import BACKGROUND_EXTENSIONS, BackgroundLibrary
+
+BACKEND_DIR = Path(__file__).resolve().parent
+DEFAULT_SRC = BACKEND_DIR / "assets" / "incoming"
+DEFAULT_DEST = BACKEND_DIR / "assets" / "backgrounds"
+DEFAULT_INDEX = BACKEND_DIR / "assets" / "backgrounds.index.json"
+DEFAULT_MANIFEST = BACKEND_DIR / "assets" / "backgrounds.ingest.json"
+
+MANIFEST_VERSION = 1
+# 暫存檔名不是 BACKGROUND_EXTENSIONS，服務列目錄時不會看到
+NEW_PREFIX = ".ingest-new-"
+RENAME_PREFIX = ".ingest-rename-"
+
+# dHash 64 bits，漢明距離 <= 這個值就當成同一張（縮圖、調色、重壓都抓得到）
+DEFAULT_DUPLICATE_DISTANCE = 6
+
+
+# ===== 單張處理（在 worker process 裡跑） =====
+
+def dhash(img: Image.Image) -> int:
+    """差異雜湊：縮成 9x8 灰階，比較左右相鄰像素亮暗。"""
+    small = img.convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for y in range(8):
+        row = pixels[y * 9:(y + 1) * 9]
+        for x in range(8):
+            value = (value << 1) | (row[x] > row[x + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def process_source(path: str, size: int, quality: int) -> dict:
+    """
+    正規化一張原始圖。回傳 JPEG bytes、dHash、分析數據；
+    只回傳純資料，方便在 process 之間傳遞。
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    with Image.open(io.BytesIO(raw)) as src:
+        src = ImageOps.exif_transpose(src)
+        img = ImageOps.fit(src.convert("RGB"), (size, size), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    # 不帶 exif / icc_profile，baseline + 4:2:0 解碼最快
+    img.save(
+        buffer,
+        format="JPEG",
+        quality=quality,
+        optimize=True,
+        progressive=False,
+        subsampling="4:2:0",
+    )
+    brightness, layouts = analyze_image(img)
+    return {
+        "sha1": hashlib.sha1(raw).hexdigest(),
+        "data": buffer.getvalue(),
+        "dhash": dhash(img),
+        "brightness": brightness,
+        "layouts": layouts,
+    }
+
+
+def hash_existing(path: str) -> int:
+    with Image.open(path) as src:
+        src.draft("RGB", (64, 64))
+        return dhash(src)
+
+
+def file_sha1(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# ===== manifest =====
+
+def load_manifest(path: str) -> Dict[str, dict]:
+    """
+    {"version": 1, "themes": {"festival": {
+        "sources": {原檔 sha1: 匯入後的檔名 或 "duplicate:<檔名>"},
+        "hashes": {檔名: [signature, dhash]}}}}
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != MANIFEST_VERSION:
+        return {}
+    return data.get("themes", {})
+
+
+def save_manifest(path: str, themes: Dict[str, dict]) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"version": MANIFEST_VERSION, "themes": themes},
+            f,
+            ensure_ascii=False,
+            indent=1,
+        )
+    os.replace(tmp_path, path)
+
+
+# ===== 編號 =====
+
+def numbered_name(theme: str, number: int) -> str:
+    return f"{theme}_{number:02d}.jpg"
+
+
+def parse_number(theme: str, name: str) -> int | None:
+    match = re.fullmatch(rf"{re.escape(theme)}_(\d+)\.jpg", name)
+    return int(match.group(1)) if match else None
+
+
+def atomic_rename_all(theme_dir: str, moves: List[Tuple[str, str]]) -> None:
+    """
+    先全部改成暫存名再改成目標名，跟舊的 rename.py 一樣兩階段，
+    新舊檔名互相重疊也不會覆蓋到別張。
+    """
+    staged = []
+    for i, (old, new) in enumerate(moves):
+        if old == new:
+            continue
+        tmp = f"{RENAME_PREFIX}{i}.tmp"
+        os.replace(os.path.join(theme_dir, old), os.path.join(theme_dir, tmp))
+        staged.append((tmp, new))
+    for tmp, new in staged:
+        os.replace(os.path.join(theme_dir, tmp), os.path.join(theme_dir, new))
+
+
+# ===== 主流程 =====
+
+class Ingester:
+    def __init__(self, args: argparse.Namespace, pool: ProcessPoolExecutor):
+        self.args = args
+        self.pool = pool
+        self.library = BackgroundLibrary(args.dest)
+        self.manifest = load_manifest(args.manifest)
+        self.index = load_index_cache(args.index)
+
+    def _existing_hashes(self, theme: str, names: List[str]) -> Dict[str, int]:
+        """目前資料夾裡每張圖的 dHash，檔案沒變就用 manifest 裡的。"""
+        state = self.manifest.setdefault(theme, {"sources": {}, "hashes": {}})
+        theme_dir = os.path.join(self.args.dest, theme)
+
+        hashes: Dict[str, int] = {}
+        todo = []
+        for name in names:
+            signature = self.library.signature(theme, name)
+            cached = state["hashes"].get(name)
+            if cached and cached[0] == signature:
+                hashes[name] = int(cached[1], 16)
+            else:
+                todo.append((name, signature))
+
+        paths = [os.path.join(theme_dir, name) for name, _ in todo]
+        for (name, signature), value in zip(todo, self.pool.map(hash_existing, paths)):
+            hashes[name] = value
+            state["hashes"][name] = [signature, f"{value:016x}"]
+
+        # 已經不在資料夾裡的檔案
+        for name in list(state["hashes"]):
+            if name not in hashes:
+                del state["hashes"][name]
+        return hashes
+
+    def _new_sources(self, theme: str) -> List[str]:
+        src_dir = os.path.join(self.args.src, theme)
+        if not os.path.isdir(src_dir):
+            return []
+        seen = self.manifest.get(theme, {}).get("sources", {})
+        paths = [
+            os.path.join(src_dir, name)
+            for name in sorted(os.listdir(src_dir))
+            if name.lower().endswith(BACKGROUND_EXTENSIONS)
+        ]
+        return [
+            path for path, sha1 in zip(paths, self.pool.map(file_sha1, paths))
+            if sha1 not in seen
+        ]
+
+    def _clean_leftovers(self, theme_dir: str) -> None:
+        """
+        上次中斷留下的暫存檔：還沒改名的新圖直接刪掉重做；
+        改名到一半的是正式背景，不能刪，要人工確認。
+        dry run 只列出來，不動任何檔案。
+        """
+        if self.args.dry_run:
+            leftovers = [
+                name for name in os.listdir(theme_dir)
+                if name.startswith((NEW_PREFIX, RENAME_PREFIX))
+            ]
+            for name in leftovers:
+                print(f"  上次中斷留下的暫存檔：{os.path.join(theme_dir, name)}")
+            return
+        for name in os.listdir(theme_dir):
+            if name.startswith(NEW_PREFIX):
+                os.remove(os.path.join(theme_dir, name))
+            elif name.startswith(RENAME_PREFIX):
+                raise SystemExit(
+                    f"{theme_dir} 裡有上次改名中斷的 {name}，請先手動改回正式檔名"
+                )
+
+    def _rename_index_keys(self, theme: str, moves: List[Tuple[str, str]]) -> None:
+        state = self.manifest.setdefault(theme, {"sources": {}, "hashes": {}})
+        renamed = dict(moves)
+        state["hashes"] = {
+            renamed.get(name, name): value for name, value in state["hashes"].items()
+        }
+        state["sources"] = {
+            sha1: renamed.get(name, name) for sha1, name in state["sources"].items()
+        }
+        moved = {
+            f"{theme}/{old}": self.index.pop(f"{theme}/{old}")
+            for old, new in moves
+            if f"{theme}/{old}" in self.index
+        }
+        for old, new in moves:
+            if f"{theme}/{old}" in moved:
+                self.index[f"{theme}/{new}"] = moved[f"{theme}/{old}"]
+
+    def renumber(self, theme: str) -> int:
+        """把 <theme>_NN.jpg 壓成從 01 開始的連號，回傳改名的張數。"""
+        theme_dir = os.path.join(self.args.dest, theme)
+        numbered = sorted(
+            (parse_number(theme, n), n)
+            for n in self.library.names(theme)
+            if parse_number(theme, n) is not None
+        )
+        moves = [
+            (name, numbered_name(theme, i))
+            for i, (_, name) in enumerate(numbered, start=1)
+            if name != numbered_name(theme, i)
+        ]
+        if moves and not self.args.dry_run:
+            atomic_rename_all(theme_dir, moves)
+            self._rename_index_keys(theme, moves)
+        return len(moves)
+
+    def ingest(self, theme: str) -> Tuple[int, int]:
+        """匯入一個主題的新圖，回傳 (新增張數, 重複略過張數)。"""
+        args = self.args
+        theme_dir = os.path.join(args.dest, theme)
+        # dry run 不建資料夾、不清暫存檔，整個背景庫都不動
+        if not args.dry_run:
+            os.makedirs(theme_dir, exist_ok=True)
+        if os.path.isdir(theme_dir):
+            self._clean_leftovers(theme_dir)
+
+        sources = self._new_sources(theme)
+        if not sources:
+            return 0, 0
+
+        names = list(self.library.names(theme))
+        known = self._existing_hashes(theme, names)
+        state = self.manifest[theme]
+
+        results = self.pool.map(
+            process_source,
+            sources,
+            [args.size] * len(sources),
+            [args.quality] * len(sources),
+        )
+
+        accepted: List[Tuple[str, dict]] = []
+        duplicates = 0
+        for path, result in zip(sources, results):
+            match = min(
+                known.items(),
+                key=lambda item: hamming(item[1], result["dhash"]),
+                default=None,
+            )
+            if match and hamming(match[1], result["dhash"]) <= args.duplicate_distance:
+                duplicates += 1
+                state["sources"][result["sha1"]] = f"duplicate:{match[0]}"
+                print(f"  重複：{os.path.basename(path)} ≈ {match[0]}")
+                continue
+            known[os.path.basename(path)] = result["dhash"]
+            accepted.append((f"{NEW_PREFIX}{len(accepted)}.tmp", result))
+
+        if args.dry_run:
+            return len(accepted), duplicates
+
+        # 先全部寫成暫存檔，再一起改名成正式檔名
+        for pending, result in accepted:
+            with open(os.path.join(theme_dir, pending), "wb") as f:
+                f.write(result["data"])
+                f.flush()
+                os.fsync(f.fileno())
+
+        next_number = max(
+            (parse_number(theme, n) or 0 for n in names), default=0
+        ) + 1
+        moves = [
+            (pending, numbered_name(theme, next_number + i))
+            for i, (pending, _) in enumerate(accepted)
+        ]
+        atomic_rename_all(theme_dir, moves)
+
+        for (pending, result), (_, final) in zip(accepted, moves):
+            signature = self.library.signature(theme, final)
+            state["sources"][result["sha1"]] = final
+            state["hashes"][final] = [signature, f"{result['dhash']:016x}"]
+            self.index[f"{theme}/{final}"] = BackgroundStats(
+                signature=signature,
+                brightness=result["brightness"],
+                layouts=result["layouts"],
+            )
+        return len(accepted), duplicates
+
+    def save(self) -> None:
+        if self.args.dry_run:
+            return
+        save_manifest(self.args.manifest, self.manifest)
+        save_index_cache(self.args.index, self.index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest raw background images")
+    parser.add_argument("--src", default=str(DEFAULT_SRC), help="原始圖資料夾（底下每個主題一個子資料夾）")
+    parser.add_argument("--dest", default=str(DEFAULT_DEST))
+    parser.add_argument("--index", default=str(DEFAULT_INDEX))
+    parser.add_argument("--manifest", default=str(DEFAULT_MANIFEST))
+    parser.add_argument("--theme", action="append", help="只處理指定主題（可重複）")
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--quality", type=int, default=90)
+    parser.add_argument("--workers", type=int, default=None, help="預設用全部核心")
+    parser.add_argument(
+        "--duplicate-distance", type=int, default=DEFAULT_DUPLICATE_DISTANCE,
+        help="dHash 漢明距離小於等於這個值視為重複（0 = 只擋完全相同）",
+    )
+    parser.add_argument("--renumber", action="store_true", help="匯入後把編號壓成連號")
+    parser.add_argument("--dry-run", action="store_true", help="只列出會做什麼，不寫檔")
+    args = parser.parse_args()
+
+    if args.theme:
+        themes = args.theme
+    else:
+        themes = sorted(
+            set(os.listdir(args.src) if os.path.isdir(args.src) else [])
+            | (set(os.listdir(args.dest)) if args.renumber else set())
+        )
+    themes = [
+        t for t in themes
+        if os.path.isdir(os.path.join(args.src, t)) or os.path.isdir(os.path.join(args.dest, t))
+    ]
+
+    total_added = total_dupes = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        ingester = Ingester(args, pool)
+        for theme in themes:
+            added, dupes = ingester.ingest(theme)
+            renamed = ingester.renumber(theme) if args.renumber else 0
+            if added or dupes or renamed:
+                print(f"{theme}: 新增 {added} 張、重複 {dupes} 張、重新編號 {renamed} 張")
+            total_added += added
+            total_dupes += dupes
+        ingester.save()
+
+    prefix = "（dry run）" if args.dry_run else ""
+    print(f"{prefix}完成：新增 {total_added} 張，略過重複 {total_dupes} 張")
+
+
+if __name__ == "__main__":
+    main()
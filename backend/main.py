@@ -5,7 +5,7 @@ from datetime import datetime, date
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 # ... 原有的 imports ...
 import base64
 import uuid
@@ -13,55 +13,78 @@ import sys
 from fastapi import Request, BackgroundTasks
 from fastapi.staticfiles import StaticFiles  # 記得引入這個
 
-# LINE SDK
-from linebot.v3 import WebhookHandler
-from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.messaging import (
-    Configuration,
-    ApiClient,
-    MessagingApi,
-    ReplyMessageRequest,
-    TextMessage,
-    ImageMessage
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+from services.admission import (
+    LEVEL_NORMAL,
+    PRIORITY_LINE,
+    PRIORITY_WEB,
+    AdmissionController,
+    Degradation,
+    Overloaded,
 )
-from linebot.v3.webhooks import (
-    MessageEvent,
-    TextMessageContent
+from services.compose_service import (
+    ComposeService,
+    DEFAULT_CANVAS_SIZE,
+    EASTER_EGG_THEMES,
+    MAX_CANVAS_SIDE,
+    MIN_CANVAS_SIDE,
+    STANDARD_THEMES,
+    base_theme,
+    is_supported_theme,
+)
+from services.effects import available_effects
+from services.renditions import (
+    FULL,
+    LINE_PREVIEW,
+    RENDITION_PRESETS,
+    ComposeResult,
+    RenditionSpec,
 )
-
-from services.compose_service import ComposeService
 from services.llm_service import LLMService, ElderCardText
+# LINE SDK 改成有金鑰才載入（見 services/line_bot.py）
+from services.line_bot import create_line_bot
+from services.intent_router import IntentRouter
+from services.prerender import PrerenderInventory
+from services.structured_logging import (
+    CorrelationIdMiddleware,
+    correlation_scope,
+    current_correlation_id,
+    dropped_records,
+    get_logger,
+    setup_logging,
+    shutdown_logging,
+)
 
 # 先載入 .env
 load_dotenv()
 
+# log 丟進 queue 由背景 thread 寫出，要在建立各個 service 之前設定好
+setup_logging()
+log = get_logger("app")
+
 # ===== 基本設定 =====
 
 BASE_DIR = Path(__file__).resolve().parent
 BACKGROUND_BASE_DIR = BASE_DIR / "assets" / "backgrounds"
+# build_asset_pack.py 打包好的背景圖；檔案不存在就讀資料夾
+BACKGROUND_PACK_PATH = os.getenv(
+    "BACKGROUND_PACK", str(BASE_DIR / "assets" / "backgrounds.pack")
+)
+# 多 worker 部署時設定這個路徑（例如 /dev/shm/elder_card_backgrounds.pool），
+# 背景只解碼一次放在共用記憶體，所有 worker 直接 mmap 使用
+SHARED_BACKGROUND_POOL = os.getenv("SHARED_BACKGROUND_POOL") or None
+# 每個 worker 留幾塊 Pillow 釋放的影像記憶體給下一張卡重用（每塊最多 16MB，
+# 1024x1024 的畫布一張 4MB）；0 = 不保留。各尺寸每張卡的尖峰用量見 benchmarks/bench_memory.py
+IMAGE_BUFFER_BLOCKS = int(os.getenv("IMAGE_BUFFER_BLOCKS", "4"))
 FONT_PATH = str(BASE_DIR / "assets" / "fonts" / "edukai-5.0.ttf")
 
-# 主題
-ALLOWED_THEMES = {
-    "morning",
-    "health",
-    "life",
-    "festival_newyear",
-    "festival_christmas",
-    "festival_common",
-    "festival_lantern",
-    "festival_midautumn",
-}
-
-# 排版風格（前端也會用到這組字串）
-ALLOWED_LAYOUTS = {
-    "auto",         # 交給後端隨機
-    "center",       # 經典置中
-    "top_bottom",   # 上下分佈
-    "left_block",   # 左側文字
-    "diagonal",     # 斜斜文字
-    "vertical",     # 直書標題
-}
+# 主題清單在 compose_service（STANDARD_THEMES / EASTER_EGG_THEMES，可以加 _retro 後綴），
+# LINE、網頁 API、app/ 原型都用同一份
 
 # 格式: { "user_id": timestamp }，記錄上次使用的時間
 USER_LAST_ACCESS = {}
@@ -73,23 +96,67 @@ DAILY_USAGE_STATS = {}
 COOLDOWN_SECONDS = 15  # 冷卻時間：每 15 秒才能做一張 (防連點)
 DAILY_LIMIT_PER_USER = 20  # 每日上限：每人每天只能做 20 張 (防大戶)
 
+# 同時最多合成幾張（超過就排隊，LINE 排在網頁前面）
+MAX_CONCURRENT_RENDERS = int(
+    os.getenv("MAX_CONCURRENT_RENDERS", str(os.cpu_count() or 4)))
+# 同時最多幾個 LLM 呼叫（跟合成的位子分開；排不到就改用 local 模板文案）
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv("MAX_CONCURRENT_LLM_CALLS", "16"))
+OVERLOADED_MESSAGE = "現在做長輩圖的人太多了 🙏\n機器人忙不過來，請過一兩分鐘再試一次！"
+
+# ===== 啟動 / 暖機 =====
+# process 一啟動就能回 /api/health（liveness），
+# 字型、背景清單、貼紙等快取在背景暖好之後，/api/ready 才回 200（readiness）
+
+STARTUP_STATE = {
+    "ready": False,
+    "process_start": time.perf_counter(),
+    "warmup_seconds": None,
+    "ready_seconds": None,
+}
+
+
+def warm_up() -> None:
+    start = time.perf_counter()
+    compose_service.warm_up()
+    STARTUP_STATE["warmup_seconds"] = round(time.perf_counter() - start, 3)
+    STARTUP_STATE["ready_seconds"] = round(
+        time.perf_counter() - STARTUP_STATE["process_start"], 3)
+    STARTUP_STATE["ready"] = True
+    log.info(
+        "Warm-up done",
+        extra={
+            "warmup_s": STARTUP_STATE["warmup_seconds"],
+            "ready_s": STARTUP_STATE["ready_seconds"],
+        },
+    )
+
+    # 暖機完再開始背景補庫存，不跟第一批請求搶 CPU
+    if prerender_inventory is not None:
+        prerender_inventory.start()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup_task = asyncio.create_task(run_in_threadpool(warm_up))
+    yield
+    warmup_task.cancel()
+    if prerender_inventory is not None:
+        prerender_inventory.stop()
+    shutdown_logging()
+
+
 # ===== FastAPI App =====
 
-app = FastAPI(title="Elder Card Generator API")
+app = FastAPI(title="Elder Card Generator API", lifespan=lifespan)
+app.add_middleware(CorrelationIdMiddleware)
 
 # ===== LINE Bot 設定 =====
 channel_access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
 channel_secret = os.getenv("LINE_CHANNEL_SECRET")
 app_base_url = os.getenv("APP_BASE_URL", "http://localhost:8000")
 
-# 檢查設定是否存在
-if not channel_access_token or not channel_secret:
-    print("Warning: LINE Bot keys not found in .env")
-
-configuration = Configuration(access_token=channel_access_token)
-async_api_client = ApiClient(configuration)
-line_bot_api = MessagingApi(async_api_client)
-handler = WebhookHandler(channel_secret)
+# 沒有金鑰（或沒裝 SDK）就是 None，只提供網頁 API
+line_bot = create_line_bot(channel_access_token, channel_secret)
 
 # ===== 靜態檔案設定 (解決圖片 URL 問題) =====
 # 確保 static 資料夾存在
@@ -118,10 +185,24 @@ app.add_middleware(
 compose_service = ComposeService(
     background_base_dir=str(BACKGROUND_BASE_DIR),
     font_path=FONT_PATH or None,
+    pack_path=BACKGROUND_PACK_PATH,
+    shared_pool_path=SHARED_BACKGROUND_POOL,
+    image_buffer_blocks=IMAGE_BUFFER_BLOCKS,
 )
 
+# 排版風格（前端也會用到這組字串）：auto 交給後端挑，其他來自 config/layouts.json
+ALLOWED_LAYOUTS = {"auto", *compose_service.available_layouts}
+
 llm_service = LLMService()
 
+intent_router = IntentRouter(str(BASE_DIR / "config" / "intents.json"))
+
+# 入場控管：LINE 優先、延遲超過 SLO 就分級降級（等級看 /api/metrics）
+admission = AdmissionController(
+    max_concurrent=MAX_CONCURRENT_RENDERS,
+    max_llm_calls=MAX_CONCURRENT_LLM_CALLS,
+)
+
 # ===== Pydantic Models =====
 
 
@@ -129,6 +210,15 @@ class GenerateRequest(BaseModel):
     theme: str
     # 新增 layout，預設 None，代表用 auto
     layout: str | None = None
+    # 特效名稱（snow / deep_fry / sticker ...），None 代表照主題自動決定
+    effects: list[str] | None = None
+    # 輸出尺寸，None 代表預設 1024 x 1024（預覽可以用 512 省 4 倍像素）
+    width: int | None = Field(default=None, ge=MIN_CANVAS_SIDE, le=MAX_CANVAS_SIDE)
+    height: int | None = Field(default=None, ge=MIN_CANVAS_SIDE, le=MAX_CANVAS_SIDE)
+    # 除了原圖以外，還要哪些版本（preview / thumbnail），同一次合成一起輸出
+    renditions: list[str] | None = None
+    # 固定背景 / layout / 貼紙 / 雪花（回應會帶這張卡用的 seed，之後可以重畫同一張）
+    seed: int | None = Field(default=None, ge=0)
 
 
 class ElderCardTextModel(BaseModel):
@@ -137,11 +227,53 @@ class ElderCardTextModel(BaseModel):
     footer: str
 
 
+class RenditionModel(BaseModel):
+    mime: str
+    width: int
+    height: int
+    image_base64: str
+
+
 class GenerateResponse(BaseModel):
     theme: str
     layout: str
     text: ElderCardTextModel
     image_base64: str
+    renditions: dict[str, RenditionModel] | None = None
+    seed: int | None = None
+
+
+def save_renditions(result: ComposeResult, subdir: str = "") -> dict[str, str]:
+    """
+    把同一張卡的各版本存進 static（或 static/<subdir>），回傳 { 版本名稱: 公開 URL }。
+    檔名共用同一個 uuid：xxx.png、xxx_preview.jpg ...
+    """
+    card_id = uuid.uuid4()
+    target_dir = STATIC_DIR / subdir if subdir else STATIC_DIR
+    target_dir.mkdir(parents=True, exist_ok=True)
+    url_prefix = f"{app_base_url}/static/{subdir + '/' if subdir else ''}"
+    urls = {}
+    for name, rendition in result.renditions.items():
+        suffix = "" if name == "full" else f"_{name}"
+        filename = f"{card_id}{suffix}.{rendition.extension}"
+        with open(target_dir / filename, "wb") as f:
+            f.write(rendition.data)
+        urls[name] = f"{url_prefix}{filename}"
+    return urls
+
+
+# ===== 尖峰預先產生的卡片庫存（只有 LINE 會用到） =====
+
+prerender_inventory = None
+if line_bot is not None:
+    prerender_inventory = PrerenderInventory(
+        str(BASE_DIR / "config" / "prerender.json"),
+        compose_service,
+        llm_service,
+        save=lambda result: save_renditions(result, subdir="inventory"),
+        # 即時請求已經在降級了，就先不要背景補貨
+        can_refill=lambda: admission.level == LEVEL_NORMAL,
+    )
 
 
 # ===== Routes =====
@@ -151,48 +283,165 @@ async def health_check():
     return {"status": "ok", "message": "Elder Card API is running"}
 
 
+@app.get("/api/ready")
+async def readiness_check():
+    """暖機完成前回 503，讓負載平衡器 / autoscaler 先不要導流量進來。"""
+    body = {
+        "ready": STARTUP_STATE["ready"],
+        "warmup_seconds": STARTUP_STATE["warmup_seconds"],
+        "ready_seconds": STARTUP_STATE["ready_seconds"],
+    }
+    if not STARTUP_STATE["ready"]:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 格式：降級等級、進行中的合成 / LLM 數、排隊數、被拒絕的次數。"""
+    return admission.prometheus() + (
+        "# TYPE elder_card_log_dropped_total counter\n"
+        f"elder_card_log_dropped_total {dropped_records()}\n"
+    )
+
+
 @app.get("/api/config")
 async def get_config():
     """
     給前端用的設定查詢：有哪些 theme / layout 可以選
     """
     return {
-        "themes": sorted(list(ALLOWED_THEMES)),
+        "themes": sorted(STANDARD_THEMES),
+        # 彩蛋主題也可以直接指定（LINE 是用關鍵字觸發）
+        "easter_egg_themes": sorted(EASTER_EGG_THEMES),
         "layouts": sorted(list(ALLOWED_LAYOUTS)),
+        "effects": available_effects(),
+        # animated_webp / animated_gif：聖誕（飄雪）、元宵（燈籠）會動
+        "renditions": sorted(RENDITION_PRESETS),
     }
 
 
-@app.post("/api/generate", response_model=GenerateResponse)
-async def generate_card(req: GenerateRequest):
+def validate_generate_request(req: GenerateRequest) -> list[RenditionSpec]:
+    """檢查 theme / layout / effects / renditions，回傳要輸出的版本。"""
     theme = req.theme
     layout = req.layout or "auto"
 
-    if theme not in ALLOWED_THEMES:
+    if not is_supported_theme(theme):
         raise HTTPException(status_code=400, detail=f"Unknown theme: {theme}")
 
     if layout not in ALLOWED_LAYOUTS:
         raise HTTPException(
             status_code=400, detail=f"Unknown layout: {layout}")
 
-    theme_dir = BACKGROUND_BASE_DIR / theme
-    if not theme_dir.exists():
+    if req.effects is not None:
+        unknown = [e for e in req.effects if e not in available_effects()]
+        if unknown:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown effects: {unknown}")
+
+    extra_renditions = req.renditions or []
+    unknown = [r for r in extra_renditions if r not in RENDITION_PRESETS]
+    if unknown:
         raise HTTPException(
-            status_code=400,
-            detail=f"No background directory for theme: {theme}",
+            status_code=400, detail=f"Unknown renditions: {unknown}")
+
+    return [FULL] + [
+        RENDITION_PRESETS[name] for name in extra_renditions if name != "full"
+    ]
+
+
+def rendition_models(result: ComposeResult) -> dict[str, RenditionModel] | None:
+    return {
+        name: RenditionModel(
+            mime=r.mime,
+            width=r.width,
+            height=r.height,
+            image_base64=r.to_base64(),
         )
+        for name, r in result.renditions.items()
+        if name != "full"
+    } or None
 
-    # 1) 先用 LLM 生文字
-    elder_text: ElderCardText = llm_service.generate_text(theme)
 
-    # 2) 合成圖片（layout == auto 就交給 ComposeService 自己隨機）
-    image_base64 = compose_service.compose_image(
-        theme=theme,
-        title=elder_text.title,
-        subtitle=elder_text.subtitle,
-        footer=elder_text.footer,
-        layout=None if layout == "auto" else layout,
+def generate_text(theme: str, degradation: Degradation) -> ElderCardText:
+    """
+    降級時改用 local 模板文案，不打 Gemini。
+    不佔合成的位子；LLM 自己的位子排不到也改用 local 模板。
+    """
+    if degradation.use_local_copy:
+        return llm_service.generate_text(theme, backend="local")
+    with admission.llm_call() as granted:
+        return llm_service.generate_text(theme, backend=None if granted else "local")
+
+
+def degraded_effects(
+    effects: list[str] | None, degradation: Degradation
+) -> list[str] | None:
+    # 空 list = 不套特效（None 是照主題自動決定）
+    return [] if degradation.skip_effects else effects
+
+
+def degraded_size(
+    req: GenerateRequest, degradation: Degradation
+) -> tuple[int | None, int | None]:
+    return degradation.canvas_size(req.width, req.height, DEFAULT_CANVAS_SIZE)
+
+
+def overloaded_error() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy, please try again later",
+        headers={"Retry-After": "30"},
     )
 
+
+def generate_card_sync(
+    req: GenerateRequest, specs: list[RenditionSpec]
+) -> tuple[ElderCardText, ComposeResult]:
+    """
+    整張卡（文字 + 合成）在 threadpool 跑，不卡住 event loop。
+    合成的位子只在合成時佔著，等 LLM（含額度排隊）的時候不佔。
+    """
+    if admission.is_shedding(PRIORITY_WEB):
+        raise Overloaded("server is shedding load")
+
+    # 1) 先用 LLM 生文字（額度不夠時可能會排隊幾秒）
+    # *_retro 只是換畫風，文案照原本的主題
+    elder_text = generate_text(base_theme(req.theme), admission.degradation())
+
+    # 2) 排到位子再合成圖片（layout == auto 就交給 ComposeService 自己隨機）
+    with admission.admit(PRIORITY_WEB) as ticket:
+        degradation = ticket.degradation
+        width, height = degraded_size(req, degradation)
+        layout = req.layout or "auto"
+        with admission.track("render"):
+            result = compose_service.compose_renditions(
+                theme=req.theme,
+                title=elder_text.title,
+                subtitle=elder_text.subtitle,
+                footer=elder_text.footer,
+                layout=None if layout == "auto" else layout,
+                effects=degraded_effects(req.effects, degradation),
+                width=width,
+                height=height,
+                renditions=specs,
+                seed=req.seed,
+            )
+        return elder_text, result
+
+
+@app.post("/api/generate", response_model=GenerateResponse)
+async def generate_card(req: GenerateRequest):
+    theme = req.theme
+    layout = req.layout or "auto"
+    specs = validate_generate_request(req)
+
+    try:
+        elder_text, result = await run_in_threadpool(
+            generate_card_sync, req, specs)
+    except Overloaded:
+        raise overloaded_error()
+
     return GenerateResponse(
         theme=theme,
         layout=layout,
@@ -201,7 +450,140 @@ async def generate_card(req: GenerateRequest):
             subtitle=elder_text.subtitle,
             footer=elder_text.footer,
         ),
-        image_base64=image_base64,
+        image_base64=result["full"].to_base64(),
+        renditions=rendition_models(result),
+        seed=result.seed,
+    )
+
+
+# ===== 串流版 /api/generate =====
+# 依序送出：
+#   meta    -> {"theme", "layout", "seed"}  背景和 layout 決定好就送（跟 LLM 同時進行）
+#   text    -> {"title", "subtitle", "footer"}
+#   preview -> {"mime", "width", "height", "image_base64"}  低解析度預覽
+#   image   -> {"image_base64", "renditions"}              原圖
+#   done    -> {}
+# 出錯時送 error -> {"detail"}。
+# 預設是 SSE（text/event-stream），?format=ndjson 改成一行一個 JSON。
+# 前端中途斷線時 Starlette 會取消這個 generator，還沒開始的預覽 / 原圖就不會再畫。
+
+STREAM_FORMATS = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def format_stream_event(fmt: str, event: str, data: dict) -> str:
+    if fmt == "ndjson":
+        return json.dumps({"event": event, **data}, ensure_ascii=False) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/generate/stream")
+async def generate_card_stream(req: GenerateRequest, format: str = "sse"):
+    if format not in STREAM_FORMATS:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown stream format: {format}")
+
+    theme = req.theme
+    layout = req.layout or "auto"
+    specs = validate_generate_request(req)
+
+    # 已經在拒絕網頁請求了就直接回 503；排隊逾時則在 stream 裡送 error
+    if admission.is_shedding(PRIORITY_WEB):
+        raise overloaded_error()
+
+    def render(fn, *args, **kwargs):
+        # 每一步合成各自排位子，等 LLM 的時候不佔著；
+        # 整段在同一個 thread 裡，前端斷線時跑完就會自己還位子
+        with admission.admit(PRIORITY_WEB), admission.track("render"):
+            return fn(*args, **kwargs)
+
+    async def events():
+        degradation = admission.degradation()
+        effects = degraded_effects(req.effects, degradation)
+        width, height = degraded_size(req, degradation)
+
+        # 文字和背景互不相干，同時開始
+        text_task = asyncio.create_task(
+            run_in_threadpool(generate_text, base_theme(theme), degradation))
+        plan_task = asyncio.create_task(run_in_threadpool(
+            render,
+            compose_service.plan_canvas,
+            theme,
+            layout=None if layout == "auto" else layout,
+            width=width,
+            height=height,
+            seed=req.seed,
+        ))
+        try:
+            plan = await plan_task
+            yield format_stream_event(format, "meta", {
+                "theme": theme,
+                "layout": plan.layout,
+                "seed": plan.seed,
+            })
+
+            elder_text: ElderCardText = await text_task
+            yield format_stream_event(format, "text", {
+                "title": elder_text.title,
+                "subtitle": elder_text.subtitle,
+                "footer": elder_text.footer,
+            })
+
+            preview = await run_in_threadpool(
+                render,
+                compose_service.compose_preview,
+                plan,
+                elder_text.title,
+                elder_text.subtitle,
+                elder_text.footer,
+                effects=effects,
+            )
+            yield format_stream_event(format, "preview", {
+                "mime": preview.mime,
+                "width": preview.width,
+                "height": preview.height,
+                "image_base64": preview.to_base64(),
+            })
+
+            result = await run_in_threadpool(
+                render,
+                compose_service.compose_plan,
+                plan,
+                elder_text.title,
+                elder_text.subtitle,
+                elder_text.footer,
+                effects=effects,
+                renditions=specs,
+            )
+            renditions = rendition_models(result)
+            yield format_stream_event(format, "image", {
+                "image_base64": result["full"].to_base64(),
+                "renditions": {
+                    name: r.model_dump() for name, r in renditions.items()
+                } if renditions else None,
+            })
+            yield format_stream_event(format, "done", {})
+        except Overloaded:
+            yield format_stream_event(format, "error", {
+                "detail": "Server is busy, please try again later",
+            })
+        except asyncio.CancelledError:
+            log.info("Client disconnected, cancelled card", extra={"theme": theme})
+            raise
+        except Exception as e:
+            log.exception("Failed to stream card", extra={"theme": theme})
+            yield format_stream_event(format, "error", {"detail": str(e)})
+        finally:
+            # 還在等的工作不用做了（已經在跑的 thread 跑完結果就丟掉）
+            text_task.cancel()
+            plan_task.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type=STREAM_FORMATS[format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
@@ -214,49 +596,39 @@ async def callback(request: Request):
     body = await request.body()
     body_str = body.decode("utf-8")
 
-    try:
-        # 驗證簽章並交給 handler 處理
-        handler.handle(body_str, signature)
-    except InvalidSignatureError:
+    if line_bot is None:
+        raise HTTPException(
+            status_code=503, detail="LINE Bot is not configured")
+
+    # 驗證簽章並交給 handler 處理；handler 會做 LLM + 合成，放到 threadpool 不卡住 event loop
+    if not await run_in_threadpool(line_bot.handle, body_str, signature):
         raise HTTPException(status_code=400, detail="Invalid signature")
 
     return "OK"
 
 
-@handler.add(MessageEvent, message=TextMessageContent)
-def handle_message(event: MessageEvent):
+def handle_message(event):
     """
-    當收到文字訊息時觸發
+    當收到文字訊息時觸發；一則訊息一個 correlation id（同一次 webhook 可能有好幾則）
     """
-    user_text = event.message.text
-    user_id = event.source.user_id
-
-    user_text_lower = user_text.lower()
+    with correlation_scope(f"{current_correlation_id()}/line-{event.message.id}"):
+        _handle_message(event)
 
-    # 簡單過濾：如果使用者輸入太短，可能不是要產生長輩圖，可以忽略或設為預設主題
-    # 這裡假設使用者輸入任何文字都視為 Prompt 或主題
-    # 為了簡化，我們嘗試把 user_text 當作 theme，如果不在 ALLOWED_THEMES 裡，就預設用 'life' 或 'morning'
 
-    keywords = ["健康", "生活格言", "早安", "節慶", "新年", "聖誕節",
-                "壞了", "爛", "老了", "失敗", "地獄", "負能量", "厭世", "開", "炸", "retro",
-                "bug", "code", "coding", "debug", "工程師", "程式",
-                "雪", "下雪", "躺平", "不想努力", "rebel"]
-
-    # 檢查 user_text 是否包含任一關鍵字
-    is_trigger = any(k in user_text_lower for k in keywords)
+def _handle_message(event):
+    user_text = event.message.text
+    user_id = event.source.user_id
 
-    # 或是針對你的 ALLOWED_THEMES 檢查
-    is_theme_command = user_text in ALLOWED_THEMES
+    # 關鍵字 -> 主題 / 後綴 / 強制 layout 的對應表在 config/intents.json，
+    # 觸發判斷跟主題對應用同一張表，整則訊息只掃一次
+    intent = intent_router.route(user_text)
 
-    if not (is_trigger or is_theme_command):
+    if intent is None:
         # 如果不是關鍵字，也不是指令，直接結束函式
         # 這樣就不會呼叫 llm_service，完全不消耗 Google API
-        line_bot_api.reply_message(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(
-                    text=f"關鍵字錯誤，找不到這個指令。")]
-            )
+        line_bot.reply_text(
+            event.reply_token,
+            f"關鍵字錯誤，找不到這個指令。",
         )
         return
 
@@ -267,15 +639,13 @@ def handle_message(event: MessageEvent):
     if current_time - last_time < COOLDOWN_SECONDS:
         # 如果距離上次請求還不到冷卻時間
         remaining = int(COOLDOWN_SECONDS - (current_time - last_time))
-        print(f"User {user_id} is ratelimited. Wait {remaining}s.")
+        log.info("User is rate limited",
+                 extra={"user_id": user_id, "wait_s": remaining})
 
         # 回覆使用者「太快了」，直接 return，不呼叫 Google API
-        line_bot_api.reply_message(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(
-                    text=f"製作太快囉！機器人正在喘氣 🥵\n請再等 {remaining} 秒後再試。")]
-            )
+        line_bot.reply_text(
+            event.reply_token,
+            f"製作太快囉！機器人正在喘氣 🥵\n請再等 {remaining} 秒後再試。",
         )
         return  # [重要] 直接結束，不往下執行
 
@@ -290,13 +660,10 @@ def handle_message(event: MessageEvent):
     user_today_count = DAILY_USAGE_STATS[today_str].get(user_id, 0)
 
     if user_today_count >= DAILY_LIMIT_PER_USER:
-        print(f"User {user_id} hit daily limit.")
-        line_bot_api.reply_message(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(
-                    text=f"您今天的製作額度已達上限 ({DAILY_LIMIT_PER_USER} 張) 🛑\n請明天再來玩！")]
-            )
+        log.info("User hit daily limit", extra={"user_id": user_id})
+        line_bot.reply_text(
+            event.reply_token,
+            f"您今天的製作額度已達上限 ({DAILY_LIMIT_PER_USER} 張) 🛑\n請明天再來玩！",
         )
         return  # [重要] 直接結束
 
@@ -306,92 +673,72 @@ def handle_message(event: MessageEvent):
     USER_LAST_ACCESS[user_id] = current_time
     DAILY_USAGE_STATS[today_str][user_id] = user_today_count + 1
 
-    target_theme = "life"  # 預設
-
-    # 簡單的關鍵字對應 (您可以做得更複雜)
-    if any(k in user_text for k in ["壞了", "爛", "老了", "失敗"]):
-        target_theme = "broken_egg"
-    # 2. 彩蛋 B：地獄梗
-    elif any(k in user_text for k in ["地獄", "負能量", "厭世", "煩"]):
-        target_theme = "dark_humor"
-    elif any(k in user_text.lower() for k in ["bug", "code", "coding", "debug", "工程師", "程式"]):
-        target_theme = "programmer"
-    elif any(k in user_text_lower for k in ["雪", "下雪"]):
-        target_theme = "festival_christmas"
-    elif any(k in user_text_lower for k in ["躺平", "不想努力", "rebel"]):
-        target_theme = "rebel"
-    elif "早" in user_text:
-        target_theme = "morning"
-    elif "健康" in user_text:
-        target_theme = "health"
-    elif "生活格言" in user_text:
-        target_theme = "life"
-    elif "節慶" in user_text:
-        target_theme = "festival_common"
-    elif "聖誕節" in user_text:
-        target_theme = "festival_christmas"
-    elif "新年" in user_text:
-        target_theme = "festival_newyear"
-
-    if any(k in user_text for k in ["開", "炸", "retro"]):
-        target_theme += "_retro"
-
-    clean_theme = target_theme.replace("_retro", "")
-
-    # [重要] 這裡要放行特殊彩蛋主題，避免被 ALLOWED_THEMES 擋住
-    # 如果 target_theme 是彩蛋，我們就不檢查 ALLOWED_THEMES
-    if target_theme not in ["broken_egg", "dark_humor"] and target_theme not in ALLOWED_THEMES:
-        # 如果不是彩蛋，也不是允許的主題，才做過濾 (原本的邏輯)
-        pass
-
     try:
-        # 1. 呼叫 LLM 服務 (同步呼叫)
-        elder_text = llm_service.generate_text(clean_theme)
-
-        forced_layout = "center" if target_theme == "dark_humor" else "auto"
-
-        # 2. 呼叫合成服務 (layout 自動)
-        image_base64 = compose_service.compose_image(
-            theme=target_theme,
-            title=elder_text.title,
-            subtitle=elder_text.subtitle,
-            footer=elder_text.footer,
-            layout=forced_layout
-        )
-
-        # 3. 將 Base64 轉存為實體檔案
-        # 產生唯一檔名，避免快取或衝突
-        filename = f"{uuid.uuid4()}.png"
-        file_path = STATIC_DIR / filename
-
-        # 解碼並寫入
-        image_data = base64.b64decode(image_base64)
-        with open(file_path, "wb") as f:
-            f.write(image_data)
+        # 0. 尖峰時段先從預先做好的庫存拿一張（保證不會跟他之前收過的重複）
+        #    不用合成，所以也不用排隊
+        if prerender_inventory is not None:
+            card = prerender_inventory.take(intent.theme, intent.layout, user_id)
+            if card is not None:
+                log.info("Served pre-rendered card",
+                         extra={"user_id": user_id, "url": card.urls["full"]})
+                line_bot.reply_image(
+                    event.reply_token, card.urls["full"], card.urls["preview"])
+                return
+
+        # 1. 呼叫 LLM 服務 (同步呼叫；降級時用 local 模板)，這時還不佔合成的位子
+        elder_text = generate_text(intent.base_theme, admission.degradation())
+
+        # 排隊拿合成的位子（LINE 優先）；太忙就回友善的訊息，並退回今天的額度
+        try:
+            ticket = admission.acquire(PRIORITY_LINE)
+        except Overloaded:
+            log.warning("Shed LINE request: server overloaded",
+                        extra={"user_id": user_id})
+            DAILY_USAGE_STATS[today_str][user_id] = user_today_count
+            USER_LAST_ACCESS.pop(user_id, None)
+            line_bot.reply_text(event.reply_token, OVERLOADED_MESSAGE)
+            return
+
+        try:
+            degradation = ticket.degradation
+
+            # 2. 呼叫合成服務 (layout 自動或由關鍵字表強制)，原圖跟 LINE 預覽圖一次輸出
+            width, height = degradation.canvas_size(None, None, DEFAULT_CANVAS_SIZE)
+            with admission.track("render"):
+                result = compose_service.compose_renditions(
+                    theme=intent.theme,
+                    title=elder_text.title,
+                    subtitle=elder_text.subtitle,
+                    footer=elder_text.footer,
+                    layout=intent.layout,
+                    effects=degraded_effects(None, degradation),
+                    width=width,
+                    height=height,
+                    renditions=[FULL, LINE_PREVIEW],
+                )
+        finally:
+            admission.release(ticket)
 
-        # 4. 組建公開 URL
+        # 3. 存成實體檔案並組建公開 URL
         # 注意：LINE 要求必須是 HTTPS (除了 localhost 開發用 ngrok)
-        image_url = f"{app_base_url}/static/{filename}"
-        print(f"Generated Image URL: {image_url}")
+        urls = save_renditions(result)
+        image_url = urls["full"]
+        log.info("Generated image", extra={"user_id": user_id, "url": image_url})
 
         # 5. 回覆圖片訊息 (使用 Reply API)
-        reply_request = ReplyMessageRequest(
-            reply_token=event.reply_token,
-            messages=[
-                ImageMessage(
-                    original_content_url=image_url,
-                    preview_image_url=image_url
-                )
-            ]
-        )
-        line_bot_api.reply_message(reply_request)
+        line_bot.reply_image(event.reply_token, image_url, urls["preview"])
+
+        if prerender_inventory is not None:
+            prerender_inventory.mark_sent(user_id, intent.theme, elder_text)
 
     except Exception as e:
-        print(f"Error handling LINE message: {e}")
+        log.exception("Error handling LINE message", extra={"user_id": user_id})
         # 出錯時回傳文字告知
-        line_bot_api.reply_message(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(text="抱歉，長輩圖產生失敗，請稍後再試。")]
-            )
+        line_bot.reply_text(
+            event.reply_token,
+            "抱歉，長輩圖產生失敗，請稍後再試。",
         )
+
+
+if line_bot is not None:
+    line_bot.on_text_message(handle_message)
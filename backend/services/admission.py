@@ -0,0 +1,311 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterator, List, Tuple
+
+from .structured_logging import get_logger
+
+log = get_logger("admission")
+
+
+# ===== 入場控管 + 分級降級 =====
+#
+# LINE 和網頁 API 共用同一批 CPU，流量一大就一起變慢。這裡：
+# - 限制同時在合成的張數，排隊時 LINE（reply token 會過期）永遠排在網頁前面
+# - 記錄最近的處理時間，超過 SLO 就一級一級降級，恢復了再一級一級升回來：
+#     0 正常
+#     1 文案改用 local 模板，不呼叫 Gemini
+#     2 + 不套特效
+#     3 + 降低解析度
+#     4 + 網頁請求直接拒絕；LINE 排不到位子就回一句友善的訊息
+# - 位子只在合成的時候佔著；LLM 呼叫另外限量（llm_call），等 Gemini / 額度的時候
+#   不會把合成的位子（預設 = CPU 數）全部卡住
+# - 目前等級、進行中的合成 / LLM 數量透過 metrics() 輸出（/api/metrics）
+
+PRIORITY_LINE = 0
+PRIORITY_WEB = 1
+PRIORITY_NAMES = {PRIORITY_LINE: "line", PRIORITY_WEB: "web"}
+
+LEVEL_NORMAL = 0
+LEVEL_TEMPLATE_COPY = 1
+LEVEL_NO_EFFECTS = 2
+LEVEL_LOW_RES = 3
+LEVEL_SHED = 4
+LEVEL_NAMES = {
+    LEVEL_NORMAL: "normal",
+    LEVEL_TEMPLATE_COPY: "template_copy",
+    LEVEL_NO_EFFECTS: "no_effects",
+    LEVEL_LOW_RES: "low_res",
+    LEVEL_SHED: "shed",
+}
+
+# 降到 LEVEL_LOW_RES 之後的最長邊
+LOW_RES_MAX_SIDE = 640
+
+# 各優先序的延遲目標（p95，秒）；LINE 的 reply token 大約一分鐘就失效
+DEFAULT_SLO_SECONDS = {PRIORITY_LINE: 6.0, PRIORITY_WEB: 10.0}
+# 最多排隊等多久
+DEFAULT_QUEUE_TIMEOUT = {PRIORITY_LINE: 8.0, PRIORITY_WEB: 5.0}
+# LLM 同時呼叫數（大多在等網路，可以比合成的位子多），排不到就改用 local 模板
+DEFAULT_MAX_LLM_CALLS = 16
+DEFAULT_LLM_QUEUE_TIMEOUT = 3.0
+
+LATENCY_WINDOW_SECONDS = 30.0
+# 至少要有這麼多筆樣本才調整等級
+MIN_SAMPLES = 5
+# 降級 / 升級之間至少間隔幾秒，避免來回跳
+STEP_DOWN_INTERVAL = 5.0
+STEP_UP_INTERVAL = 15.0
+# p95 低於 SLO 的這個比例才開始恢復
+RECOVERY_RATIO = 0.6
+
+
+class Overloaded(Exception):
+    """系統過載，這個請求被拒絕（網頁回 503、LINE 回友善訊息）。"""
+
+
+@dataclass(frozen=True)
+class Degradation:
+    level: int
+    use_local_copy: bool
+    skip_effects: bool
+    max_side: int | None
+
+    @property
+    def name(self) -> str:
+        return LEVEL_NAMES[self.level]
+
+    def canvas_size(
+        self, width: int | None, height: int | None, default: Tuple[int, int]
+    ) -> Tuple[int | None, int | None]:
+        """依降級等級縮小輸出尺寸（等比例），沒降級就原樣回傳。"""
+        if self.max_side is None:
+            return width, height
+        w, h = width or default[0], height or default[1]
+        ratio = self.max_side / max(w, h)
+        if ratio >= 1:
+            return width, height
+        return max(1, int(w * ratio)), max(1, int(h * ratio))
+
+
+def degradation_for(level: int) -> Degradation:
+    return Degradation(
+        level=level,
+        use_local_copy=level >= LEVEL_TEMPLATE_COPY,
+        skip_effects=level >= LEVEL_NO_EFFECTS,
+        max_side=LOW_RES_MAX_SIDE if level >= LEVEL_LOW_RES else None,
+    )
+
+
+@dataclass
+class Ticket:
+    priority: int
+    degradation: Degradation
+    started: float
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrent: int = 4,
+        slo_seconds: Dict[int, float] | None = None,
+        queue_timeout: Dict[int, float] | None = None,
+        max_llm_calls: int = DEFAULT_MAX_LLM_CALLS,
+        llm_queue_timeout: float = DEFAULT_LLM_QUEUE_TIMEOUT,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_llm_calls = max_llm_calls
+        self.llm_queue_timeout = llm_queue_timeout
+        self._llm_slots = threading.BoundedSemaphore(max_llm_calls)
+        self.slo_seconds = slo_seconds or DEFAULT_SLO_SECONDS
+        self.queue_timeout = queue_timeout or DEFAULT_QUEUE_TIMEOUT
+
+        self._cond = threading.Condition()
+        self._active = 0
+        # (priority, 序號)：heap 頂端是下一個可以進場的人
+        self._waiting: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+
+        self.level = LEVEL_NORMAL
+        self._last_change = 0.0
+        # (完成時間, 花費秒數, priority)
+        self._latencies: Deque[Tuple[float, float, int]] = deque()
+
+        self._in_flight: Dict[str, int] = {"render": 0, "llm": 0}
+        self._counters: Dict[str, int] = {
+            "admitted_line": 0,
+            "admitted_web": 0,
+            "shed_line": 0,
+            "shed_web": 0,
+            "llm_saturated": 0,
+        }
+
+    # ===== 進場 / 離場 =====
+
+    def acquire(self, priority: int) -> Ticket:
+        """
+        排隊拿一個合成的位子；位子空出來時 priority 小的先拿。
+        過載等級到 LEVEL_SHED 時網頁請求直接拒絕，排太久也會拒絕（raise Overloaded）。
+        """
+        name = PRIORITY_NAMES[priority]
+        start = time.monotonic()
+        with self._cond:
+            # 在拒絕請求時不會有新樣本進來，進場時也要檢查一下能不能恢復
+            self._adjust_level(start)
+            if self.is_shedding(priority):
+                self._counters[f"shed_{name}"] += 1
+                raise Overloaded("server is shedding load")
+
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiting, entry)
+            deadline = start + self.queue_timeout[priority]
+            try:
+                while not (
+                    self._active < self.max_concurrent and self._waiting[0] == entry
+                ):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters[f"shed_{name}"] += 1
+                        # 排到逾時也算一次超過 SLO 的樣本
+                        self._record(priority, time.monotonic() - start)
+                        raise Overloaded("timed out waiting for a render slot")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                # 可能輪到下一個人了
+                self._cond.notify_all()
+
+            self._active += 1
+            self._counters[f"admitted_{name}"] += 1
+            return Ticket(
+                priority=priority,
+                degradation=degradation_for(self.level),
+                started=start,
+            )
+
+    def is_shedding(self, priority: int) -> bool:
+        """這個優先序現在是不是直接拒絕（LINE 永遠會排隊試試看）。"""
+        return self.level >= LEVEL_SHED and priority != PRIORITY_LINE
+
+    def release(self, ticket: Ticket) -> None:
+        with self._cond:
+            self._active -= 1
+            self._record(ticket.priority, time.monotonic() - ticket.started)
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, priority: int) -> Iterator[Ticket]:
+        ticket = self.acquire(priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @contextmanager
+    def track(self, kind: str) -> Iterator[None]:
+        """記錄進行中的工作數（"render" / "llm"），給 metrics 用。"""
+        with self._cond:
+            self._in_flight[kind] = self._in_flight.get(kind, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight[kind] -= 1
+
+    @contextmanager
+    def llm_call(self) -> Iterator[bool]:
+        """
+        拿一個 LLM 呼叫的位子（跟合成的位子分開算）。
+        llm_queue_timeout 內拿不到就 yield False，呼叫端改用 local 模板，不要一直等。
+        """
+        if not self._llm_slots.acquire(timeout=self.llm_queue_timeout):
+            with self._cond:
+                self._counters["llm_saturated"] += 1
+            yield False
+            return
+        try:
+            with self.track("llm"):
+                yield True
+        finally:
+            self._llm_slots.release()
+
+    # ===== 降級等級 =====
+
+    def _record(self, priority: int, seconds: float) -> None:
+        """呼叫時要持有 self._cond。"""
+        now = time.monotonic()
+        self._latencies.append((now, seconds, priority))
+        self._adjust_level(now)
+
+    def _pressure(self) -> float | None:
+        """最近各優先序 p95 / SLO 的最大值；樣本不夠回傳 None。"""
+        worst = None
+        for priority, slo in self.slo_seconds.items():
+            samples = sorted(s for _, s, p in self._latencies if p == priority)
+            if len(samples) < MIN_SAMPLES:
+                continue
+            p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+            ratio = p95 / slo
+            worst = ratio if worst is None else max(worst, ratio)
+        return worst
+
+    def _adjust_level(self, now: float) -> None:
+        while self._latencies and now - self._latencies[0][0] > LATENCY_WINDOW_SECONDS:
+            self._latencies.popleft()
+        pressure = self._pressure()
+        if pressure is not None and pressure > 1.0 and self.level < LEVEL_SHED:
+            if now - self._last_change >= STEP_DOWN_INTERVAL:
+                self._set_level(self.level + 1, now, pressure)
+        # 樣本不夠（例如網頁請求都被拒絕了）也當作壓力已經下來，慢慢升回去
+        elif (pressure is None or pressure < RECOVERY_RATIO) and self.level > LEVEL_NORMAL:
+            if now - self._last_change >= STEP_UP_INTERVAL:
+                self._set_level(self.level - 1, now, pressure)
+
+    def _set_level(self, level: int, now: float, pressure: float | None) -> None:
+        log.warning(
+            "Degradation level changed",
+            extra={
+                "degradation_from": LEVEL_NAMES[self.level],
+                "degradation_to": LEVEL_NAMES[level],
+                "degradation_level": level,
+                # None = 最近沒有負載樣本
+                "pressure": round(pressure, 2) if pressure is not None else None,
+            },
+        )
+        self.level = level
+        self._last_change = now
+        # 換等級之後重新累積樣本，不要被舊的延遲拖著一路降到底
+        self._latencies.clear()
+
+    def degradation(self) -> Degradation:
+        return degradation_for(self.level)
+
+    # ===== metrics =====
+
+    def metrics(self) -> Dict[str, float]:
+        with self._cond:
+            self._adjust_level(time.monotonic())
+            return {
+                "degradation_level": self.level,
+                "in_flight_renders": self._in_flight.get("render", 0),
+                "in_flight_llm_calls": self._in_flight.get("llm", 0),
+                "active_slots": self._active,
+                "max_slots": self.max_concurrent,
+                "max_llm_calls": self.max_llm_calls,
+                "queued": len(self._waiting),
+                **{f"{k}_total": v for k, v in self._counters.items()},
+            }
+
+    def prometheus(self, prefix: str = "elder_card") -> str:
+        """Prometheus text format，給 /api/metrics 用。"""
+        lines = []
+        for key, value in self.metrics().items():
+            kind = "counter" if key.endswith("_total") else "gauge"
+            lines.append(f"# TYPE {prefix}_{key} {kind}")
+            lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
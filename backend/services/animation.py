@@ -0,0 +1,279 @@
+import io
+import math
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+from .renditions import Rendition, RenditionSpec
+from .structured_logging import get_logger, log_duration
+
+log = get_logger("animation")
+
+
+# ===== 會動的長輩圖（飄雪 / 燈籠） =====
+#
+# 背景 + 描邊文字只畫一次（ComposeService.draw_canvas 的結果），每一格只在上面疊粒子：
+# - snow：雪花往下飄、左右微微擺動
+# - lantern：暖色光暈忽明忽暗 + 小亮點閃爍
+# 所有粒子在每一格的位置 / 亮度一次用 numpy 算完（N 顆 x F 格），
+# 一圈剛好接回第一格，可以無縫循環。
+#
+# 編碼：
+# - WebP：libwebp 的動畫編碼器會自己找每格跟上一格不同的區塊（sub-frame + blending）
+# - GIF：先用第一格做一個共用調色盤，之後每格用同一個調色盤，
+#   Pillow 的 optimize 會把沒變的像素換成透明、裁成變動範圍（disposal=1 保留上一格）
+
+ANIMATIONS = ("snow", "lantern")
+
+FRAME_COUNT = 16
+FRAME_DURATION_MS = 100
+
+# 以 1024 x 1024 為準的粒子數量 / 大小，其他尺寸依面積 / 邊長縮放
+SNOW_FLAKES = 150
+SNOW_DIAMETER = (3, 8)
+SNOW_ALPHA = (150, 230)
+SNOW_SWAY = 10
+SNOW_COLOR = (255, 255, 255)
+
+LANTERN_GLOWS = 6
+LANTERN_RADIUS = 120
+LANTERN_COLOR = (255, 150, 50)
+LANTERN_SPARKLES = 40
+SPARKLE_COLOR = (255, 236, 180)
+
+
+def animation_for(theme: str, effects: List[str]) -> str | None:
+    """這張卡要用哪一種動畫；沒有適合的就回傳 None（輸出靜態圖）。"""
+    if "lantern" in theme:
+        return "lantern"
+    if "snow" in effects:
+        return "snow"
+    return None
+
+
+# ===== 粒子 =====
+
+def _disc_offsets(diameter: int) -> np.ndarray:
+    """直徑 diameter 的實心圓，回傳 (k, 2) 的 (dy, dx)。"""
+    r = diameter / 2
+    grid = np.arange(diameter) - (diameter - 1) / 2
+    dy, dx = np.meshgrid(grid, grid, indexing="ij")
+    mask = dy * dy + dx * dx <= r * r
+    offsets = np.stack([dy[mask], dx[mask]], axis=1)
+    return np.round(offsets - offsets.min(axis=0)).astype(np.int32)
+
+
+def _stamp(
+    alpha: np.ndarray,
+    ys: np.ndarray,
+    xs: np.ndarray,
+    values: np.ndarray,
+    sizes: np.ndarray,
+) -> None:
+    """
+    把粒子一次蓋到 alpha (F, H, W) 上。ys / xs / values 是 (N, F)，sizes 是 (N,)。
+    超出邊界的會從另一邊繞回來（循環動畫的雪花才不會突然消失）。
+    """
+    frames, height, width = alpha.shape
+    flat = alpha.reshape(-1)
+    frame_base = (np.arange(frames, dtype=np.int64) * height * width)[None, :]
+    for size in np.unique(sizes):
+        pick = sizes == size
+        offsets = _disc_offsets(int(size))
+        # (n, F, k)
+        yy = (ys[pick][:, :, None] + offsets[None, None, :, 0]) % height
+        xx = (xs[pick][:, :, None] + offsets[None, None, :, 1]) % width
+        index = frame_base[:, :, None] + yy.astype(np.int64) * width + xx
+        value = np.broadcast_to(values[pick][:, :, None], index.shape)
+        # 重疊的地方取較亮的（maximum.at 比 python 迴圈快很多，數量也不大）
+        np.maximum.at(flat, index.ravel(), value.ravel())
+
+
+def _snow_alpha(rng: np.random.Generator, frames: int, height: int, width: int) -> np.ndarray:
+    scale = min(width, height) / 1024
+    count = max(10, int(SNOW_FLAKES * width * height / (1024 * 1024)))
+    t = np.arange(frames) / frames
+
+    x0 = rng.uniform(0, width, count)
+    y0 = rng.uniform(0, height, count)
+    lo, hi = SNOW_DIAMETER
+    sizes = np.maximum(1, np.round(rng.integers(lo, hi + 1, count) * scale)).astype(np.int32)
+    opacity = rng.integers(SNOW_ALPHA[0], SNOW_ALPHA[1] + 1, count)
+    # 大顆（近）的掉兩個畫面高，小顆（遠）的掉一個，一圈剛好回到原位
+    laps = np.where(sizes >= np.median(sizes), 2, 1)
+    phase = rng.uniform(0, 2 * math.pi, count)
+
+    ys = y0[:, None] + laps[:, None] * height * t[None, :]
+    xs = x0[:, None] + SNOW_SWAY * scale * np.sin(2 * math.pi * t[None, :] + phase[:, None])
+    values = np.broadcast_to(opacity[:, None], ys.shape).astype(np.uint8)
+
+    alpha = np.zeros((frames, height, width), dtype=np.uint8)
+    _stamp(alpha, ys.astype(np.int64), xs.astype(np.int64), values, sizes)
+    return alpha
+
+
+def _sparkle_alpha(rng: np.random.Generator, frames: int, height: int, width: int) -> np.ndarray:
+    scale = min(width, height) / 1024
+    count = max(6, int(LANTERN_SPARKLES * width * height / (1024 * 1024)))
+    t = np.arange(frames) / frames
+
+    xs = np.repeat(rng.integers(0, width, count)[:, None], frames, axis=1)
+    ys = np.repeat(rng.integers(0, height, count)[:, None], frames, axis=1)
+    sizes = np.maximum(2, np.round(rng.integers(3, 7, count) * scale)).astype(np.int32)
+    # 每顆用整數倍的頻率閃爍，一圈剛好接回來
+    speed = rng.integers(1, 3, count)
+    phase = rng.uniform(0, 2 * math.pi, count)
+    wave = np.sin(2 * math.pi * speed[:, None] * t[None, :] + phase[:, None])
+    values = (np.clip(wave, 0, 1) ** 3 * 255).astype(np.uint8)
+
+    alpha = np.zeros((frames, height, width), dtype=np.uint8)
+    _stamp(alpha, ys, xs, values, sizes)
+    return alpha
+
+
+def _glow_layers(rng: np.random.Generator, frames: int, height: int, width: int):
+    """燈籠光暈：回傳 [(y0, x0, 光暈形狀 (h, w) float32, 每格亮度 (F,))]。"""
+    scale = min(width, height) / 1024
+    radius = max(8, int(LANTERN_RADIUS * scale))
+    t = np.arange(frames) / frames
+    glows = []
+    for _ in range(LANTERN_GLOWS):
+        # 燈籠大多掛在畫面上緣和兩側
+        cx = int(rng.uniform(0, width))
+        cy = int(rng.uniform(0, height * 0.45))
+        r = int(radius * rng.uniform(0.6, 1.2))
+        y0, y1 = max(0, cy - r), min(height, cy + r)
+        x0, x1 = max(0, cx - r), min(width, cx + r)
+        yy, xx = np.mgrid[y0:y1, x0:x1]
+        dist2 = ((yy - cy) ** 2 + (xx - cx) ** 2) / float(r * r)
+        shape = np.exp(-3.0 * dist2).astype(np.float32)
+        # 兩個不同頻率的波疊起來，看起來像燭火在晃
+        p1, p2 = rng.uniform(0, 2 * math.pi, 2)
+        m1, m2 = rng.integers(1, 3), rng.integers(3, 6)
+        level = (
+            0.55
+            + 0.25 * np.sin(2 * math.pi * m1 * t + p1)
+            + 0.15 * np.sin(2 * math.pi * m2 * t + p2)
+        ).astype(np.float32)
+        glows.append((y0, x0, shape, level))
+    return glows
+
+
+# ===== 合成每一格 =====
+
+def render_frames(
+    base: Image.Image,
+    kind: str,
+    frames: int = FRAME_COUNT,
+    seed: int | None = None,
+) -> List[Image.Image]:
+    """在同一張 base（RGB，已經畫好字）上疊粒子，回傳每一格。"""
+    if kind not in ANIMATIONS:
+        raise ValueError(f"Unknown animation: {kind}")
+    rng = np.random.default_rng(seed)
+    if base.mode != "RGB":
+        base = base.convert("RGB")
+    width, height = base.size
+    base_arr = np.asarray(base, dtype=np.int16)
+
+    if kind == "snow":
+        alpha = _snow_alpha(rng, frames, height, width)
+        color = SNOW_COLOR
+        glows = []
+    else:
+        alpha = _sparkle_alpha(rng, frames, height, width)
+        color = SPARKLE_COLOR
+        glows = _glow_layers(rng, frames, height, width)
+
+    color_arr = np.array(color, dtype=np.int16)
+    diff = color_arr - base_arr
+    out: List[Image.Image] = []
+    for f in range(frames):
+        a = alpha[f]
+        # 只算有粒子的列，其他地方直接用 base
+        frame = base_arr.copy()
+        rows = np.flatnonzero(a.any(axis=1))
+        if rows.size:
+            r0, r1 = rows[0], rows[-1] + 1
+            frame[r0:r1] += (diff[r0:r1] * a[r0:r1, :, None].astype(np.int16) + 127) // 255
+        for y0, x0, shape, level in glows:
+            h, w = shape.shape
+            add = shape[:, :, None] * (level[f] * np.array(LANTERN_COLOR, dtype=np.float32))
+            frame[y0:y0 + h, x0:x0 + w] += (add * 0.6).astype(np.int16)
+        np.clip(frame, 0, 255, out=frame)
+        out.append(Image.fromarray(frame.astype(np.uint8)))
+    return out
+
+
+# ===== 編碼 =====
+
+def _encode_gif(frames: List[Image.Image], duration: int) -> bytes:
+    # 共用一個調色盤：靜態的部分每格都是同樣的 index，delta 才會小
+    first = frames[0].quantize(colors=255, method=Image.Quantize.MEDIANCUT)
+    paletted = [first] + [
+        f.quantize(palette=first, dither=Image.Dither.NONE) for f in frames[1:]
+    ]
+    buffer = io.BytesIO()
+    paletted[0].save(
+        buffer,
+        format="GIF",
+        save_all=True,
+        append_images=paletted[1:],
+        duration=duration,
+        loop=0,
+        disposal=1,
+        optimize=True,
+    )
+    return buffer.getvalue()
+
+
+def _encode_webp(frames: List[Image.Image], duration: int, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    frames[0].save(
+        buffer,
+        format="WEBP",
+        save_all=True,
+        append_images=frames[1:],
+        duration=duration,
+        loop=0,
+        quality=quality,
+        method=4,
+        # 只有粒子在動，讓編碼器挑 lossless / lossy 混用的小區塊
+        allow_mixed=True,
+    )
+    return buffer.getvalue()
+
+
+def encode_animation(
+    canvas: Image.Image,
+    kind: str,
+    spec: RenditionSpec,
+    seed: int | None = None,
+) -> Rendition:
+    """先縮到 spec 的尺寸再疊粒子（小圖省很多），輸出 WebP / GIF 動畫。"""
+    base = canvas
+    if spec.max_side and max(canvas.size) > spec.max_side:
+        ratio = spec.max_side / max(canvas.size)
+        size = (
+            max(1, round(canvas.width * ratio)),
+            max(1, round(canvas.height * ratio)),
+        )
+        base = canvas.resize(size, Image.LANCZOS, reducing_gap=2.0)
+
+    fmt = spec.format.upper()
+    with log_duration(log, "Encoded animation", kind=kind, format=fmt):
+        frames = render_frames(base, kind, seed=seed)
+        if fmt == "GIF":
+            data = _encode_gif(frames, FRAME_DURATION_MS)
+        elif fmt == "WEBP":
+            data = _encode_webp(frames, FRAME_DURATION_MS, spec.quality)
+        else:
+            raise ValueError(f"Animated output must be GIF or WEBP, got {fmt}")
+    return Rendition(
+        name=spec.name,
+        width=base.width,
+        height=base.height,
+        format=fmt,
+        data=data,
+    )
@@ -0,0 +1,121 @@
+import io
+import json
+import mmap
+import os
+import struct
+from typing import Dict, Iterable, List, Tuple
+
+from PIL import Image
+
+
+# ===== 背景圖打包格式 =====
+#
+# 幾百張小 JPEG 分散在好幾個資料夾，每次請求都要列目錄 + 開檔。
+# 打包成一個檔案後，啟動時 mmap 一次，之後直接從記憶體解碼。
+#
+# 檔案格式（數字都是 little-endian）：
+#   MAGIC (8 bytes) | index 長度 (uint64) | index JSON (utf-8) | 圖片資料 ...
+#
+# index JSON：
+#   {"version": 1, "themes": {"morning": [["morning_01.jpg", offset, length], ...]}}
+# offset 是從資料區開頭（header + index 之後，對齊 16 bytes）算起。
+
+PACK_MAGIC = b"ECPACK01"
+PACK_VERSION = 1
+_HEADER = struct.Struct("<8sQ")
+
+# 資料區塊對齊，讓每張圖都從整齊的位置開始
+_ALIGN = 16
+
+
+def _align(n: int) -> int:
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def write_pack(
+    out_path: str,
+    themes: Dict[str, List[Tuple[str, bytes]]],
+) -> None:
+    """
+    把 {theme: [(檔名, 檔案內容), ...]} 寫成一個 pack 檔。
+    先寫到暫存檔再 rename，避免服務讀到寫一半的檔案。
+    """
+    offset = 0
+    index_themes: Dict[str, list] = {}
+    for theme, items in themes.items():
+        entries = []
+        for name, data in items:
+            entries.append([name, offset, len(data)])
+            offset = _align(offset + len(data))
+        index_themes[theme] = entries
+
+    raw = json.dumps(
+        {"version": PACK_VERSION, "themes": index_themes},
+        ensure_ascii=False,
+    ).encode("utf-8")
+    data_start = _align(_HEADER.size + len(raw))
+
+    tmp_path = f"{out_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(PACK_MAGIC, len(raw)))
+        f.write(raw)
+        f.write(b"\0" * (data_start - f.tell()))
+        for items in themes.values():
+            for _, data in items:
+                f.write(data)
+                f.write(b"\0" * (_align(f.tell()) - f.tell()))
+    os.replace(tmp_path, out_path)
+
+
+class AssetPack:
+    """唯讀的背景圖 pack，整個檔案 mmap 進來，依 theme 取圖。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, index_len = _HEADER.unpack_from(self._mm, 0)
+        if magic != PACK_MAGIC:
+            raise ValueError(f"Not an asset pack: {path}")
+
+        index = json.loads(
+            self._mm[_HEADER.size:_HEADER.size + index_len].decode("utf-8")
+        )
+        if index.get("version") != PACK_VERSION:
+            raise ValueError(f"Unsupported asset pack version: {index.get('version')}")
+
+        # theme -> {name: (絕對 offset, length)}，保留原本順序
+        data_start = _align(_HEADER.size + index_len)
+        self._themes: Dict[str, Dict[str, Tuple[int, int]]] = {
+            theme: {
+                name: (data_start + offset, length)
+                for name, offset, length in entries
+            }
+            for theme, entries in index["themes"].items()
+        }
+        self._names: Dict[str, List[str]] = {
+            theme: list(entries.keys()) for theme, entries in self._themes.items()
+        }
+
+    def themes(self) -> Iterable[str]:
+        return self._themes.keys()
+
+    def names(self, theme: str) -> List[str]:
+        return self._names.get(theme, [])
+
+    def length(self, theme: str, name: str) -> int:
+        return self._themes[theme][name][1]
+
+    def read(self, theme: str, name: str) -> memoryview:
+        """回傳該圖在 mmap 裡的 memoryview，不會複製資料。"""
+        offset, length = self._themes[theme][name]
+        return memoryview(self._mm)[offset:offset + length]
+
+    def open_image(self, theme: str, name: str) -> Image.Image:
+        # BytesIO 只複製壓縮後的幾十 KB，解碼直接吃記憶體，不經過檔案系統
+        return Image.open(io.BytesIO(self.read(theme, name)))
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
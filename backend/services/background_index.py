@@ -0,0 +1,182 @@
+import json
+import os
+import random
+import threading
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageOps
+
+from .background_library import BackgroundLibrary
+from .graphics_utils import LAYOUT_REGIONS, estimate_brightness, layout_scores
+from .structured_logging import get_logger
+
+log = get_logger("background_index")
+
+
+# ===== 背景分析索引 =====
+#
+# 每張背景事先算好：整體亮度、每個 layout 文字區域的複雜度。
+# 依 (theme, layout) 把「文字區最乾淨」的那一批背景先分好桶，
+# 使用者指定 layout 時直接從桶裡隨機挑，每次請求 O(1)。
+#
+# 結果存在 JSON 快取檔，背景沒變就不用重算：
+#   {"version": 1, "regions": {...}, "entries": {"morning/morning_01.jpg":
+#       {"signature": "...", "brightness": 153.2, "layouts": {"center": 31.5, ...}}}}
+# regions（layouts.json 的文字區）改過的話整份快取作廢。
+
+INDEX_VERSION = 1
+
+# 分析用的縮圖大小，複雜度排名跟原圖差不多，但快很多
+ANALYSIS_SIZE = (256, 256)
+
+# 每個 (theme, layout) 取複雜度最低的前 30% 當候選
+BEST_FRACTION = 0.3
+
+
+def _regions_json() -> Dict[str, List[List[float]]]:
+    return {k: [list(box) for box in v] for k, v in LAYOUT_REGIONS.items()}
+
+
+@dataclass
+class BackgroundStats:
+    signature: str
+    brightness: float
+    layouts: Dict[str, float]
+
+
+def analyze_image(img: Image.Image) -> Tuple[float, Dict[str, float]]:
+    """回傳 (亮度, {layout: 複雜度})。"""
+    small = ImageOps.fit(img.convert("RGB"), ANALYSIS_SIZE)
+    return (
+        estimate_brightness(small),
+        layout_scores(small, list(LAYOUT_REGIONS.keys())),
+    )
+
+
+def load_index_cache(cache_path: str | None) -> Dict[str, BackgroundStats]:
+    """讀分析快取，key 是 "theme/檔名"；沒有或格式不對就回空的。"""
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != INDEX_VERSION:
+            return {}
+        # layouts.json 的文字區改過，之前算的複雜度就不準了
+        if data.get("regions") != _regions_json():
+            return {}
+        return {
+            key: BackgroundStats(**value)
+            for key, value in data.get("entries", {}).items()
+        }
+    except Exception as e:
+        log.warning("Ignoring broken background index cache", extra={"error": str(e)})
+        return {}
+
+
+def save_index_cache(cache_path: str | None, stats: Dict[str, BackgroundStats]) -> None:
+    if not cache_path:
+        return
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": INDEX_VERSION,
+                "regions": _regions_json(),
+                "entries": {k: asdict(v) for k, v in stats.items()},
+            },
+            f,
+            ensure_ascii=False,
+        )
+    os.replace(tmp_path, cache_path)
+
+
+class BackgroundIndex:
+    def __init__(self, library: BackgroundLibrary, cache_path: str | None = None):
+        self.library = library
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._stats: Dict[str, BackgroundStats] = {}
+        # (theme, layout) -> 候選檔名
+        self._buckets: Dict[Tuple[str, str], List[str]] = {}
+        self.ready = False
+
+    # ===== 建索引 =====
+
+    def _analyze(self, theme: str, name: str, signature: str) -> BackgroundStats:
+        with self.library.open(theme, name) as src:
+            src.draft("RGB", ANALYSIS_SIZE)
+            brightness, layouts = analyze_image(src)
+        return BackgroundStats(
+            signature=signature, brightness=brightness, layouts=layouts
+        )
+
+    def build(self) -> None:
+        """
+        分析所有背景（有快取的直接沿用），然後重建候選桶。
+        背景資料夾有變動時再呼叫一次即可。
+        """
+        cached = load_index_cache(self.cache_path)
+        stats: Dict[str, BackgroundStats] = {}
+        analyzed = 0
+
+        for theme in self.library.themes():
+            for name in self.library.names(theme):
+                key = f"{theme}/{name}"
+                try:
+                    signature = self.library.signature(theme, name)
+                    entry = cached.get(key)
+                    if entry is None or entry.signature != signature:
+                        entry = self._analyze(theme, name, signature)
+                        analyzed += 1
+                except Exception as e:
+                    log.warning("Skip background", extra={"key": key, "error": str(e)})
+                    continue
+                stats[key] = entry
+
+        buckets: Dict[Tuple[str, str], List[str]] = {}
+        for theme in self.library.themes():
+            names = [n for n in self.library.names(theme) if f"{theme}/{n}" in stats]
+            if not names:
+                continue
+            keep = max(1, int(len(names) * BEST_FRACTION))
+            for layout in LAYOUT_REGIONS:
+                ranked = sorted(
+                    names,
+                    key=lambda n: stats[f"{theme}/{n}"].layouts.get(layout, float("inf")),
+                )
+                buckets[(theme, layout)] = ranked[:keep]
+
+        with self._lock:
+            self._stats = stats
+            self._buckets = buckets
+            self.ready = True
+
+        if analyzed:
+            save_index_cache(self.cache_path, stats)
+        log.info(
+            "Backgrounds indexed",
+            extra={
+                "count": len(stats),
+                "analyzed": analyzed,
+                "from_cache": len(stats) - analyzed,
+            },
+        )
+
+    # ===== 查詢 =====
+
+    def select(
+        self,
+        theme: str,
+        layout: str,
+        rng: random.Random | None = None,
+    ) -> str | None:
+        """從該 layout 文字區最乾淨的背景裡隨機挑一張，沒有索引就回 None。"""
+        bucket = self._buckets.get((theme, layout))
+        if not bucket:
+            return None
+        return (rng or random).choice(bucket)
+
+    def stats(self, theme: str, name: str) -> BackgroundStats | None:
+        return self._stats.get(f"{theme}/{name}")
@@ -0,0 +1,92 @@
+import os
+import threading
+from typing import Dict, List, Tuple
+
+from PIL import Image
+
+from .asset_pack import AssetPack
+from .structured_logging import get_logger
+
+log = get_logger("background_library")
+
+
+BACKGROUND_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+class BackgroundLibrary:
+    """
+    背景圖來源：
+    - 有 pack 檔（build_asset_pack.py 產生）就全部從 mmap 讀
+    - 沒有的話讀 backgrounds/<theme>/ 資料夾，目錄清單會快取，
+      資料夾 mtime 有變才重新列
+    """
+
+    def __init__(self, base_dir: str, pack_path: str | None = None):
+        self.base_dir = base_dir
+        self.pack: AssetPack | None = None
+        if pack_path and os.path.exists(pack_path):
+            self.pack = AssetPack(pack_path)
+            log.info("Using asset pack", extra={"path": pack_path})
+
+        self._lock = threading.Lock()
+        # theme -> (資料夾 mtime, 檔名清單)
+        self._listing: Dict[str, Tuple[int, List[str]]] = {}
+
+    def _list_dir(self, theme: str) -> List[str]:
+        theme_dir = os.path.join(self.base_dir, theme)
+        try:
+            mtime = os.stat(theme_dir).st_mtime_ns
+        except OSError:
+            return []
+
+        cached = self._listing.get(theme)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        names = sorted(
+            name for name in os.listdir(theme_dir)
+            if name.lower().endswith(BACKGROUND_EXTENSIONS)
+        )
+        with self._lock:
+            self._listing[theme] = (mtime, names)
+        return names
+
+    def themes(self) -> List[str]:
+        if self.pack:
+            return list(self.pack.themes())
+        if not os.path.isdir(self.base_dir):
+            return []
+        return sorted(
+            name for name in os.listdir(self.base_dir)
+            if os.path.isdir(os.path.join(self.base_dir, name))
+        )
+
+    def names(self, theme: str) -> List[str]:
+        """該主題所有背景圖的檔名（不要修改回傳的 list）。"""
+        if self.pack:
+            return self.pack.names(theme)
+        return self._list_dir(theme)
+
+    def has_theme(self, theme: str) -> bool:
+        return bool(self.names(theme))
+
+    def open(self, theme: str, name: str) -> Image.Image:
+        """開啟（尚未解碼的）背景圖，可以先呼叫 draft 再 convert。"""
+        if self.pack:
+            return self.pack.open_image(theme, name)
+        return Image.open(os.path.join(self.base_dir, theme, name))
+
+    def signature(self, theme: str, name: str) -> str:
+        """
+        用來判斷分析快取是否還有效的指紋：
+        資料夾模式用檔案大小 + mtime，pack 模式用長度。
+        """
+        if self.pack:
+            return f"pack:{self.pack.length(theme, name)}"
+        st = os.stat(os.path.join(self.base_dir, theme, name))
+        return f"{st.st_size}:{st.st_mtime_ns}"
+
+    def warm(self) -> None:
+        """先把每個主題的清單讀好，第一個請求就不用列目錄。"""
+        for theme in self.themes():
+            self.names(theme)
@@ -1,38 +1,122 @@
-import base64
-import glob
-import io
 import os
 import random
-from typing import Tuple
+import secrets
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, ImageOps
 
-from .text_utils import (
-    remove_emoji,
-    split_text_to_lines,
-    TITLE_MAX_CHARS,
-    SUBTITLE_MAX_CHARS,
-    FOOTER_MAX_CHARS,
-    apply_deep_fry,
-)
+from .text_utils import remove_emoji
 from .graphics_utils import (
     estimate_brightness,
     pick_text_color,
     pick_stroke_color,
     pick_best_layout,
-    draw_lines_center,
-    draw_vertical_text,
-    measure_vertical_text_height,
-    maybe_add_sticker,
-    add_snow_effect,
 )
+from .layout_spec import LayoutEngine, load_layout_specs
+from .rotated_text import RotatedTextCache
+from .font_fallback import FontChain, FontStack, draw_text, load_font_sources
+from .background_index import BackgroundIndex
+from .background_library import BackgroundLibrary
+from .procedural_backgrounds import generate_background, has_palette
+from .sticker_atlas import SUPPORTED_CANVAS_WIDTHS, get_sticker_atlas
+from .shared_pool import SharedBackgroundPool, attach_pool, ensure_pool
+from .animation import animation_for, encode_animation
+from .effects import EffectContext, apply_effects, auto_effects
+from .structured_logging import get_logger, log_duration
+from .renditions import (
+    DEFAULT_RENDITIONS,
+    FULL,
+    LINE_PREVIEW,
+    ComposeResult,
+    Rendition,
+    RenditionSpec,
+    encode_renditions,
+)
+
+
+# 版面的像素數值（字級、描邊、間距）在 config/layouts.json，以 reference_side 設計，
+# 其他尺寸依短邊等比例縮放。
+DEFAULT_CANVAS_SIZE = (1024, 1024)
+MIN_CANVAS_SIDE = 256
+MAX_CANVAS_SIDE = 2048
+
+log = get_logger("compose")
+
+# ===== 主題 =====
+# 後端 API、LINE、app/ 原型都用這份清單檢查主題，不要各自去看背景資料夾有沒有圖。
+
+# 一般主題：背景圖庫（沒有圖的話用該主題配色程式產生）
+STANDARD_THEMES = (
+    "morning",
+    "health",
+    "life",
+    "festival_newyear",
+    "festival_christmas",
+    "festival_common",
+    "festival_lantern",
+    "festival_midautumn",
+)
+# 彩蛋主題：沒有自己的背景資料夾，借別人的背景或用自己的配色產生
+EASTER_EGG_THEMES = ("dark_humor", "broken_egg", "programmer", "lotus", "rebel")
+SUPPORTED_THEMES = STANDARD_THEMES + EASTER_EGG_THEMES
+# 可以接在任何主題後面的後綴（_retro = 電子包漿）
+THEME_SUFFIXES = ("_retro",)
+
+
+def base_theme(theme: str) -> str:
+    """去掉 _retro 之類的後綴，得到找背景 / 字色用的主題。"""
+    for suffix in THEME_SUFFIXES:
+        theme = theme.replace(suffix, "")
+    return theme
+
+
+def is_supported_theme(theme: str) -> bool:
+    return base_theme(theme) in SUPPORTED_THEMES
+
+
+@dataclass
+class CanvasPlan:
+    """還沒畫字的畫布：背景已經挑好、layout 已經決定。"""
+    theme: str               # 原本的主題（可能帶 _retro，特效用）
+    real_theme: str          # 去掉後綴的主題（背景 / 字色用）
+    background: Image.Image  # RGB，字和特效都直接畫在這張上
+    layout: str
+    # 這張卡的亂數：seed 決定背景 / layout，再從同一個 rng 抽出特效和動畫用的 seed。
+    # 特效每次畫都從 effect_seed 重新開始，低解析度預覽和原圖的貼紙 / 雪花才會一樣。
+    seed: int = 0
+    effect_seed: int = 0
+    animation_seed: int = 0
+
+    def effect_rng(self) -> random.Random:
+        return random.Random(self.effect_seed)
 
 
 class ComposeService:
-    def __init__(self, background_base_dir: str, font_path: str | None = None):
+    def __init__(
+        self,
+        background_base_dir: str,
+        font_path: str | None = None,
+        pack_path: str | None = None,
+        shared_pool_path: str | None = None,
+        image_buffer_blocks: int | None = None,
+    ):
         self.background_base_dir = background_base_dir
         self.font_path = font_path
 
+        # Pillow 釋放的影像記憶體先留著給下一張圖用（整個 process 共用，也就是每個 worker 一份），
+        # 每張卡的畫布 / 縮圖不用一直跟系統要新的記憶體。None = 照 Pillow 預設（不保留）
+        if image_buffer_blocks is not None:
+            Image.core.set_blocks_max(image_buffer_blocks)
+
+        # 背景圖來源：有 pack 檔就用 mmap，沒有就讀資料夾
+        self.backgrounds = BackgroundLibrary(background_base_dir, pack_path)
+
+        # 多個 worker 共用一份已解碼的背景（沒設定就每次自己解碼）。
+        # 產生 / attach 要解碼全部背景，放在 warm_up 做，import 時不卡住；暖好之前先自己解碼
+        self.shared_pool_path = shared_pool_path
+        self.shared_pool: SharedBackgroundPool | None = None
+
         # 不同主題的基礎顏色（之後再依背景亮度微調）
         self.theme_title_colors = {
             "morning": (255, 50, 20, 255),          # 暖紅
@@ -49,48 +133,113 @@ class ComposeService:
         self.assets_root = os.path.dirname(self.background_base_dir)
         self.sticker_dir = os.path.join(self.assets_root, "stickers")
 
-        # layout 設定
+        # 背景分析索引（亮度、各 layout 文字區複雜度），warm_up 時建立
+        self.background_index = BackgroundIndex(
+            self.backgrounds,
+            cache_path=os.path.join(self.assets_root, "backgrounds.index.json"),
+        )
+
+        # 同一個字級只載入一次字型；主字型缺的字依 config/fonts.json 換字型畫
+        self._font_cache: Dict[int, FontStack | ImageFont.FreeTypeFont | ImageFont.ImageFont] = {}
+        self.font_chain = FontChain(load_font_sources(font_path))
+
+        # layout 設定在 config/layouts.json，編譯好的 placement plan 依畫布大小快取
+        self.layout_specs = load_layout_specs()
+        self.layouts = LayoutEngine(
+            self.layout_specs, self._load_font, font_key=self.font_path
+        )
         self.layout_config = {
-            "center": {"name": "經典置中"},
-            "top_bottom": {"name": "上下分佈"},
-            "left_block": {"name": "左側文字"},
-            "diagonal": {"name": "斜斜標題"},
-            "vertical": {"name": "直書標題"},
+            key: {"name": spec.name} for key, spec in self.layout_specs.layouts.items()
         }
-        self.available_layouts = list(self.layout_config.keys())
+        self.available_layouts = self.layout_specs.names()
+        # 斜斜的字：轉好的文字圖層依內容 / 角度快取
+        self.rotated_text = RotatedTextCache()
 
     # ===== 共用工具 =====
 
-    def _load_font(self, size: int) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
-        if self.font_path and os.path.exists(self.font_path):
+    def _load_font(self, size: int) -> FontStack | ImageFont.FreeTypeFont | ImageFont.ImageFont:
+        font = self._font_cache.get(size)
+        if font is not None:
+            return font
+
+        font = None
+        if self.font_chain:
             try:
-                return ImageFont.truetype(self.font_path, size)
+                font = self.font_chain.at(size)
             except Exception:
                 # fallback
                 pass
-        return ImageFont.load_default()
+        if font is None:
+            font = ImageFont.load_default()
+        self._font_cache[size] = font
+        return font
 
-    def _choose_background(self, theme: str) -> Image.Image:
+    def warm_up(self) -> None:
+        """
+        啟動時先把字型、背景清單、貼紙圖集、背景分析索引載好，
+        第一張卡就不用等這些 I/O。
+        """
+        # 常用尺寸的 placement plan 先編譯好（順便載入各字級的字型）
+        for side in SUPPORTED_CANVAS_WIDTHS:
+            for layout in self.available_layouts:
+                self.layouts.compile(layout, (side, side))
+
+        self.backgrounds.warm()
+        if self.shared_pool_path and self.shared_pool is None:
+            ensure_pool(self.backgrounds, self.shared_pool_path)
+            self.shared_pool = attach_pool(self.shared_pool_path)
+        get_sticker_atlas(self.sticker_dir).variants_for(DEFAULT_CANVAS_SIZE)
+        self.background_index.build()
+
+    def _choose_background(
+        self,
+        theme: str,
+        rng: random.Random,
+        size: Tuple[int, int] = DEFAULT_CANVAS_SIZE,
+        layout: str | None = None,
+    ) -> Image.Image:
+        """
+        挑背景並轉成 size 大小的 RGB 畫布（一定是新的一張，可以直接在上面畫）。
+        有指定 layout 時，優先從「該 layout 文字區最乾淨」的背景裡挑。
+        """
         # === [新增] 背景圖映射邏輯 ===
         # 如果是特殊彩蛋，強制借用別人的背景圖
         # 地獄梗 -> 用早安圖 (反差最大)
         # 壞了 -> 用健康圖 (身體健康 vs 系統壞了)
+        # 有自己配色的彩蛋（工程師、蓮花...）改用程式產生的背景
         target_theme = theme
-        if theme in ["dark_humor", "broken_egg", "programmer", "lotus", "rebel"]:
-            target_theme = random.choice(["morning", "life"])
+        if theme in EASTER_EGG_THEMES:
+            if has_palette(theme):
+                return generate_background(theme, size, rng=rng).copy()
+            target_theme = rng.choice(["morning", "life"])
 
-        theme_dir = os.path.join(self.background_base_dir, target_theme)
-        pattern = os.path.join(theme_dir, "*.*")
-        candidates = glob.glob(pattern)
+        candidates = self.backgrounds.names(target_theme)
 
         if not candidates:
-            img = Image.new("RGBA", (1024, 1024), (255, 240, 220, 255))
-            return img
-
-        img_path = random.choice(candidates)
-        img = Image.open(img_path).convert("RGBA")
-        img = img.resize((1024, 1024))
-        return img
+            # 資料夾是空的：用該主題配色程式產生一張，不再是單色畫布
+            return generate_background(target_theme, size, rng=rng).copy()
+
+        name = None
+        if layout:
+            name = self.background_index.select(target_theme, layout, rng=rng)
+        if name is None:
+            name = rng.choice(candidates)
+
+        if self.shared_pool is not None:
+            pooled = self.shared_pool.get(target_theme, name)
+            if pooled is not None:
+                # 共用池的圖是唯讀、零複製的 RGBX，convert("RGB") 就是唯一一次複製
+                if pooled.size != size:
+                    return ImageOps.fit(pooled, size).convert("RGB")
+                return pooled.convert("RGB")
+
+        with self.backgrounds.open(target_theme, name) as src:
+            # JPEG 可以直接用縮小的 DCT 解碼，預覽尺寸就不用解整張
+            src.draft("RGB", size)
+            # 裁切成目標比例再縮放，非正方形畫布也不會變形
+            # （fit 本來就會產生新的圖，已經是 RGB 的話不用先 convert 複製一份）
+            rgb = src if src.mode == "RGB" else src.convert("RGB")
+            return ImageOps.fit(rgb, size)
 
     def _get_title_color(self, theme: str) -> Tuple[int, int, int, int]:
 
@@ -109,293 +258,263 @@ class ComposeService:
         subtitle: str,
         footer: str,
         layout: str | None = None,
+        effects: List[str] | None = None,
+        width: int | None = None,
+        height: int | None = None,
+        seed: int | None = None,
     ) -> str:
         """
-        回傳 base64 encoded PNG 字串
+        回傳 base64 encoded PNG 字串（參數同 render_canvas）。
+        """
+        canvas, _ = self.render_canvas(
+            theme, title, subtitle, footer,
+            layout=layout, effects=effects, width=width, height=height, seed=seed,
+        )
+        return encode_renditions(canvas, [FULL])["full"].to_base64()
 
-        - layout 為 None 或 "auto" 時，會在 available_layouts 之間自動挑選。
-        - 目前只畫 title + subtitle，不畫 footer。
-        - 圖片上的文字不含 emoji（先移除避免字型畫不出來）。
+    def compose_renditions(
+        self,
+        theme: str,
+        title: str,
+        subtitle: str,
+        footer: str,
+        layout: str | None = None,
+        effects: List[str] | None = None,
+        width: int | None = None,
+        height: int | None = None,
+        renditions: Iterable[RenditionSpec] = DEFAULT_RENDITIONS,
+        seed: int | None = None,
+    ) -> ComposeResult:
         """
-        # === [新增] 處理 theme 後綴 ===
-        # 如果 theme 包含 "_retro"，先把它還原成正常的資料夾名稱來找背景
-        real_theme = theme
-        if "_retro" in theme:
-            real_theme = theme.replace("_retro", "")
+        合成一次，輸出多個尺寸 / 格式（原圖、LINE 預覽、縮圖...）。
+        各版本從同一張畫布縮放，平行編碼。
+        """
+        plan = self.plan_canvas(
+            theme, layout=layout, width=width, height=height, seed=seed
+        )
+        return self.compose_plan(
+            plan, title, subtitle, footer, effects=effects, renditions=renditions
+        )
 
-        # 先把 emoji 拿掉，再畫到圖片上
-        title = remove_emoji(title)
-        subtitle = remove_emoji(subtitle)
+    def compose_plan(
+        self,
+        plan: CanvasPlan,
+        title: str,
+        subtitle: str,
+        footer: str,
+        effects: List[str] | None = None,
+        renditions: Iterable[RenditionSpec] = DEFAULT_RENDITIONS,
+    ) -> ComposeResult:
+        """
+        在已經準備好的 plan 上畫字並輸出各版本（plan 畫完就不能再用）。
+        有動畫版本時，背景和文字只畫一次：靜態版本在上面補飄雪，動畫版本逐格疊粒子。
+        """
+        renditions = list(renditions)
+        if effects is None:
+            effects = auto_effects(plan.theme, title, subtitle)
+        kind = (
+            animation_for(plan.theme, effects)
+            if any(spec.animated for spec in renditions) else None
+        )
 
-        bg = self._choose_background(real_theme)
-        width, height = bg.size
+        with log_duration(
+            log, "Composed card", theme=plan.theme, layout=plan.layout, seed=plan.seed
+        ):
+            if kind is None:
+                canvas = self.draw_canvas(plan, title, subtitle, footer, effects=effects)
+                return ComposeResult(
+                    theme=plan.theme,
+                    layout=plan.layout,
+                    renditions=encode_renditions(canvas, renditions),
+                    seed=plan.seed,
+                )
 
-        # 統一的安全邊界，避免文字太貼近圖片邊緣
-        safe_margin_x = int(width * 0.06)
-        safe_margin_y = int(height * 0.06)
+            # 雪花改成動畫裡的粒子，base 先不下雪
+            base = self.draw_canvas(
+                plan, title, subtitle, footer,
+                effects=[name for name in effects if name != "snow"],
+            )
+            result = {}
+            stills = [spec for spec in renditions if not spec.animated]
+            if stills:
+                still = base
+                if "snow" in effects:
+                    # 特效會直接改畫布，靜態版本的雪下在複本上，動畫還要用沒有雪的 base
+                    still = apply_effects(
+                        base.copy(), ["snow"],
+                        EffectContext(sticker_dir=self.sticker_dir, rng=plan.effect_rng()),
+                    )
+                result = encode_renditions(still, stills)
+                del still  # 下雪的複本編碼完就放掉，不要留到動畫編碼時
+            for spec in renditions:
+                if spec.animated:
+                    result[spec.name] = encode_animation(
+                        base, kind, spec, seed=plan.animation_seed
+                    )
+            return ComposeResult(
+                theme=plan.theme, layout=plan.layout, renditions=result, seed=plan.seed
+            )
 
-        center_x = width // 2
+    def compose_preview(
+        self,
+        plan: CanvasPlan,
+        title: str,
+        subtitle: str,
+        footer: str,
+        effects: List[str] | None = None,
+        spec: RenditionSpec = LINE_PREVIEW,
+    ) -> Rendition:
+        """
+        直接在縮小的背景上畫一張低解析度預覽，
+        比畫完原圖再縮小快很多，plan 之後還可以畫原圖。
+        """
+        width, height = plan.background.size
+        ratio = min(1.0, spec.max_side / max(width, height)) if spec.max_side else 1.0
+        size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+        canvas = self.draw_canvas(
+            plan, title, subtitle, footer, effects=effects, size=size
+        )
+        return encode_renditions(canvas, [spec])[spec.name]
 
-        # 根據背景估計亮度，調整字色
-        brightness = estimate_brightness(bg)
-        base_title = self._get_title_color(real_theme)
-        base_subtitle = (60, 60, 60, 255)
+    def render_canvas(
+        self,
+        theme: str,
+        title: str,
+        subtitle: str,
+        footer: str,
+        layout: str | None = None,
+        effects: List[str] | None = None,
+        width: int | None = None,
+        height: int | None = None,
+        seed: int | None = None,
+    ) -> Tuple[Image.Image, str]:
+        """
+        合成長輩圖，回傳 (RGB 畫布, 實際使用的 layout)
 
-        # 用新的方法選顏色：先微調，再強制確保對比
-        title_color = pick_text_color(base_title, brightness)
-        subtitle_color = pick_text_color(
-            base_subtitle, brightness, prefer_light=True
+        - layout 為 None 或 "auto" 時，會在 available_layouts 之間自動挑選。
+        - effects 為 None 時依主題/文字自動決定特效，否則照名稱依序套用
+          （名稱見 effects.EFFECT_REGISTRY）。
+        - width / height 指定輸出尺寸（預設 1024 x 1024），字級、描邊、
+          間距都跟著短邊等比例縮放，預覽圖可以直接用小尺寸畫。
+        - seed：同樣的 seed + 參數永遠畫出同一張（背景、layout、貼紙、雪花）；
+          沒給就隨機產生一個，記在 log 和結果裡，之後可以重現。
+        - 目前只畫 title + subtitle，不畫 footer。
+        - 圖片上的 emoji 用彩色 emoji 字型畫；沒有裝的話先移除，避免畫成方框。
+        """
+        plan = self.plan_canvas(
+            theme, layout=layout, width=width, height=height, seed=seed
         )
+        return self.draw_canvas(plan, title, subtitle, footer, effects=effects), plan.layout
 
-        # 字型
-        title_font_large = self._load_font(100)
-        title_font_normal = self._load_font(80)
-        subtitle_font = self._load_font(45)
+    def plan_canvas(
+        self,
+        theme: str,
+        layout: str | None = None,
+        width: int | None = None,
+        height: int | None = None,
+        seed: int | None = None,
+    ) -> CanvasPlan:
+        """
+        不需要文字的部分先做：挑背景、決定 layout。
+        串流 API 可以在等 LLM 的同時先做這一步，馬上告訴前端用哪個 layout。
+        """
+        # 每個請求自己一個 rng，不碰全域的 random（不同請求不會互相干擾）
+        if seed is None:
+            seed = secrets.randbits(32)
+        rng = random.Random(seed)
+        # === [新增] 處理 theme 後綴 ===
+        # 如果 theme 包含 "_retro"，先把它還原成正常的資料夾名稱來找背景
+        real_theme = base_theme(theme)
 
-        title_lines = split_text_to_lines(title, max_chars=TITLE_MAX_CHARS)
-        subtitle_lines = split_text_to_lines(
-            subtitle, max_chars=SUBTITLE_MAX_CHARS
+        canvas_size = (
+            width or DEFAULT_CANVAS_SIZE[0],
+            height or DEFAULT_CANVAS_SIZE[1],
         )
-
-        # 外框 / glow
-        stroke_width = 6
-        title_stroke = pick_stroke_color(title_color)
-        subtitle_stroke = pick_stroke_color(subtitle_color)
+        forced_layout = layout if layout in self.available_layouts else None
+        bg = self._choose_background(real_theme, rng, canvas_size, forced_layout)
 
         # 決定實際要用的 layout
         if not layout or layout == "auto" or layout not in self.available_layouts:
-            layout = pick_best_layout(bg, self.available_layouts)
-
-        draw = ImageDraw.Draw(bg)
-
-        if layout == "center":
-            # 經典置中
-            current_y = int(height * 0.28)
-            current_y = draw_lines_center(
-                draw,
-                title_lines,
-                title_font_large,
-                center_x,
-                current_y,
-                line_spacing=6,
-                fill=title_color,
-                stroke_width=stroke_width,
-                stroke_fill=title_stroke,
-            )
-            current_y += 10
-
-            draw_lines_center(
-                draw,
-                subtitle_lines,
-                subtitle_font,
-                center_x,
-                current_y,
-                line_spacing=6,
-                fill=subtitle_color,
-                stroke_width=4,
-                stroke_fill=title_stroke,
+            layout = pick_best_layout(
+                bg, self.available_layouts, self.layout_specs.regions(), rng=rng
             )
 
-        elif layout == "top_bottom":
-            # 上面是標題，下面是副標
-            title_y = int(height * 0.14)
-            draw_lines_center(
-                draw,
-                title_lines,
-                title_font_normal,
-                center_x,
-                title_y,
-                line_spacing=4,
-                fill=title_color,
-                stroke_width=stroke_width,
-                stroke_fill=title_stroke,
-            )
-            subtitle_y = int(height * 0.62)
-
-            draw_lines_center(
-                draw,
-                subtitle_lines,
-                subtitle_font,
-                center_x,
-                subtitle_y,
-                line_spacing=4,
-                fill=subtitle_color,
-                stroke_width=2,
-                stroke_fill=title_stroke,
-            )
+        return CanvasPlan(
+            theme=theme,
+            real_theme=real_theme,
+            background=bg,
+            layout=layout,
+            seed=seed,
+            effect_seed=rng.getrandbits(32),
+            animation_seed=rng.getrandbits(32),
+        )
 
-        elif layout == "left_block":
-            # 左側區塊：標題 + 內容直書在左邊，英文改放下面橫排
-            margin_x = safe_margin_x
+    def draw_canvas(
+        self,
+        plan: CanvasPlan,
+        title: str,
+        subtitle: str,
+        footer: str,
+        effects: List[str] | None = None,
+        size: Tuple[int, int] | None = None,
+    ) -> Image.Image:
+        """
+        在 plan 的背景上畫字、套特效，回傳 RGB 畫布。
+        整個過程都在同一張畫布上就地修改，只有要透明度的圖層（斜字、貼紙、雪花）另外配置。
+        - size 沒給：直接畫在 plan.background 上（畫完這個 plan 就不能再用）
+        - size 比較小：縮一份背景來畫（低解析度預覽），plan 之後還能畫原尺寸
+        字要放哪裡由 config/layouts.json 決定（見 layout_spec.py）。
+        """
+        theme = plan.theme
+        real_theme = plan.real_theme
 
-            # 只挑出要做直書的文字：非 ASCII（中文、全形符號），英文等留給橫排
-            title_source = "".join(title_lines)
-            subtitle_source = "".join(subtitle_lines)
+        # 沒有彩色 emoji 字型就先把 emoji 拿掉，再畫到圖片上
+        if not self.font_chain.has_color_emoji:
+            title = remove_emoji(title)
+            subtitle = remove_emoji(subtitle)
 
-            vertical_title = "".join(
-                ch for ch in title_source
-                if not ch.isspace() and ord(ch) >= 128
-            )
-            vertical_subtitle = "".join(
-                ch for ch in subtitle_source
-                if not ch.isspace() and ord(ch) >= 128
-            )
+        bg = plan.background
+        if size is not None and size != bg.size:
+            bg = ImageOps.fit(bg, size)
 
-            # 計算直書標題 / 內容的高度，讓整塊在上下方向置中
-            title_block_h = measure_vertical_text_height(
-                draw,
-                vertical_title,
-                title_font_normal,
-                line_spacing=4,
-                stroke_width=stroke_width,
-            )
-            subtitle_block_h = measure_vertical_text_height(
-                draw,
-                vertical_subtitle,
-                subtitle_font,
-                line_spacing=4,
-                stroke_width=2,
-            )
-            block_h = max(title_block_h, subtitle_block_h)
-            available_h = height - 2 * safe_margin_y
-
-            if block_h > 0 and block_h < available_h:
-                # 有空間 → 讓整個直書區塊上下置中
-                top_y = safe_margin_y + (available_h - block_h) // 2
-            else:
-                # 太長就從安全邊界開始畫，避免文字跑出圖外
-                top_y = safe_margin_y
-
-            # 標題直書在最左邊
-            draw_vertical_text(
-                draw,
-                vertical_title,
-                title_font_normal,
-                x=margin_x,
-                start_y=top_y,
-                line_spacing=4,
-                fill=title_color,
-                stroke_width=stroke_width,
-                stroke_fill=title_stroke,
-            )
+        # 根據背景估計亮度，調整字色
+        brightness = estimate_brightness(bg)
+        base_title = self._get_title_color(real_theme)
+        base_subtitle = (60, 60, 60, 255)
 
-            # 拉大欄距，讓標題跟內容不要太擠
-            column_gap = int(width * 0.09)
-            subtitle_x = margin_x + column_gap
-
-            # 副標直書放在右邊一點的位置，形成兩欄直式
-            draw_vertical_text(
-                draw,
-                vertical_subtitle,
-                subtitle_font,
-                x=subtitle_x,
-                start_y=top_y,
-                line_spacing=4,
-                fill=subtitle_color,
-                stroke_width=2,
-                stroke_fill=title_stroke,
-            )
+        # 用新的方法選顏色：先微調，再強制確保對比
+        colors = {
+            "title": pick_text_color(base_title, brightness),
+            "subtitle": pick_text_color(base_subtitle, brightness, prefer_light=True),
+        }
+        strokes = {role: pick_stroke_color(color) for role, color in colors.items()}
 
-            # 額外：把英文集中畫在圖片下方置中，避免英文直書怪怪的
-            english_chars = [
-                ch
-                for ch in f"{title} {subtitle}"
-                if ch.isascii() and (ch.isalpha() or ch.isdigit() or ch.isspace())
-            ]
-            english_text = "".join(english_chars)
-            # 把多個空白縮成一個，避免空格亂七八糟
-            english_text = " ".join(english_text.split())
-
-            if english_text:
-                bbox = draw.textbbox(
-                    (0, 0),
-                    english_text,
-                    font=subtitle_font,
-                    stroke_width=2,
-                )
-                text_w = bbox[2] - bbox[0]
-                text_h = bbox[3] - bbox[1]
-
-                english_x = center_x - text_w // 2
-                english_y = height - safe_margin_y - text_h
-
-                draw.text(
-                    (english_x, english_y),
-                    english_text,
-                    font=subtitle_font,
-                    fill=subtitle_color,
-                    stroke_width=2,
-                    stroke_fill=subtitle_stroke,
+        boxes = self.layouts.place(plan.layout, bg.size, {
+            "title": title,
+            "subtitle": subtitle,
+            "footer": footer,
+        })
+        draw = ImageDraw.Draw(bg)
+        for box in boxes:
+            if box.rotate:
+                self.rotated_text.draw(bg, box.runs, box.rotate, colors, strokes)
+                continue
+            for run in box.runs:
+                draw_text(
+                    bg,
+                    draw,
+                    (run.x, run.y),
+                    run.text,
+                    font=run.font,
+                    fill=colors[run.color],
+                    stroke_width=run.stroke,
+                    stroke_fill=strokes[run.stroke_color],
                 )
 
-        elif layout == "vertical":
-            # 直書標題 + 內容都靠右排成兩欄
-            top_y = safe_margin_y
-
-            # 估一個中文字寬度，避免貼到右邊
-            sample_char = "永"
-            title_bbox = draw.textbbox(
-                (0, 0), sample_char, font=title_font_normal, stroke_width=stroke_width
-            )
-            title_char_w = title_bbox[2] - title_bbox[0]
-
-            subtitle_bbox = draw.textbbox(
-                (0, 0), sample_char, font=subtitle_font, stroke_width=2
-            )
-            subtitle_char_w = subtitle_bbox[2] - subtitle_bbox[0]
-
-            # 最右邊放標題，再往左放副標
-            title_x = width - safe_margin_x - title_char_w
-            column_gap = max(int(width * 0.04),
-                             subtitle_char_w + int(width * 0.01))
-            subtitle_x = title_x - column_gap
-
-            vertical_title = "".join(ch for ch in "".join(
-                title_lines) if not ch.isspace())
-            vertical_subtitle = "".join(
-                ch for ch in "".join(subtitle_lines) if not ch.isspace()
-            )
-
-            draw_vertical_text(
-                draw,
-                vertical_title,
-                title_font_normal,
-                x=title_x,
-                start_y=top_y,
-                line_spacing=4,
-                fill=title_color,
-                stroke_width=stroke_width,
-                stroke_fill=title_stroke,
-            )
-
-            draw_vertical_text(
-                draw,
-                vertical_subtitle,
-                subtitle_font,
-                x=subtitle_x,
-                start_y=top_y,
-                line_spacing=4,
-                fill=subtitle_color,
-                stroke_width=2,
-                stroke_fill=title_stroke,
-            )
-
-        # 最後可選地加一張貼紙
-        maybe_add_sticker(bg, self.sticker_dir)
-
-        # === [新增] 彩蛋：飄雪特效 ===
-        # 觸發條件：主題包含 "christmas" (聖誕節)，或者標題/副標有 "雪" 這個字
-        is_christmas = "christmas" in theme
-        has_snow_text = "雪" in title or "雪" in subtitle
-
-        if is_christmas or has_snow_text:
-            add_snow_effect(bg)
-
-        if "old" in theme or "retro" in theme or "復古" in title:
-            bg = apply_deep_fry(bg)
+        # 最後套用特效（貼紙、飄雪、電子包漿...）
+        if effects is None:
+            effects = auto_effects(theme, title, subtitle)
+        bg = apply_effects(bg, effects, EffectContext(
+            sticker_dir=self.sticker_dir, rng=plan.effect_rng()))
 
-        # 轉成 base64
-        buffer = io.BytesIO()
-        bg.convert("RGB").save(buffer, format="PNG")
-        base64_str = base64.b64encode(buffer.getvalue()).decode("utf-8")
-        return base64_str
+        return bg if bg.mode == "RGB" else bg.convert("RGB")
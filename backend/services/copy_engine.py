@@ -0,0 +1,184 @@
+import itertools
+import json
+import math
+import random
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Tuple
+
+from .text_utils import SUBTITLE_MAX_CHARS, TITLE_MAX_CHARS
+
+
+# ===== 離線文案產生器 =====
+#
+# 不呼叫 LLM，用 config/copy_grammar.json 的「模板 + 詞槽」組出文案：
+# - slots：共用詞槽，模板裡寫 {wish}、{people} 之類的名稱
+# - styles：和 LLMService.style_variants 同名的語氣，各自多加一些句型
+# - themes：每個主題的 title / subtitle / footer 模板（default 給沒列到的主題）
+#
+# 載入時就把每個 (主題, 語氣) 的所有組合展開、去重、濾掉超過字數的，
+# 產生一張卡只是挑三個 index，幾微秒就好。
+# 沒給 seed 時用「跳號」的方式走完全部組合，走完一輪之前不會重複。
+
+COPY_LIMITS = {
+    "title": TITLE_MAX_CHARS,
+    "subtitle": SUBTITLE_MAX_CHARS,
+    "footer": 15,
+}
+FIELDS = ("title", "subtitle", "footer")
+
+_SLOT_PATTERN = re.compile(r"\{(\w+)\}")
+
+
+def expand_template(template: str, slots: Mapping[str, List[str]]) -> List[str]:
+    """把模板裡的 {slot} 換成所有可能的詞，回傳全部組合。"""
+    names = _SLOT_PATTERN.findall(template)
+    if not names:
+        return [template]
+    for name in names:
+        if name not in slots:
+            raise ValueError(f"Unknown slot {{{name}}} in template: {template}")
+    parts = _SLOT_PATTERN.split(template)
+    # split 之後奇數位置是 slot 名稱
+    choices = [
+        slots[part] if i % 2 else [part]
+        for i, part in enumerate(parts)
+    ]
+    return ["".join(combo) for combo in itertools.product(*choices)]
+
+
+@dataclass(frozen=True)
+class CopyPool:
+    """某個 (主題, 語氣) 展開後的所有句子。"""
+    title: Tuple[str, ...]
+    subtitle: Tuple[str, ...]
+    footer: Tuple[str, ...]
+
+    def __len__(self) -> int:
+        return len(self.title) * len(self.subtitle) * len(self.footer)
+
+    def card(self, index: int) -> Tuple[str, str, str]:
+        """用混合進位把一個 index 拆成 (title, subtitle, footer)。"""
+        index, t = divmod(index, len(self.title))
+        f, s = divmod(index, len(self.subtitle))
+        return self.title[t], self.subtitle[s], self.footer[f]
+
+
+class _Walker:
+    """
+    不重複走完 0..n-1：index = (offset + stride * i) mod n，stride 和 n 互質，
+    每一輪重新抽 stride / offset。不用記住發過哪些，O(1) 記憶體。
+    """
+
+    def __init__(self, n: int):
+        self.n = n
+        self._restart()
+
+    def _restart(self) -> None:
+        self.count = 0
+        self.offset = random.randrange(self.n)
+        stride = random.randrange(1, self.n) if self.n > 1 else 1
+        while math.gcd(stride, self.n) != 1:
+            stride += 1
+        self.stride = stride
+
+    def next(self) -> int:
+        if self.count >= self.n:
+            self._restart()
+        index = (self.offset + self.stride * self.count) % self.n
+        self.count += 1
+        return index
+
+
+class CopyEngine:
+    def __init__(self, config_path: str):
+        self.config_path = config_path
+        with open(config_path, encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.styles: List[str] = list(self.config.get("styles", {}).keys())
+
+        self._lock = threading.Lock()
+        self._pools: Dict[Tuple, CopyPool] = {}
+        self._walkers: Dict[Tuple, _Walker] = {}
+
+    # ===== 展開 =====
+
+    def _theme_config(self, theme: str) -> dict:
+        themes = self.config["themes"]
+        return themes.get(theme) or themes["default"]
+
+    def _build_pool(
+        self,
+        theme: str,
+        style: str | None,
+        variables: Tuple[Tuple[str, str], ...],
+    ) -> CopyPool:
+        theme_config = self._theme_config(theme)
+        slots = dict(self.config.get("slots", {}))
+        slots.update(theme_config.get("slots", {}))
+        # 執行期的變數（例如生肖）也當成只有一個選項的詞槽
+        slots.update({name: [value] for name, value in variables})
+
+        style_config = {}
+        if style and theme_config.get("use_styles", True):
+            style_config = self.config.get("styles", {}).get(style, {})
+
+        fields = {}
+        for field in FIELDS:
+            templates = theme_config.get(field, []) + style_config.get(field, [])
+            sentences = dict.fromkeys(
+                text
+                for template in templates
+                for text in expand_template(template, slots)
+                if len(text) <= COPY_LIMITS[field]
+            )
+            if not sentences:
+                raise ValueError(f"No {field} fits the limit for theme: {theme}")
+            fields[field] = tuple(sentences)
+        return CopyPool(**fields)
+
+    def pool(
+        self,
+        theme: str,
+        style: str | None = None,
+        variables: Mapping[str, str] | None = None,
+    ) -> CopyPool:
+        key = (theme, style, tuple(sorted((variables or {}).items())))
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._build_pool(*key)
+            with self._lock:
+                self._pools[key] = pool
+        return pool
+
+    # ===== 對外 =====
+
+    def generate(
+        self,
+        theme: str,
+        style: str | None = None,
+        seed: int | None = None,
+        variables: Mapping[str, str] | None = None,
+    ) -> Tuple[str, str, str]:
+        """
+        回傳 (title, subtitle, footer)。
+        - 給 seed：結果固定（同樣的 seed 永遠同一張）
+        - 不給：同一個 (主題, 語氣) 走完所有組合前不會重複
+        style 不給就隨機挑一種語氣。
+        """
+        rng = random.Random(seed) if seed is not None else random
+        if style is None and self.styles:
+            style = rng.choice(self.styles)
+        pool = self.pool(theme, style, variables)
+
+        if seed is not None:
+            return pool.card(rng.randrange(len(pool)))
+
+        key = (theme, style, tuple(sorted((variables or {}).items())))
+        with self._lock:
+            walker = self._walkers.get(key)
+            if walker is None or walker.n != len(pool):
+                walker = self._walkers[key] = _Walker(len(pool))
+            index = walker.next()
+        return pool.card(index)
@@ -0,0 +1,179 @@
+import random
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+
+from PIL import Image, ImageFilter, ImageStat
+
+from .graphics_utils import add_snow_effect, maybe_add_sticker
+
+
+# ===== 特效管線 =====
+#
+# 每個特效都是 (img, ctx) -> img 的函式，用名稱註冊在 EFFECT_REGISTRY。
+# compose_image 可以依 request 指定要跑哪些特效，沒指定就照原本的觸發條件。
+
+
+@dataclass
+class EffectContext:
+    """特效執行時需要的外部資訊（貼紙資料夾、這張卡的亂數等）。"""
+    sticker_dir: str | None = None
+    rng: random.Random | None = None
+
+
+EffectFn = Callable[[Image.Image, EffectContext], Image.Image]
+
+EFFECT_REGISTRY: Dict[str, EffectFn] = {}
+
+
+def register_effect(name: str) -> Callable[[EffectFn], EffectFn]:
+    """把特效函式註冊到 EFFECT_REGISTRY，之後就能用名稱呼叫。"""
+    def decorator(fn: EffectFn) -> EffectFn:
+        EFFECT_REGISTRY[name] = fn
+        return fn
+    return decorator
+
+
+def available_effects() -> List[str]:
+    return list(EFFECT_REGISTRY.keys())
+
+
+def auto_effects(theme: str, title: str, subtitle: str) -> List[str]:
+    """
+    沒有指定特效時，沿用原本的觸發規則：
+    - 貼紙：每張都試試看（沒有貼紙檔就什麼都不做）
+    - 飄雪：主題包含 christmas，或標題/副標有「雪」
+    - 電子包漿：主題包含 old / retro，或標題有「復古」
+    """
+    names = ["sticker"]
+
+    if "christmas" in theme or "雪" in title or "雪" in subtitle:
+        names.append("snow")
+
+    if "old" in theme or "retro" in theme or "復古" in title:
+        names.append("deep_fry")
+
+    return names
+
+
+def apply_effects(
+    img: Image.Image,
+    names: List[str],
+    ctx: EffectContext,
+) -> Image.Image:
+    """依序套用特效，回傳最後的圖（有些特效會換成新的圖物件）。"""
+    for name in names:
+        fn = EFFECT_REGISTRY.get(name)
+        if fn is None:
+            raise ValueError(f"Unknown effect: {name}")
+        img = fn(img, ctx)
+    return img
+
+
+# ===== 內建特效 =====
+
+
+# 特效都直接改傳進來的畫布（不透明的 RGB），不再先轉成 RGBA 複製一份；
+# 需要透明度的只有貼紙 / 雪花自己那一層，用遮罩貼上去。
+
+
+@register_effect("sticker")
+def sticker_effect(img: Image.Image, ctx: EffectContext) -> Image.Image:
+    if ctx.sticker_dir:
+        maybe_add_sticker(img, ctx.sticker_dir, ctx.rng)
+    return img
+
+
+@register_effect("snow")
+def snow_effect(img: Image.Image, ctx: EffectContext) -> Image.Image:
+    add_snow_effect(img, ctx.rng)
+    return img
+
+
+# --- 電子包漿 ---
+#
+# 原本是 Color(3.0) -> Contrast(2.0) -> Sharpness(10.0) 三次 ImageEnhance，
+# 每次都會產生一張整張大小的中間圖。這裡改成：
+# 1. 飽和度 + 對比度都是線性運算，合併成一個 color matrix，一次 convert 完成
+#    （對比係數 >= 1 時，先裁切再拉對比跟最後一起裁切結果相同）
+# 2. Sharpness = blend(SMOOTH(img), img, f) = f*img - (f-1)*SMOOTH(img)，
+#    直接合成一個 3x3 kernel，只做一次卷積
+# 3. 一次處理 DEEP_FRY_BAND_ROWS 列再貼回原畫布，中間圖只有一條帶子那麼大，
+#    不會同時有好幾張整張的複本（卷積要上下各多讀一列，結果跟整張一起做相同）
+
+DEEP_FRY_SATURATION = 3.0
+DEEP_FRY_CONTRAST = 2.0
+DEEP_FRY_SHARPNESS = 10.0
+DEEP_FRY_BAND_ROWS = 128
+
+# ITU-R 601-2 luma，跟 Pillow convert("L") 用的係數一樣
+_LUMA = (0.299, 0.587, 0.114)
+
+
+def _saturation_matrix(factor: float) -> tuple:
+    """out = factor * c + (1 - factor) * L"""
+    rows = []
+    for channel in range(3):
+        row = [(1 - factor) * w for w in _LUMA]
+        row[channel] += factor
+        rows.extend(row + [0.0])
+    return tuple(rows)
+
+
+def _sharpen_kernel(factor: float) -> ImageFilter.Kernel:
+    # SMOOTH kernel 是 [1,1,1,1,5,1,1,1,1] / 13
+    scale = 13
+    others = -(factor - 1)
+    center = factor * scale - (factor - 1) * 5
+    weights = [others] * 4 + [center] + [others] * 4
+    return ImageFilter.Kernel((3, 3), weights, scale=scale)
+
+
+_SATURATION_MATRIX = _saturation_matrix(DEEP_FRY_SATURATION)
+_SHARPEN_KERNEL = _sharpen_kernel(DEEP_FRY_SHARPNESS)
+
+
+def fused_deep_fry(img: Image.Image) -> Image.Image:
+    """
+    彩蛋：電子包漿特效（高飽和、高對比、過度銳化）。
+    模擬那種被轉傳了幾萬次的失真感。
+
+    RGB 的圖直接就地修改並回傳同一張；其他模式先轉成 RGB（最後輸出本來就是不透明的 RGB）。
+    """
+    rgb = img if img.mode == "RGB" else img.convert("RGB")
+
+    # 對比度要用「飽和之後」的平均亮度，用縮小圖估就夠準
+    small = rgb.reduce(8).convert("RGB", _SATURATION_MATRIX)
+    mean = ImageStat.Stat(small.convert("L")).mean[0]
+
+    k = DEEP_FRY_CONTRAST
+    offset = (1 - k) * int(mean + 0.5)
+    matrix = []
+    for i, value in enumerate(_SATURATION_MATRIX):
+        if i % 4 == 3:
+            matrix.append(offset)
+        else:
+            matrix.append(value * k)
+    matrix = tuple(matrix)
+
+    width, height = rgb.size
+    # 上一條的結果等下一條讀完邊界列才貼回去，下一條讀到的才是原圖
+    pending = None
+    for top in range(0, height, DEEP_FRY_BAND_ROWS):
+        bottom = min(height, top + DEEP_FRY_BAND_ROWS)
+        src_top = max(0, top - 1)
+        band = rgb.crop((0, src_top, width, min(height, bottom + 1)))
+        if pending is not None:
+            rgb.paste(*pending)
+        band = band.convert("RGB", matrix).filter(_SHARPEN_KERNEL)
+        pending = (
+            band.crop((0, top - src_top, width, top - src_top + bottom - top)),
+            (0, top),
+        )
+    if pending is not None:
+        rgb.paste(*pending)
+    return rgb
+
+
+@register_effect("deep_fry")
+def deep_fry_effect(img: Image.Image, ctx: EffectContext) -> Image.Image:
+    return fused_deep_fry(img)
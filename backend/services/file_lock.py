@@ -0,0 +1,40 @@
+from contextlib import contextmanager
+from typing import IO, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# ===== 跨 process 的檔案鎖 =====
+#
+# 額度狀態檔、共用背景池都要讓多個 worker 輪流寫。
+# POSIX 用 flock；Windows（開發機）沒有 fcntl，改用 msvcrt.locking 鎖檔案的第一個 byte。
+
+
+@contextmanager
+def locked(f: IO) -> Iterator[None]:
+    """拿到 f 的獨佔鎖才往下執行，離開時放掉。其他 process 會在這裡等。"""
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+        return
+
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            break
+        except OSError:
+            # LK_LOCK 重試 10 秒還拿不到會丟 OSError，繼續等
+            continue
+    try:
+        yield
+    finally:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,353 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import unicodedata
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from .structured_logging import get_logger
+
+log = get_logger("fonts")
+
+
+# ===== 字型備援（缺字換字型畫） =====
+#
+# edukai 沒有 emoji、也缺一些罕用字 / 符號，以前只能先 remove_emoji，其他缺的字就畫成方框。
+# 這裡：
+# - 每個字型啟動時讀一次 cmap，轉成 0x110000 bits 的覆蓋表（約 136 KB），
+#   查「這個字型有沒有這個字」就是一次 bytes 索引 + 位移，O(1)
+# - FontChain 依序是：主字型（FONT_PATH）→ config/fonts.json 的 fallbacks，
+#   不存在的檔案直接略過；同一個字用哪個字型只算一次（dict）
+# - FontStack 是某個字級的一整組字型，介面跟 ImageFont 一樣（getlength / getbbox），
+#   排版（layout_spec / text_layout）完全不用知道有備援；畫的時候用 draw_text，
+#   一次掃過文字切成「同一個字型」的片段，各自畫、基線對齊主字型
+# - 彩色 emoji：color 的字型用 embedded_color 畫；Noto / Apple 這類只有固定點陣大小的
+#   （bitmap_size），先用原生大小畫在小圖層上再縮放貼上
+
+FONT_CONFIG_PATH = Path(__file__).resolve().parent.parent / "config" / "fonts.json"
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+UNICODE_SIZE = 0x110000
+
+# 接在前一個字後面、要跟它用同一個字型畫的字（emoji 變體、ZWJ、膚色、旗幟 tag...）；
+# ZWJ 後面的字也跟前面黏在一起（👨‍👩‍👧 是一個 emoji）
+ZWJ = "\u200d"
+JOINERS = frozenset(
+    [0x200C, 0x200D, 0xFE0E, 0xFE0F, 0x20E3]
+    + list(range(0x1F3FB, 0x1F400))
+    + list(range(0xE0020, 0xE0080))
+)
+
+Font = ImageFont.FreeTypeFont | ImageFont.ImageFont
+
+
+# ===== cmap → 覆蓋表 =====
+
+def _u16(data, offset: int) -> int:
+    return struct.unpack_from(">H", data, offset)[0]
+
+
+def _u32(data, offset: int) -> int:
+    return struct.unpack_from(">I", data, offset)[0]
+
+
+def _cmap_format4(data, offset: int, covered: np.ndarray) -> None:
+    seg_x2 = _u16(data, offset + 6)
+    ends = offset + 14
+    starts = ends + seg_x2 + 2
+    deltas = starts + seg_x2
+    ranges = deltas + seg_x2
+    for i in range(seg_x2 // 2):
+        end = _u16(data, ends + 2 * i)
+        start = _u16(data, starts + 2 * i)
+        delta = _u16(data, deltas + 2 * i)
+        range_offset = _u16(data, ranges + 2 * i)
+        if start == 0xFFFF or start > end:
+            continue
+        if range_offset == 0:
+            covered[start:end + 1] = True
+            # 算出 glyph 0（.notdef）的那個字其實沒有
+            missing = (0x10000 - delta) & 0xFFFF
+            if start <= missing <= end:
+                covered[missing] = False
+            continue
+        base = ranges + 2 * i + range_offset
+        for code in range(start, end + 1):
+            glyph = _u16(data, base + 2 * (code - start))
+            if glyph and (glyph + delta) & 0xFFFF:
+                covered[code] = True
+
+
+def _cmap_format12(data, offset: int, covered: np.ndarray) -> None:
+    groups = _u32(data, offset + 12)
+    for i in range(groups):
+        start, end, glyph = struct.unpack_from(">III", data, offset + 16 + 12 * i)
+        end = min(end, UNICODE_SIZE - 1)
+        if start > end:
+            continue
+        covered[start:end + 1] = True
+        if glyph == 0:
+            covered[start] = False
+
+
+def read_coverage(path: str, index: int = 0) -> bytes:
+    """讀字型檔的 cmap，回傳 0x110000 bits 的覆蓋表（bit i = 有沒有 U+i）。"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        offset = 0
+        if data[:4] == b"ttcf":
+            offset = _u32(data, 12 + 4 * index)
+        cmap = None
+        for i in range(_u16(data, offset + 4)):
+            record = offset + 12 + 16 * i
+            if data[record:record + 4] == b"cmap":
+                cmap = _u32(data, record + 8)
+                break
+        if cmap is None:
+            raise ValueError(f"No cmap table in {path}")
+
+        # 優先用 format 12（整個 Unicode），沒有才用 format 4（只有 BMP）
+        subtables: Dict[int, int] = {}
+        for i in range(_u16(data, cmap + 2)):
+            platform, encoding, sub = struct.unpack_from(">HHI", data, cmap + 4 + 8 * i)
+            if (platform, encoding) in ((3, 10), (3, 1), (3, 0)) or platform == 0:
+                fmt = _u16(data, cmap + sub)
+                if fmt in (4, 12):
+                    subtables.setdefault(fmt, cmap + sub)
+
+        covered = np.zeros(UNICODE_SIZE, dtype=bool)
+        if 12 in subtables:
+            _cmap_format12(data, subtables[12], covered)
+        elif 4 in subtables:
+            _cmap_format4(data, subtables[4], covered)
+        else:
+            raise ValueError(f"No unicode cmap (format 4 / 12) in {path}")
+    return np.packbits(covered, bitorder="little").tobytes()
+
+
+# ===== 字型設定 =====
+
+@dataclass
+class FontSource:
+    path: str
+    index: int = 0
+    color: bool = False
+    bitmap_size: int | None = None   # 只有固定點陣大小的彩色字型
+    coverage: bytes | None = field(default=None, repr=False)  # None = 當作什麼字都有
+
+    def covers(self, code: int) -> bool:
+        coverage = self.coverage
+        return coverage is None or (coverage[code >> 3] >> (code & 7)) & 1 == 1
+
+
+def _resolve(path: str) -> str:
+    return path if os.path.isabs(path) or ":" in path else str(BACKEND_DIR / path)
+
+
+def load_font_sources(primary: str | None, path: str | Path = FONT_CONFIG_PATH) -> List[FontSource]:
+    """主字型 + fonts.json 的 fallbacks，只留下存在、cmap 讀得到的。"""
+    entries = [{"path": primary}] if primary else []
+    try:
+        with open(path, encoding="utf-8") as f:
+            entries += json.load(f).get("fallbacks", [])
+    except FileNotFoundError:
+        pass
+
+    sources: List[FontSource] = []
+    seen = set()
+    for entry in entries:
+        font_path = _resolve(entry["path"])
+        if font_path in seen or not os.path.exists(font_path):
+            continue
+        seen.add(font_path)
+        source = FontSource(
+            path=font_path,
+            index=int(entry.get("index", 0)),
+            color=bool(entry.get("color", False)),
+            bitmap_size=entry.get("bitmap_size"),
+        )
+        try:
+            source.coverage = read_coverage(font_path, source.index)
+        except Exception as exc:
+            log.warning("Skip font without readable cmap", extra={"path": font_path, "error": str(exc)})
+            continue
+        sources.append(source)
+    log.info("Font chain loaded", extra={"fonts": [s.path for s in sources]})
+    return sources
+
+
+class FontChain:
+    """依序的字型清單；字 → 用第幾個字型畫，算過就記住。"""
+
+    def __init__(self, sources: Sequence[FontSource]):
+        self.sources = list(sources)
+        self._choice: Dict[str, int] = {}
+        self._stacks: Dict[int, "FontStack"] = {}
+        self._lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return bool(self.sources)
+
+    @property
+    def has_color_emoji(self) -> bool:
+        return any(source.color for source in self.sources)
+
+    def source_for(self, ch: str) -> int:
+        index = self._choice.get(ch)
+        if index is None:
+            code = ord(ch)
+            # 都沒有就用主字型（畫成方框，至少看得出少了字）
+            index = next(
+                (i for i, source in enumerate(self.sources) if source.covers(code)), 0
+            )
+            self._choice[ch] = index
+        return index
+
+    def segments(self, text: str) -> List[Tuple[int, str]]:
+        """一次掃過，切成 [(字型 index, 片段)]；emoji 修飾字跟著前一個字。"""
+        out: List[Tuple[int, str]] = []
+        current = -1
+        start = 0
+        for i, ch in enumerate(text):
+            if current >= 0 and (
+                ord(ch) in JOINERS or unicodedata.combining(ch) or text[i - 1] == ZWJ
+            ):
+                continue
+            index = self.source_for(ch)
+            if index != current:
+                if current >= 0:
+                    out.append((current, text[start:i]))
+                current, start = index, i
+        if current >= 0:
+            out.append((current, text[start:]))
+        return out
+
+    def at(self, size: int) -> "FontStack":
+        stack = self._stacks.get(size)
+        if stack is None:
+            with self._lock:
+                stack = self._stacks.setdefault(size, FontStack(self, size))
+        return stack
+
+
+# ===== 某個字級的一組字型 =====
+
+class _Face:
+    """一個字型在某個字級的樣子；點陣 emoji 用原生大小畫再縮放（scale）。"""
+
+    def __init__(self, source: FontSource, size: int):
+        self.color = source.color
+        self.scale = 1.0
+        load_size = size
+        if source.bitmap_size:
+            load_size = source.bitmap_size
+            self.scale = size / source.bitmap_size
+        self.font = ImageFont.truetype(source.path, load_size, index=source.index)
+
+    def length(self, text: str) -> float:
+        return self.font.getlength(text) * self.scale
+
+    def bbox(self, text: str, stroke: int) -> Tuple[float, float, float, float]:
+        """以基線為原點的外框（已經乘上 scale）。"""
+        stroke = 0 if self.color else stroke
+        left, top, right, bottom = self.font.getbbox(text, stroke_width=stroke, anchor="ls")
+        s = self.scale
+        return left * s, top * s, right * s, bottom * s
+
+
+class FontStack:
+    """
+    跟 ImageFont 一樣有 getlength / getbbox / size，排版程式直接當一般字型用；
+    座標跟主字型的預設 anchor（la）一致，畫的時候要用 draw_text。
+    """
+
+    def __init__(self, chain: FontChain, size: int):
+        self.chain = chain
+        self.size = size
+        self._faces: Dict[int, _Face] = {}
+        self.ascent = self.face(0).font.getmetrics()[0]
+
+    def face(self, index: int) -> _Face:
+        face = self._faces.get(index)
+        if face is None:
+            face = _Face(self.chain.sources[index], self.size)
+            self._faces[index] = face
+        return face
+
+    def getlength(self, text: str, *args, **kwargs) -> float:
+        return sum(self.face(i).length(part) for i, part in self.chain.segments(text))
+
+    def getbbox(self, text: str, *args, stroke_width: int = 0, **kwargs) -> Tuple[int, int, int, int]:
+        x = 0.0
+        box = None
+        for i, part in self.chain.segments(text):
+            face = self.face(i)
+            left, top, right, bottom = face.bbox(part, stroke_width)
+            part_box = (x + left, self.ascent + top, x + right, self.ascent + bottom)
+            box = part_box if box is None else (
+                min(box[0], part_box[0]), min(box[1], part_box[1]),
+                max(box[2], part_box[2]), max(box[3], part_box[3]),
+            )
+            x += face.length(part)
+        if box is None:
+            return 0, 0, 0, 0
+        return int(box[0]), int(box[1]), int(round(box[2])), int(round(box[3]))
+
+    def getmetrics(self) -> Tuple[int, int]:
+        return self.face(0).font.getmetrics()
+
+
+def _paste_scaled(image: Image.Image, face: _Face, text: str, x: float, baseline: float) -> None:
+    left, top, right, bottom = face.font.getbbox(text, anchor="ls")
+    if right <= left or bottom <= top:
+        return
+    layer = Image.new("RGBA", (right - left, bottom - top), (0, 0, 0, 0))
+    ImageDraw.Draw(layer).text((-left, -top), text, font=face.font, anchor="ls", embedded_color=True)
+    size = (
+        max(1, int(round(layer.width * face.scale))),
+        max(1, int(round(layer.height * face.scale))),
+    )
+    layer = layer.resize(size, Image.LANCZOS)
+    dest = (int(round(x + left * face.scale)), int(round(baseline + top * face.scale)))
+    image.paste(layer, dest, layer)
+
+
+def draw_text(
+    image: Image.Image,
+    draw: ImageDraw.ImageDraw,
+    xy: Tuple[int, int],
+    text: str,
+    font: Font | FontStack,
+    fill,
+    stroke_width: int = 0,
+    stroke_fill=None,
+) -> None:
+    """跟 draw.text 一樣（左上角 anchor）；font 是 FontStack 的話依字型分段畫。"""
+    if not isinstance(font, FontStack):
+        draw.text(xy, text, font=font, fill=fill, stroke_width=stroke_width, stroke_fill=stroke_fill)
+        return
+
+    x, y = xy
+    baseline = y + font.ascent
+    for i, part in font.chain.segments(text):
+        face = font.face(i)
+        if face.scale != 1.0:
+            _paste_scaled(image, face, part, x, baseline)
+        elif face.color:
+            draw.text((x, baseline), part, font=face.font, anchor="ls", embedded_color=True)
+        else:
+            draw.text(
+                (x, baseline),
+                part,
+                font=face.font,
+                anchor="ls",
+                fill=fill,
+                stroke_width=stroke_width,
+                stroke_fill=stroke_fill,
+            )
+        x += face.length(part)
@@ -1,10 +1,11 @@
-import glob
-import os
 import random
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 from PIL import Image, ImageDraw, ImageFont, ImageStat
 
+from .layout_spec import load_layout_specs
+from .sticker_atlas import get_sticker_atlas
+
 
 # ===== 亮度 / 顏色相關 =====
 
@@ -120,58 +121,56 @@ def region_complexity(img: Image.Image, box: Tuple[int, int, int, int]) -> float
     return float(stat.stddev[0])
 
 
-def pick_best_layout(bg: Image.Image, available_layouts: List[str]) -> str:
-    """
-    根據背景圖各區塊的「乾淨程度」來挑 layout：
-    複雜度最小的區域，就是最適合放字的 layout。
-    """
+# 每個 layout 的主要文字區域（比例座標 x1, y1, x2, y2）。
+# 跟畫字用的是同一份 config/layouts.json，改版面就不用兩邊一起改。
+LAYOUT_REGIONS: Dict[str, List[Tuple[float, float, float, float]]] = (
+    load_layout_specs().regions()
+)
+
+
+def layout_scores(
+    bg: Image.Image,
+    available_layouts: List[str],
+    regions: Dict[str, List[Tuple[float, float, float, float]]] | None = None,
+) -> Dict[str, float]:
+    """每個 layout 文字區域的平均複雜度，越小越乾淨。"""
     width, height = bg.size
+    result = {}
 
-    # 每個 layout 可能用到的主要文字區域（可以之後再微調）
-    regions = {
-        "center": [
-            (width * 0.15, height * 0.28, width * 0.85, height * 0.65),
-        ],
-        "top_bottom": [
-            (width * 0.15, height * 0.10, width * 0.85, height * 0.28),  # 上面標題
-            (width * 0.15, height * 0.60, width * 0.85, height * 0.88),  # 下面副標
-        ],
-        "left_block": [
-            (width * 0.08, height * 0.20, width * 0.55, height * 0.80),
-        ],
-        "vertical": [
-            (width * 0.70, height * 0.15, width * 0.94, height * 0.82),
-        ],
-        "diagonal": [
-            (width * 0.18, height * 0.25, width * 0.82, height * 0.70),
-        ],
-    }
-
-    best_layout = None
-    best_score = None
-
-    for layout, boxes in regions.items():
+    for layout, boxes in (regions or LAYOUT_REGIONS).items():
         if layout not in available_layouts:
             continue
 
         scores = []
-        for box in boxes:
+        for x1, y1, x2, y2 in boxes:
+            box = (width * x1, height * y1, width * x2, height * y2)
             scores.append(region_complexity(bg, box))
 
         if not scores:
             continue
 
-        avg_score = sum(scores) / len(scores)
+        result[layout] = sum(scores) / len(scores)
 
-        if best_score is None or avg_score < best_score:
-            best_score = avg_score
-            best_layout = layout
+    return result
 
-    if best_layout:
-        return best_layout
+
+def pick_best_layout(
+    bg: Image.Image,
+    available_layouts: List[str],
+    regions: Dict[str, List[Tuple[float, float, float, float]]] | None = None,
+    rng: random.Random | None = None,
+) -> str:
+    """
+    根據背景圖各區塊的「乾淨程度」來挑 layout：
+    複雜度最小的區域，就是最適合放字的 layout。
+    """
+    scores = layout_scores(bg, available_layouts, regions)
+
+    if scores:
+        return min(scores, key=scores.get)
 
     # 萬一都失敗，就退回原本的隨機
-    return random.choice(available_layouts)
+    return (rng or random).choice(available_layouts)
 
 
 # ===== 畫文字相關 =====
@@ -296,71 +295,39 @@ def measure_vertical_text_height(
 # ===== 貼紙相關 =====
 
 
-def maybe_add_sticker(bg: Image.Image, sticker_dir: str) -> None:
+def maybe_add_sticker(
+    bg: Image.Image, sticker_dir: str, rng: random.Random | None = None
+) -> None:
     """
     如果指定資料夾下有 png/webp，就隨機挑一張貼在四個角其中一個。
+    貼紙只在第一次（或資料夾有變動時）讀檔，之後直接用縮好的版本。
     """
-    if not os.path.isdir(sticker_dir):
-        return
-
-    candidates = [
-        p for p in glob.glob(os.path.join(sticker_dir, "*.*"))
-        if p.lower().endswith((".png", ".webp"))
-    ]
-    if not candidates:
-        return
-
-    path = random.choice(candidates)
-    try:
-        sticker = Image.open(path).convert("RGBA")
-    except Exception:
-        return
-
-    max_size = int(bg.width * 0.18)
-    sticker.thumbnail((max_size, max_size), Image.LANCZOS)
-
-    corner = random.choice(["tl", "tr", "bl", "br"])
-    margin = int(bg.width * 0.03)
-
-    if corner == "tl":
-        pos = (margin, margin)
-    elif corner == "tr":
-        pos = (bg.width - sticker.width - margin, margin)
-    elif corner == "bl":
-        pos = (margin, bg.height - sticker.height - margin)
-    else:
-        pos = (
-            bg.width - sticker.width - margin,
-            bg.height - sticker.height - margin,
-        )
+    get_sticker_atlas(sticker_dir).add_to(bg, rng)
 
-    bg.alpha_composite(sticker, dest=pos)
 
-
-def add_snow_effect(img: Image.Image) -> None:
+def add_snow_effect(img: Image.Image, rng: random.Random | None = None) -> None:
     """
-    在圖片上畫出隨機分佈的半透明雪花。
+    在圖片上畫出隨機分佈的半透明雪花（直接畫在 img 上）。
+    雪花只需要透明度，用一張單通道的 L 遮罩當圖層，不用整張 RGBA。
     """
-    # 建立一個可以用來畫半透明圖層的物件
-    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay)
+    rng = rng or random
+    # 遮罩的值就是雪花的不透明度
+    mask = Image.new("L", img.size, 0)
+    draw = ImageDraw.Draw(mask)
     width, height = img.size
 
     # 雪花數量，隨機 100~200 顆
-    num_flakes = random.randint(100, 200)
+    num_flakes = rng.randint(100, 200)
 
     for _ in range(num_flakes):
-        x = random.randint(0, width)
-        y = random.randint(0, height)
+        x = rng.randint(0, width)
+        y = rng.randint(0, height)
         # 雪花大小不一 (半徑 2~6)
-        radius = random.randint(2, 6)
+        radius = rng.randint(2, 6)
         # 透明度隨機 (150~230)，營造遠近感 (255是不透明)
-        alpha = random.randint(150, 230)
+        alpha = rng.randint(150, 230)
 
-        draw.ellipse(
-            (x, y, x + radius, y + radius),
-            fill=(255, 255, 255, alpha)
-        )
+        draw.ellipse((x, y, x + radius, y + radius), fill=alpha)
 
-    # 將雪花圖層疊加到原圖上
-    img.alpha_composite(overlay)
+    # 用遮罩把白色疊到原圖上
+    img.paste((255, 255, 255), mask=mask)
@@ -0,0 +1,157 @@
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from .structured_logging import get_logger
+
+log = get_logger("intent_router")
+
+
+# ===== LINE 訊息 -> 主題 的關鍵字路由 =====
+#
+# 關鍵字表放在 config/intents.json：
+# - themes：由上到下是優先順序，訊息裡出現任一關鍵字就命中
+#   （layout 可以強制指定版面，例如地獄梗固定置中）
+# - modifiers：額外的後綴（例如「開 / 炸」-> _retro 電子包漿）
+# - commands：訊息完全等於主題名稱時直接用該主題
+#
+# 所有關鍵字編成一個 regex，每則訊息只掃一次。
+# 設定檔改了會自動重新載入，不用重開服務。
+
+RELOAD_CHECK_INTERVAL = 1.0
+
+
+@dataclass(frozen=True)
+class Intent:
+    theme: str        # 合成用的主題（可能帶 _retro 之類的後綴）
+    base_theme: str   # 給 LLM 用的乾淨主題
+    layout: str       # "auto" 或強制的 layout
+
+
+class KeywordMatcher:
+    """
+    把所有關鍵字編成一個 regex，一次掃過文字找出所有命中（包含重疊的）關鍵字。
+
+    用 (?=(k1|k2|...)) 在每個位置找「最長」的關鍵字（在 C 裡跑，比 Python 迴圈快）；
+    同一個位置較短的關鍵字一定是最長那個的前綴，所以預先把前綴的 payload
+    也併進去，就不會漏掉任何命中。
+    """
+
+    def __init__(self, patterns: List[Tuple[str, int]]):
+        payloads: Dict[str, set] = {}
+        for word, payload in patterns:
+            if word:
+                payloads.setdefault(word, set()).add(payload)
+
+        self._payloads: Dict[str, frozenset] = {}
+        for word in payloads:
+            merged = set()
+            for other, other_payloads in payloads.items():
+                if word.startswith(other):
+                    merged |= other_payloads
+            self._payloads[word] = frozenset(merged)
+
+        words = sorted(payloads, key=len, reverse=True)
+        self._regex = re.compile(
+            "(?=(" + "|".join(re.escape(w) for w in words) + "))"
+        ) if words else None
+
+    def payloads(self, text: str) -> set:
+        found = set()
+        if self._regex is None:
+            return found
+        for word in self._regex.findall(text):
+            found |= self._payloads[word]
+        return found
+
+
+class IntentRouter:
+    def __init__(self, config_path: str):
+        self.config_path = config_path
+        self._lock = threading.Lock()
+        self._mtime: int | None = None
+        self._last_check = 0.0
+        self._load()
+
+    # ===== 載入 / 編譯 =====
+
+    def _load(self) -> None:
+        with open(self.config_path, encoding="utf-8") as f:
+            config = json.load(f)
+
+        rules = config.get("themes", [])
+        modifiers = config.get("modifiers", [])
+
+        # payload < len(rules) 是主題規則，之後的是 modifier
+        patterns = []
+        for i, rule in enumerate(rules):
+            patterns.extend((k.lower(), i) for k in rule["keywords"])
+        for j, modifier in enumerate(modifiers):
+            patterns.extend((k.lower(), len(rules) + j) for k in modifier["keywords"])
+
+        compiled = (
+            KeywordMatcher(patterns),
+            [(r["theme"], r.get("layout", "auto")) for r in rules],
+            [m["suffix"] for m in modifiers],
+            set(config.get("commands", [])),
+            config.get("default_theme", "life"),
+        )
+        # 一次換掉整組，讀的人不會拿到一半新一半舊的設定
+        self._compiled = compiled
+        self._mtime = os.stat(self.config_path).st_mtime_ns
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._last_check < RELOAD_CHECK_INTERVAL:
+            return
+        with self._lock:
+            self._last_check = now
+            try:
+                mtime = os.stat(self.config_path).st_mtime_ns
+            except OSError:
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                self._load()
+                log.info("Reloaded intents", extra={"path": self.config_path})
+            except Exception as e:
+                # 設定檔寫壞了就繼續用舊的
+                self._mtime = mtime
+                log.warning(
+                    "Failed to reload intents",
+                    extra={"path": self.config_path, "error": str(e)},
+                )
+
+    # ===== 對外 =====
+
+    def route(self, text: str) -> Intent | None:
+        """
+        回傳訊息對應的 Intent；不是任何關鍵字或指令就回 None。
+        """
+        self._maybe_reload()
+        matcher, rules, suffixes, commands, default_theme = self._compiled
+
+        if text in commands:
+            return Intent(theme=text, base_theme=text, layout="auto")
+
+        hits = matcher.payloads(text.lower())
+        if not hits:
+            return None
+
+        rule_hits = [h for h in hits if h < len(rules)]
+        if rule_hits:
+            base_theme, layout = rules[min(rule_hits)]
+        else:
+            base_theme, layout = default_theme, "auto"
+
+        theme = base_theme
+        for h in sorted(hits):
+            if h >= len(rules):
+                theme += suffixes[h - len(rules)]
+
+        return Intent(theme=theme, base_theme=base_theme, layout=layout)
@@ -0,0 +1,425 @@
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Mapping, Tuple
+
+from PIL import ImageFont
+
+from .text_layout import fit_rows, metrics_for
+
+
+# ===== 宣告式版面 =====
+#
+# 每個 layout 長什麼樣子寫在 config/layouts.json，不用改 Python 就能加新版面：
+# - boxes：文字區（比例座標 rect），同時也是挑 layout / 挑背景時算「乾淨程度」的區域
+#   （score: false 的不算，例如只有英文時才會出現的那一行）
+# - flow：rows 是橫書一塊接一塊往下排；columns 是直書一欄接一欄排
+# - align / valign：在 rect 裡靠哪邊（columns 的 align 也決定欄往哪個方向長）
+# - blocks：要畫的文字（title / subtitle / footer / english）、字型角色、描邊、行距
+#   filter：cjk 只留非 ASCII（直書用）、nospace 拿掉空白
+# - 橫書依實際字寬在 rect 寬度內斷行（text_layout.py）；min_scale < 1 的話
+#   塞不下時整塊字一起縮小，最小縮到 min_scale
+# - rotate：整塊字以文字區中心逆時針轉幾度（diagonal），畫法見 rotated_text.py
+#
+# 數值（字級、描邊、間距）以 reference_side（1024）設計，其他尺寸依短邊等比例縮放。
+# LayoutEngine.compile 把 spec 換算成像素、載好字型，依 (layout, 畫布大小, 字型) 快取；
+# 每次請求只剩量實際字串的寬高、算座標。
+
+LAYOUT_SPEC_PATH = Path(__file__).resolve().parent.parent / "config" / "layouts.json"
+
+FLOWS = ("rows", "columns")
+ALIGNS = ("left", "center", "right")
+VALIGNS = ("top", "middle", "bottom")
+TEXT_SOURCES = ("title", "subtitle", "footer", "english")
+FILTERS = (None, "cjk", "nospace")
+
+# 直書估欄寬用的字
+COLUMN_SAMPLE_CHAR = "永"
+
+Font = ImageFont.FreeTypeFont | ImageFont.ImageFont
+
+
+def scaled_px(value: float, scale: float) -> int:
+    """把以 reference_side 設計的像素值換算成目前畫布大小；0 維持 0，其他最少 1px。"""
+    if value <= 0:
+        return 0
+    return max(1, int(round(value * scale)))
+
+
+# ===== spec =====
+
+@dataclass(frozen=True)
+class BlockSpec:
+    text: str
+    font: str
+    color: str
+    stroke: int = 0
+    stroke_color: str = "title"
+    line_gap: int = 0
+    filter: str | None = None
+
+
+@dataclass(frozen=True)
+class BoxSpec:
+    rect: Tuple[float, float, float, float]
+    flow: str
+    align: str
+    valign: str
+    gap: int
+    score: bool
+    blocks: Tuple[BlockSpec, ...]
+    rotate: float = 0.0
+    min_scale: float = 1.0
+
+
+@dataclass(frozen=True)
+class LayoutSpec:
+    key: str
+    name: str
+    boxes: Tuple[BoxSpec, ...]
+
+    def regions(self) -> List[Tuple[float, float, float, float]]:
+        """挑 layout / 背景時要看的文字區（比例座標）。"""
+        return [box.rect for box in self.boxes if box.score]
+
+
+def _parse_box(layout: str, raw: dict, fonts: Mapping[str, int]) -> BoxSpec:
+    box = BoxSpec(
+        rect=tuple(float(v) for v in raw["rect"]),
+        flow=raw.get("flow", "rows"),
+        align=raw.get("align", "center"),
+        valign=raw.get("valign", "top"),
+        gap=int(raw.get("gap", 0)),
+        score=bool(raw.get("score", True)),
+        blocks=tuple(BlockSpec(**block) for block in raw.get("blocks", [])),
+        rotate=float(raw.get("rotate", 0)),
+        min_scale=float(raw.get("min_scale", 1)),
+    )
+    x1, y1, x2, y2 = box.rect
+    if len(box.rect) != 4 or not (0 <= x1 < x2 <= 1 and 0 <= y1 < y2 <= 1):
+        raise ValueError(f"[{layout}] rect must be 0 <= x1 < x2 <= 1: {box.rect}")
+    if box.flow not in FLOWS:
+        raise ValueError(f"[{layout}] unknown flow: {box.flow}")
+    if box.align not in ALIGNS or box.valign not in VALIGNS:
+        raise ValueError(f"[{layout}] unknown align: {box.align} / {box.valign}")
+    if not -90 < box.rotate < 90:
+        raise ValueError(f"[{layout}] rotate must be between -90 and 90: {box.rotate}")
+    if not 0 < box.min_scale <= 1:
+        raise ValueError(f"[{layout}] min_scale must be in (0, 1]: {box.min_scale}")
+    for block in box.blocks:
+        if block.text not in TEXT_SOURCES:
+            raise ValueError(f"[{layout}] unknown text source: {block.text}")
+        if block.font not in fonts:
+            raise ValueError(f"[{layout}] unknown font role: {block.font}")
+        if block.filter not in FILTERS:
+            raise ValueError(f"[{layout}] unknown filter: {block.filter}")
+    return box
+
+
+@dataclass(frozen=True)
+class LayoutSpecs:
+    reference_side: int
+    fonts: Dict[str, int]
+    layouts: Dict[str, LayoutSpec]
+
+    def names(self) -> List[str]:
+        return list(self.layouts)
+
+    def regions(self) -> Dict[str, List[Tuple[float, float, float, float]]]:
+        return {key: spec.regions() for key, spec in self.layouts.items()}
+
+
+def load_layout_specs(path: str | Path = LAYOUT_SPEC_PATH) -> LayoutSpecs:
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    fonts = {role: int(size) for role, size in raw["fonts"].items()}
+    layouts = {
+        key: LayoutSpec(
+            key=key,
+            name=value.get("name", key),
+            boxes=tuple(_parse_box(key, box, fonts) for box in value["boxes"]),
+        )
+        for key, value in raw["layouts"].items()
+    }
+    return LayoutSpecs(
+        reference_side=int(raw.get("reference_side", 1024)),
+        fonts=fonts,
+        layouts=layouts,
+    )
+
+
+# ===== 編譯後的 placement plan =====
+
+@dataclass(frozen=True)
+class CompiledBlock:
+    spec: BlockSpec
+    font: Font
+    font_px: int
+    stroke: int
+    line_gap: int
+    column_width: int   # 直書欄寬（columns 才有用）
+
+
+@dataclass(frozen=True)
+class CompiledBox:
+    spec: BoxSpec
+    rect: Tuple[int, int, int, int]
+    center_x: int       # 從比例座標直接算，跟 (x1 + x2) // 2 可能差 1px
+    gap: int
+    blocks: Tuple[CompiledBlock, ...]
+
+
+@dataclass(frozen=True)
+class PlacementPlan:
+    layout: str
+    size: Tuple[int, int]
+    boxes: Tuple[CompiledBox, ...]
+
+
+@dataclass(frozen=True)
+class GlyphRun:
+    """畫一段字所需的一切；color / stroke_color 是角色名稱（title / subtitle）。"""
+    text: str
+    x: int
+    y: int
+    font: Font
+    color: str
+    stroke: int
+    stroke_color: str
+
+
+@dataclass(frozen=True)
+class PlacedBox:
+    """一個文字區排好的結果；rotate 不是 0 的話 runs 要當成一整塊旋轉。"""
+    rotate: float
+    runs: Tuple[GlyphRun, ...]
+
+
+def english_text(title: str, subtitle: str) -> str:
+    """標題 + 副標裡的英文數字（直書版面另外橫排在下面）。"""
+    chars = [
+        ch for ch in f"{title} {subtitle}"
+        if ch.isascii() and (ch.isalpha() or ch.isdigit() or ch.isspace())
+    ]
+    # 把多個空白縮成一個，避免空格亂七八糟
+    return " ".join("".join(chars).split())
+
+
+def _apply_filter(text: str, name: str | None) -> str:
+    if name == "cjk":
+        return "".join(ch for ch in text if not ch.isspace() and ord(ch) >= 128)
+    if name == "nospace":
+        return "".join(ch for ch in text if not ch.isspace())
+    return text
+
+
+def _measure(font: Font, text: str, stroke: int) -> Tuple[int, int]:
+    left, top, right, bottom = font.getbbox(text, stroke_width=stroke)
+    return right - left, bottom - top
+
+
+# 編譯好的 placement plan 最多留幾份。寬高是 client 給的（256~2048 任意整數），
+# 不設上限的話換尺寸一直打就能把 worker 記憶體撐爆；常用尺寸一直被用到，不會被擠掉
+PLAN_CACHE_SIZE = 256
+
+
+class LayoutEngine:
+    def __init__(
+        self,
+        specs: LayoutSpecs,
+        load_font: Callable[[int], Font],
+        font_key: str | None = None,
+        max_plans: int = PLAN_CACHE_SIZE,
+    ):
+        self.specs = specs
+        self.load_font = load_font
+        self.font_key = font_key
+        self.max_plans = max_plans
+        self._lock = threading.Lock()
+        # LRU：最近用過的放最後面
+        self._plans: "OrderedDict[Tuple, PlacementPlan]" = OrderedDict()
+
+    # ===== 編譯（有快取） =====
+
+    def compile(self, layout: str, size: Tuple[int, int]) -> PlacementPlan:
+        key = (layout, size, self.font_key)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                return plan
+        plan = self._compile(self.specs.layouts[layout], size)
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return plan
+
+    def _compile(self, spec: LayoutSpec, size: Tuple[int, int]) -> PlacementPlan:
+        width, height = size
+        scale = min(width, height) / self.specs.reference_side
+        boxes = []
+        for box in spec.boxes:
+            x1, y1, x2, y2 = box.rect
+            blocks = []
+            for block in box.blocks:
+                font_px = scaled_px(self.specs.fonts[block.font], scale)
+                font = self.load_font(font_px)
+                stroke = scaled_px(block.stroke, scale)
+                column_width = 0
+                if box.flow == "columns":
+                    column_width, _ = _measure(font, COLUMN_SAMPLE_CHAR, stroke)
+                blocks.append(CompiledBlock(
+                    spec=block,
+                    font=font,
+                    font_px=font_px,
+                    stroke=stroke,
+                    line_gap=scaled_px(block.line_gap, scale),
+                    column_width=column_width,
+                ))
+            boxes.append(CompiledBox(
+                spec=box,
+                rect=(int(width * x1), int(height * y1), int(width * x2), int(height * y2)),
+                center_x=int(width * (x1 + x2) / 2),
+                gap=scaled_px(box.gap, scale),
+                blocks=tuple(blocks),
+            ))
+        return PlacementPlan(layout=spec.key, size=size, boxes=tuple(boxes))
+
+    # ===== 每次請求：量字、算座標 =====
+
+    def place(
+        self,
+        layout: str,
+        size: Tuple[int, int],
+        texts: Mapping[str, str],
+    ) -> List[PlacedBox]:
+        """texts 給 title / subtitle / footer，回傳每個文字區要畫的字（已經有座標）。"""
+        sources = dict(texts)
+        sources.setdefault("english", english_text(
+            texts.get("title", ""), texts.get("subtitle", "")
+        ))
+        placed: List[PlacedBox] = []
+        for box in self.compile(layout, size).boxes:
+            if box.spec.flow == "rows":
+                runs = self._place_rows(box, sources)
+            else:
+                runs = self._place_columns(box, sources)
+            placed.append(PlacedBox(rotate=box.spec.rotate, runs=tuple(runs)))
+        return placed
+
+    @staticmethod
+    def _run(
+        block: CompiledBlock,
+        text: str,
+        x: int,
+        y: int,
+        font: Font | None = None,
+        stroke: int | None = None,
+    ) -> GlyphRun:
+        return GlyphRun(
+            text=text,
+            x=x,
+            y=y,
+            font=font or block.font,
+            color=block.spec.color,
+            stroke=block.stroke if stroke is None else stroke,
+            stroke_color=block.spec.stroke_color,
+        )
+
+    def _place_rows(self, box: CompiledBox, sources: Mapping[str, str]) -> List[GlyphRun]:
+        x1, y1, x2, y2 = box.rect
+        texts = [
+            _apply_filter(sources.get(block.spec.text, "").strip(), block.spec.filter)
+            for block in box.blocks
+        ]
+        # 依字寬斷行；min_scale < 1 的話塞不下就整塊縮小
+        _, fitted = fit_rows(
+            [
+                (text, block.font_px, block.stroke, block.line_gap)
+                for text, block in zip(texts, box.blocks)
+            ],
+            (x2 - x1, y2 - y1),
+            box.gap,
+            self.load_font,
+            box.spec.min_scale,
+        )
+        measured = []
+        for block, (font, stroke, line_gap, lines) in zip(box.blocks, fitted):
+            metrics = metrics_for(font)
+            line_h = metrics.line_height(stroke)
+            measured.append((
+                block, font, stroke, line_gap,
+                [(line, metrics.width(line, stroke), line_h) for line in lines],
+            ))
+
+        # 每行往下 (字高 + 行距)，區塊之間再加 gap
+        total = 0
+        for i, (_, _, _, line_gap, lines) in enumerate(measured):
+            total += sum(h + line_gap for _, _, h in lines)
+            if i < len(measured) - 1:
+                total += box.gap
+        if measured and measured[-1][4]:
+            total -= measured[-1][3]
+
+        if box.spec.valign == "bottom":
+            y = y2 - total
+        elif box.spec.valign == "middle" and 0 < total < y2 - y1:
+            y = y1 + (y2 - y1 - total) // 2
+        else:
+            y = y1
+
+        runs = []
+        center_x = box.center_x
+        for block, font, stroke, line_gap, lines in measured:
+            for line, w, h in lines:
+                if box.spec.align == "left":
+                    x = x1
+                elif box.spec.align == "right":
+                    x = x2 - w
+                else:
+                    x = center_x - w // 2
+                runs.append(self._run(block, line, x, y, font, stroke))
+                y += h + line_gap
+            y += box.gap
+        return runs
+
+    def _place_columns(self, box: CompiledBox, sources: Mapping[str, str]) -> List[GlyphRun]:
+        x1, y1, x2, y2 = box.rect
+        columns = []
+        for block in box.blocks:
+            text = _apply_filter(sources.get(block.spec.text, ""), block.spec.filter)
+            # 直書每個字佔一樣高的格子（標點也是），不用一個字一個字量
+            char_h = metrics_for(block.font).line_height(block.stroke)
+            chars = [(ch, char_h) for ch in text if not ch.isspace()]
+            column_h = sum(h for _, h in chars) + block.line_gap * max(0, len(chars) - 1)
+            columns.append((block, chars, column_h))
+
+        # 所有欄共用同一個頂端，整組上下置中（太長就從頂端開始）
+        block_h = max((h for _, _, h in columns), default=0)
+        if box.spec.valign == "middle" and 0 < block_h < y2 - y1:
+            top = y1 + (y2 - y1 - block_h) // 2
+        elif box.spec.valign == "bottom" and 0 < block_h < y2 - y1:
+            top = y2 - block_h
+        else:
+            top = y1
+
+        runs = []
+        x = None
+        previous: CompiledBlock | None = None
+        for block, chars, _ in columns:
+            # align 決定第一欄貼哪一邊，後面的欄往另一邊長
+            if box.spec.align == "right":
+                x = x2 - block.column_width if x is None else (
+                    x - block.column_width - box.gap)
+            else:
+                x = x1 if x is None else x + previous.column_width + box.gap
+            previous = block
+
+            y = top
+            for ch, h in chars:
+                runs.append(self._run(block, ch, x, y))
+                y += h + block.line_gap
+        return runs
@@ -0,0 +1,88 @@
+from typing import Callable
+
+from .structured_logging import get_logger
+
+log = get_logger("line_bot")
+
+# LINE SDK 只有在真的有設定 LINE 金鑰時才 import，
+# 只跑 /api/generate 的部署不用載入整包 SDK。
+
+
+class LineBot:
+    """LINE Messaging API / Webhook 的小包裝。"""
+
+    def __init__(self, access_token: str, channel_secret: str):
+        from linebot.v3 import WebhookHandler
+        from linebot.v3.exceptions import InvalidSignatureError
+        from linebot.v3.messaging import (
+            ApiClient,
+            Configuration,
+            ImageMessage,
+            MessagingApi,
+            ReplyMessageRequest,
+            TextMessage,
+        )
+        from linebot.v3.webhooks import MessageEvent, TextMessageContent
+
+        self._InvalidSignatureError = InvalidSignatureError
+        self._ImageMessage = ImageMessage
+        self._ReplyMessageRequest = ReplyMessageRequest
+        self._TextMessage = TextMessage
+        self._MessageEvent = MessageEvent
+        self._TextMessageContent = TextMessageContent
+
+        configuration = Configuration(access_token=access_token)
+        self.api = MessagingApi(ApiClient(configuration))
+        self.handler = WebhookHandler(channel_secret)
+
+    def on_text_message(self, fn: Callable) -> Callable:
+        """註冊文字訊息的處理函式（等同 @handler.add(MessageEvent, message=TextMessageContent)）。"""
+        return self.handler.add(
+            self._MessageEvent, message=self._TextMessageContent
+        )(fn)
+
+    def handle(self, body: str, signature: str) -> bool:
+        """驗證簽章並分派事件，簽章錯誤回傳 False。"""
+        try:
+            self.handler.handle(body, signature)
+        except self._InvalidSignatureError:
+            return False
+        return True
+
+    def reply_text(self, reply_token: str, text: str) -> None:
+        self.api.reply_message(
+            self._ReplyMessageRequest(
+                reply_token=reply_token,
+                messages=[self._TextMessage(text=text)],
+            )
+        )
+
+    def reply_image(self, reply_token: str, image_url: str, preview_url: str) -> None:
+        self.api.reply_message(
+            self._ReplyMessageRequest(
+                reply_token=reply_token,
+                messages=[
+                    self._ImageMessage(
+                        original_content_url=image_url,
+                        preview_image_url=preview_url,
+                    )
+                ],
+            )
+        )
+
+
+def create_line_bot(
+    access_token: str | None,
+    channel_secret: str | None,
+) -> LineBot | None:
+    """沒有金鑰或沒安裝 SDK 就回傳 None，服務照樣可以跑網頁 API。"""
+    if not access_token or not channel_secret:
+        log.warning("LINE Bot keys not found in .env")
+        return None
+
+    try:
+        return LineBot(access_token, channel_secret)
+    except ImportError as e:
+        log.warning(
+            "line-bot-sdk not installed, LINE Bot disabled", extra={"error": str(e)})
+        return None
@@ -1,10 +1,34 @@
 import json
 import os
 import random
+import time
 from dataclasses import dataclass
-from typing import Dict, Optional
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
 import datetime
-from google import genai
+
+from .copy_engine import CopyEngine
+from .quota_governor import (
+    QuotaGovernor,
+    estimate_tokens,
+    is_quota_error,
+    retry_after_seconds,
+)
+from .structured_logging import get_logger
+
+if TYPE_CHECKING:
+    from google import genai
+
+
+CONFIG_DIR = Path(__file__).resolve().parent.parent / "config"
+DEFAULT_COPY_GRAMMAR = str(CONFIG_DIR / "copy_grammar.json")
+DEFAULT_QUOTA_CONFIG = str(CONFIG_DIR / "gemini_quota.json")
+
+BACKEND_GEMINI = "gemini"
+BACKEND_LOCAL = "local"
+BACKENDS = (BACKEND_GEMINI, BACKEND_LOCAL)
+
+log = get_logger("llm")
 
 
 @dataclass
@@ -16,47 +40,41 @@ class ElderCardText:
 
 class LLMService:
     """
-    使用 Gemini API 產生長輩圖文案。
-    - 有 GEMINI_API_KEY 或 GOOGLE_API_KEY 就呼叫 Gemini
-    - 沒有或出錯則使用內建模板 fallback
+    產生長輩圖文案，有兩種後端：
+    - gemini：有 GEMINI_API_KEY 或 GOOGLE_API_KEY 就呼叫 Gemini
+    - local：離線的模板組合（CopyEngine），不用網路、幾微秒一張
+    預設用 gemini（沒有金鑰就是 local），Gemini 全部失敗時也會退回 local。
+    環境變數 LLM_BACKEND 或 generate_text(backend=...) 可以指定。
     """
 
-    def __init__(self) -> None:
-        # 這些是預設模板，會在沒有 LLM 或錯誤時使用
-        self.templates: Dict[str, ElderCardText] = {
-            "morning": ElderCardText(
-                title="早安 祝福滿滿",
-                subtitle="新的一天記得多呼吸幾口新鮮空氣，讓心情跟著亮起來。",
-                footer="把這份祝福分享給在乎的人，一起元氣滿滿迎接今天 ☀️",
-            ),
-            "health": ElderCardText(
-                title="健康是最大的財富",
-                subtitle="少熬夜、多喝水，適度活動筋骨，身體才會跟你當好朋友。",
-                footer="想起好久不見的親朋好友，關心一句：最近也要記得照顧自己喔 💕",
-            ),
-            "life": ElderCardText(
-                title="人生慢慢來也沒關係",
-                subtitle="偶爾停下腳步，看看身邊的人、身邊的風景，也是種收穫。",
-                footer="把這張圖傳給懂你的人，一起好好過生活 🌿",
-            ),
-            "festival_newyear": ElderCardText(
-                title="新年快樂 福氣滿滿",
-                subtitle="願你新的一年，平安順心、笑口常開，家人健康闔家團圓。",
-                footer="想到誰想一起過好年，就快把祝福傳給他吧 🧧",
-            ),
-            "festival_christmas": ElderCardText(
-                title="聖誕快樂 平安喜樂",
-                subtitle="願溫暖的燈火，照亮你與家人的笑容與心。",
-                footer="把這份小小的祝福傳出去，讓聖誕更有味道 🎄",
-            ),
-        }
+    def __init__(
+        self,
+        copy_grammar_path: str | None = None,
+        quota_config_path: str | None = None,
+    ) -> None:
+        # 離線文案產生器：沒有金鑰、模型全掛、或刻意選 local 時使用
+        self.copy_engine = CopyEngine(copy_grammar_path or DEFAULT_COPY_GRAMMAR)
 
         api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-        print("[LLMService] GEMINI_API_KEY loaded:", bool(api_key))
+        log.info("Gemini API key loaded", extra={"has_key": bool(api_key)})
+
+        # google-genai 只有在有金鑰時才 import（載入要一段時間）
+        self.client: Optional["genai.Client"] = None
+        if api_key:
+            try:
+                from google import genai
+
+                self.client = genai.Client(api_key=api_key)
+            except ImportError as e:
+                log.warning(
+                    "google-genai not installed, using local copy", extra={"error": str(e)})
 
-        self.client: Optional[genai.Client] = (
-            genai.Client(api_key=api_key) if api_key else None
+        self.backend = os.getenv("LLM_BACKEND") or (
+            BACKEND_GEMINI if self.client else BACKEND_LOCAL
         )
+        if self.backend not in BACKENDS:
+            log.warning("Unknown LLM_BACKEND, using local", extra={"backend": self.backend})
+            self.backend = BACKEND_LOCAL
 
         # 可調整成你想用的模型
         # self.model_name = "gemini-2.5-flash"
@@ -73,6 +91,13 @@ class LLMService:
             "gemini-robotics-er-1.5-preview"
         ]
 
+        # 每個模型的 RPM / TPM / 每日額度，呼叫前先確認
+        # （GEMINI_QUOTA_STATE 有設定就跨 worker 共用狀態）
+        self.quota = QuotaGovernor(
+            quota_config_path or DEFAULT_QUOTA_CONFIG,
+            state_path=os.getenv("GEMINI_QUOTA_STATE") or None,
+        )
+
         # 主題說明
         self.theme_descriptions: Dict[str, str] = {
             "morning": "早安、早晨開啟新的一天，溫暖打氣的祝福。",
@@ -94,12 +119,12 @@ class LLMService:
             "溫暖療癒",
         ]
 
-    def _get_zodiac_context(self) -> str:
+    def zodiac(self, now: datetime.datetime | None = None) -> Tuple[int, str]:
         """
-        計算當前年份與生肖。
+        計算當前（或 now 指定時間的）年份與生肖。
         如果月份 >= 11，視為準備過明年農曆年。
         """
-        now = datetime.datetime.now()
+        now = now or datetime.datetime.now()
         year = now.year
 
         # 如果是 11, 12 月，通常大家都在求「明年」的新年祝福了
@@ -109,8 +134,10 @@ class LLMService:
         # 生肖對照表 (2025是蛇年，2025%12=9)
         # 餘數對應：0猴, 1雞, 2狗, 3豬, 4鼠, 5牛, 6虎, 7兔, 8龍, 9蛇, 10馬, 11羊
         zodiacs = ["猴", "雞", "狗", "豬", "鼠", "牛", "虎", "兔", "龍", "蛇", "馬", "羊"]
-        zodiac_char = zodiacs[year % 12]
+        return year, zodiacs[year % 12]
 
+    def _get_zodiac_context(self) -> str:
+        year, zodiac_char = self.zodiac()
         return f"現在是（或即將迎接）{year} 年，也就是「{zodiac_char}年」。"
 
     # --------- prompt 組裝 ---------
@@ -238,32 +265,33 @@ JSON 格式如下：
         full_prompt = instructions + "\n\n" + few_shot
         return full_prompt
 
-    # --------- fallback ---------
+    # --------- local 後端 ---------
+
+    def generate_local(
+        self,
+        theme: str,
+        style: str | None = None,
+        seed: int | None = None,
+    ) -> ElderCardText:
+        """用離線模板組出文案；給 seed 結果就固定。"""
+        _, zodiac_char = self.zodiac()
+        title, subtitle, footer = self.copy_engine.generate(
+            theme, style=style, seed=seed, variables={"zodiac": zodiac_char}
+        )
+        return ElderCardText(title=title, subtitle=subtitle, footer=footer)
 
     def _fallback(self, theme: str) -> ElderCardText:
-        if theme in self.templates:
-            return self.templates[theme]
-
-        return ElderCardText(
-            title="送上暖暖的祝福",
-            subtitle="別忘了幫自己留一點喘口氣的時間。",
-            footer="傳給你在乎的人吧",
-        )
+        return self.generate_local(theme)
 
     # --------- 對外主方法 ---------
 
-    def generate_text(self, theme: str) -> ElderCardText:
+    def generate_text(self, theme: str, backend: str | None = None) -> ElderCardText:
         """
         對外呼叫：
-        - 優先用 Gemini 產生 JSON 再 parse
-        - 失敗就回到模板
+        - backend 沒給就用 self.backend
+        - gemini：產生 JSON 再 parse，失敗就回到 local
+        - local：直接用離線模板
         """
-        if not self.client:
-            return self._fallback(theme)
-
-        style = random.choice(self.style_variants)  # 每次隨機一種風格
-        prompt = self._build_prompt(theme, style)
-
         if theme == "broken_egg":
             return ElderCardText(
                 title="誰說這壞了？",
@@ -271,10 +299,36 @@ JSON 格式如下：
                 footer="—— 來自何老師的邪惡梔子花計畫"
             )
 
-        # ✅ 開始迴圈：依序嘗試每個模型
-        for model_name in self.model_candidates:
+        backend = backend or self.backend
+        if backend == BACKEND_LOCAL or not self.client:
+            return self.generate_local(theme)
+
+        style = random.choice(self.style_variants)  # 每次隨機一種風格
+        prompt = self._build_prompt(theme, style)
+
+        # ✅ 開始迴圈：由額度控管決定用哪個模型（額度不夠的直接跳過，不去撞 429）
+        max_output_tokens = 2048
+        estimated_tokens = estimate_tokens(prompt, max_output_tokens)
+        remaining = list(self.model_candidates)
+        while remaining:
+            decision = self.quota.plan(remaining, estimated_tokens)
+            if decision.model is None:
+                log.info("No model has quota left, using local copy engine", extra={"theme": theme})
+                return self._fallback(theme)
+            model_name = decision.model
+            remaining.remove(model_name)
+
+            if decision.wait > 0:
+                log.info(
+                    "Queued for model quota",
+                    extra={"model": model_name, "wait_s": round(decision.wait, 2)},
+                )
+                time.sleep(decision.wait)
+
             try:
-                print(f"[LLMService] Trying model: {model_name}...")
+                # 每次嘗試都記的話太多，DEBUG 會被取樣
+                log.debug("Trying model", extra={"model": model_name, "theme": theme})
+                started = time.perf_counter()
 
                 response = self.client.models.generate_content(
                     model=model_name,  # 這裡改用迴圈當下的 model_name
@@ -283,27 +337,37 @@ JSON 格式如下：
                         "response_mime_type": "application/json",
                         "temperature": 0.9,
                         "top_p": 0.95,
-                        "max_output_tokens": 2048,
+                        "max_output_tokens": max_output_tokens,
                     },
                 )
 
+                usage = getattr(response, "usage_metadata", None)
+                self.quota.record_usage(
+                    model_name,
+                    estimated_tokens,
+                    getattr(usage, "total_token_count", None),
+                )
+
                 raw_text = response.text.strip()
-                # print(f"[LLMService] Response from {model_name}: success!")
 
                 data = json.loads(raw_text)
 
                 if isinstance(data, list):
                     if not data:
                         # 如果這個模型回傳空陣列，視為失敗，嘗試下一個
-                        print(
-                            f"[LLMService] {model_name} returned empty list, skipping.")
+                        log.warning(
+                            "Model returned empty list, skipping",
+                            extra={"model": model_name},
+                        )
                         continue
                     data = data[0]
 
                 if not isinstance(data, dict):
                     # 格式不對，嘗試下一個
-                    print(
-                        f"[LLMService] {model_name} returned invalid format, skipping.")
+                    log.warning(
+                        "Model returned invalid format, skipping",
+                        extra={"model": model_name},
+                    )
                     continue
 
                 title = str(data.get("title", "")).strip()
@@ -322,16 +386,28 @@ JSON 格式如下：
                     continue  # 欄位缺失，視為失敗，換下一個
 
                 # 🎉 成功！直接回傳結果，結束迴圈
+                log.info(
+                    "Generated text",
+                    extra={
+                        "model": model_name,
+                        "theme": theme,
+                        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                    },
+                )
                 return ElderCardText(title=title, subtitle=subtitle, footer=footer)
 
             except Exception as e:
                 # 🚨 這裡捕捉錯誤 (例如 429 額度滿了)
-                print(
-                    f"[LLMService] Model {model_name} failed with error: {e}")
-                print(f"[LLMService] Switching to next model...")
+                log.warning(
+                    "Model failed, switching to next model",
+                    extra={"model": model_name, "error": str(e)},
+                )
+                if is_quota_error(e):
+                    # 額度控管的數字跟實際不符：這個模型先冷卻，之後不會再排到它
+                    self.quota.penalize(model_name, retry_after_seconds(e))
                 # 繼續迴圈 (continue)，嘗試清單裡的下一個模型
                 continue
 
-        # ❌ 如果迴圈跑完了，所有模型都失敗，才使用 Fallback 模板
-        print("[LLMService] All models failed. Using fallback template.")
+        # ❌ 如果迴圈跑完了，所有模型都失敗，才改用離線文案
+        log.warning("All models failed, using local copy engine", extra={"theme": theme})
         return self._fallback(theme)
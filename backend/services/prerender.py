@@ -0,0 +1,293 @@
+import json
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Callable, Deque, Dict, List, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from .compose_service import ComposeService
+from .llm_service import ElderCardText, LLMService
+from .renditions import FULL, LINE_PREVIEW, ComposeResult
+from .structured_logging import correlation_scope, get_logger
+
+log = get_logger("prerender")
+
+
+# ===== 尖峰時段預先算好的卡片庫存 =====
+#
+# 「早安」的流量集中在早上 6~8 點，節日當天也會一次湧進來。
+# 排程器在尖峰 / 節日開始前（lead_minutes）就把整張卡（文案 + 圖 + LINE 預覽）
+# 做好存進 static，LINE 請求進來時直接發一張還沒發給這個人的卡，不用等 LLM 和合成。
+# 庫存被拿走就叫醒排程器在背景補貨。
+# can_refill 回傳 False 時（例如系統正在降級）先不補，把 CPU 讓給即時請求。
+#
+# 設定在 config/prerender.json：
+# - peaks：每天的尖峰時段、要備哪些主題、每個 layout 備幾張
+# - festivals：節日日期（農曆節日每年不同，逐年列出；"*" 代表每年同一天）
+#   新年用 LLMService.zodiac 的年份（以 timezone 的時間算）（11、12 月就算明年），
+#   卡片也會標上生肖，換年之後舊生肖的卡就不再發。
+
+SENT_HISTORY_PER_USER = 500
+
+
+@dataclass
+class PrerenderedCard:
+    theme: str
+    layout: str
+    tag: str                       # 新年卡是生肖，其他主題是空字串
+    text: ElderCardText
+    urls: Dict[str, str]           # {"full": ..., "preview": ...}
+    uses: int = 0
+    recipients: Set[str] = field(default_factory=set)
+
+    @property
+    def fingerprint(self) -> str:
+        """同樣的文案就算背景不同，也算「同一張」，不會再發給同一個人。"""
+        return f"{self.theme}|{self.text.title}|{self.text.subtitle}"
+
+
+@dataclass(frozen=True)
+class StockTarget:
+    theme: str
+    layout: str
+    count: int
+
+
+def _parse_clock(value: str) -> Tuple[int, int]:
+    hour, minute = value.split(":")
+    return int(hour), int(minute)
+
+
+class PrerenderInventory:
+    def __init__(
+        self,
+        config_path: str,
+        compose_service: ComposeService,
+        llm_service: LLMService,
+        save: Callable[[ComposeResult], Dict[str, str]],
+        can_refill: Callable[[], bool] | None = None,
+    ):
+        with open(config_path, encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.compose_service = compose_service
+        self.llm_service = llm_service
+        self.save = save
+        self.can_refill = can_refill or (lambda: True)
+
+        self.timezone = ZoneInfo(self.config.get("timezone", "Asia/Taipei"))
+        self.max_uses = int(self.config.get("max_uses_per_card", 1))
+        self.layouts: List[str] = self.config.get(
+            "layouts", compose_service.available_layouts
+        )
+
+        self._lock = threading.Lock()
+        # (theme, layout) -> 卡片（先做的先發）
+        self._stock: Dict[Tuple[str, str], Deque[PrerenderedCard]] = {}
+        # user_id -> 最近發過的卡片 fingerprint（只留最近幾百張）
+        self._sent: Dict[str, OrderedDict] = {}
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    # ===== 要備多少貨 =====
+
+    def _tag_for(self, theme: str, now: datetime | None = None) -> str:
+        if theme == "festival_newyear":
+            # 跟 _festival_date 用同一個時區，換年前後生肖和節日區間才不會差 8 小時
+            _, zodiac_char = self.llm_service.zodiac(now or datetime.now(self.timezone))
+            return zodiac_char
+        return ""
+
+    def _festival_date(self, theme: str, festival: dict, now: datetime) -> date | None:
+        if theme == "festival_newyear":
+            # 跟文案一樣用生肖的年份：11、12 月就在準備明年的新年
+            year, _ = self.llm_service.zodiac(now)
+        else:
+            year = now.year
+        value = festival["dates"].get(str(year)) or festival["dates"].get("*")
+        if not value:
+            return None
+        month, day = value.split("-")
+        return date(year, int(month), int(day))
+
+    def targets(self, now: datetime | None = None) -> List[StockTarget]:
+        """現在（考慮提前量）應該要有庫存的 (主題, layout, 張數)。"""
+        now = now or datetime.now(self.timezone)
+        lead = timedelta(minutes=self.config.get("lead_minutes", 30))
+        wanted: Dict[Tuple[str, str], int] = {}
+
+        def want(theme: str, count: int) -> None:
+            for layout in self.layouts:
+                key = (theme, layout)
+                wanted[key] = max(wanted.get(key, 0), count)
+
+        for peak in self.config.get("peaks", []):
+            start_h, start_m = _parse_clock(peak["start"])
+            end_h, end_m = _parse_clock(peak["end"])
+            start = now.replace(hour=start_h, minute=start_m, second=0, microsecond=0)
+            end = now.replace(hour=end_h, minute=end_m, second=0, microsecond=0)
+            if start - lead <= now <= end:
+                for theme in peak["themes"]:
+                    want(theme, peak.get("per_layout", 4))
+
+        today = now.date()
+        for theme, festival in self.config.get("festivals", {}).items():
+            day = self._festival_date(theme, festival, now)
+            if day is None:
+                continue
+            first = day - timedelta(days=festival.get("days_before", 1))
+            last = day + timedelta(days=festival.get("days_after", 1))
+            if first <= today <= last:
+                want(theme, festival.get("per_layout", 4))
+
+        return [
+            StockTarget(theme, layout, count)
+            for (theme, layout), count in wanted.items()
+        ]
+
+    # ===== 補貨 =====
+
+    def _available(self, theme: str, layout: str) -> int:
+        tag = self._tag_for(theme)
+        return sum(
+            1 for card in self._stock.get((theme, layout), ())
+            if card.tag == tag and card.uses < self.max_uses
+        )
+
+    def _render_card(self, theme: str, layout: str) -> PrerenderedCard:
+        elder_text = self.llm_service.generate_text(theme)
+        result = self.compose_service.compose_renditions(
+            theme=theme,
+            title=elder_text.title,
+            subtitle=elder_text.subtitle,
+            footer=elder_text.footer,
+            layout=layout,
+            renditions=[FULL, LINE_PREVIEW],
+        )
+        return PrerenderedCard(
+            theme=theme,
+            layout=result.layout,
+            tag=self._tag_for(theme),
+            text=elder_text,
+            urls=self.save(result),
+        )
+
+    def refill(self, now: datetime | None = None) -> int:
+        """把目前該有的庫存補滿，回傳這次做了幾張。"""
+        made = 0
+        for target in self.targets(now):
+            while not self._stop.is_set():
+                if not self.can_refill():
+                    return made
+                with self._lock:
+                    if self._available(target.theme, target.layout) >= target.count:
+                        break
+                # 每張庫存卡一個 correlation id，跟即時請求的 log 分得開
+                with correlation_scope(prefix="prerender"):
+                    try:
+                        card = self._render_card(target.theme, target.layout)
+                    except Exception as e:
+                        log.warning(
+                            "Failed to render inventory card",
+                            extra={
+                                "theme": target.theme,
+                                "layout": target.layout,
+                                "error": str(e),
+                            },
+                        )
+                        break
+                with self._lock:
+                    self._stock.setdefault(
+                        (target.theme, target.layout), deque()
+                    ).append(card)
+                made += 1
+        if made:
+            log.info("Rendered cards into inventory", extra={"count": made})
+        return made
+
+    def _prune(self) -> None:
+        """發完的、生肖過期的卡拿掉。"""
+        with self._lock:
+            for (theme, _), cards in self._stock.items():
+                tag = self._tag_for(theme)
+                keep = [c for c in cards if c.tag == tag and c.uses < self.max_uses]
+                if len(keep) != len(cards):
+                    cards.clear()
+                    cards.extend(keep)
+
+    # ===== 發卡 =====
+
+    def take(self, theme: str, layout: str, user_id: str) -> PrerenderedCard | None:
+        """
+        拿一張這個使用者還沒收過的卡；layout 是 "auto" 就不限 layout。
+        沒有庫存回傳 None（呼叫端照原本的流程即時產生）。
+        """
+        keys = (
+            [(theme, l) for l in self.layouts]
+            if layout == "auto" else [(theme, layout)]
+        )
+        tag = self._tag_for(theme)
+        with self._lock:
+            sent = self._sent.get(user_id, {})
+            # 從庫存最多的 layout 開始拿，各 layout 平均消耗
+            for key in sorted(keys, key=lambda k: -len(self._stock.get(k, ()))):
+                for card in self._stock.get(key, ()):
+                    if (
+                        card.tag != tag
+                        or card.uses >= self.max_uses
+                        or user_id in card.recipients
+                        or card.fingerprint in sent
+                    ):
+                        continue
+                    card.uses += 1
+                    card.recipients.add(user_id)
+                    self._remember(user_id, card.fingerprint)
+                    self._wake.set()
+                    return card
+        return None
+
+    def mark_sent(self, user_id: str, theme: str, text: ElderCardText) -> None:
+        """即時產生的卡也記下來，之後不會再從庫存發一樣的文案給他。"""
+        fingerprint = f"{theme}|{text.title}|{text.subtitle}"
+        with self._lock:
+            self._remember(user_id, fingerprint)
+
+    def _remember(self, user_id: str, fingerprint: str) -> None:
+        sent = self._sent.setdefault(user_id, OrderedDict())
+        sent[fingerprint] = None
+        sent.move_to_end(fingerprint)
+        while len(sent) > SENT_HISTORY_PER_USER:
+            sent.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                f"{theme}/{layout}": self._available(theme, layout)
+                for theme, layout in self._stock
+            }
+
+    # ===== 背景排程 =====
+
+    def _run(self) -> None:
+        interval = float(self.config.get("check_interval_seconds", 60))
+        while not self._stop.is_set():
+            self._prune()
+            self.refill()
+            # 每隔 interval 檢查一次；有人拿走庫存就提早醒來補貨
+            self._wake.wait(interval)
+            self._wake.clear()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="prerender", daemon=True
+        )
+        self._thread.start()
+        log.info("Scheduler started")
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
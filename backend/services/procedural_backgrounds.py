@@ -0,0 +1,280 @@
+import random
+import zlib
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+# ===== 程式產生的背景 =====
+#
+# 主題資料夾是空的（或是彩蛋主題根本沒有素材）時，
+# 用 NumPy 畫一張有主題配色的背景，取代單色畫布：
+# - gradient：斜向漸層 + 暗角
+# - bokeh：柔焦光斑
+# - sunrays：放射狀光芒
+# - floral：分形雜訊底紋 + 花瓣
+#
+# 這些圖層都很平滑，所以先在 WORK_SIDE 的小圖上算，再用 Pillow 放大，
+# 1024x1024 只要幾十毫秒。同一組 (主題, 尺寸, seed) 的結果會快取起來，
+# 沒指定 seed 時從 VARIANTS_PER_THEME 個固定 seed 裡挑，跟挑背景圖檔一樣。
+
+RGB = Tuple[int, int, int]
+
+WORK_SIDE = 384
+VARIANTS_PER_THEME = 8
+CACHE_SIZE = 64
+
+
+@dataclass(frozen=True)
+class Palette:
+    top: RGB                 # 漸層起點
+    bottom: RGB              # 漸層終點
+    accents: Tuple[RGB, ...] # 光斑 / 花瓣 / 光芒的顏色
+    layers: Tuple[str, ...]  # 依序疊上去的圖層
+
+
+THEME_PALETTES: Dict[str, Palette] = {
+    "morning": Palette(
+        (255, 214, 150), (255, 140, 90),
+        ((255, 245, 200), (255, 200, 120), (255, 170, 170)),
+        ("gradient", "sunrays", "bokeh"),
+    ),
+    "health": Palette(
+        (200, 240, 200), (90, 170, 110),
+        ((240, 255, 220), (180, 230, 160), (255, 250, 200)),
+        ("gradient", "floral", "bokeh"),
+    ),
+    "life": Palette(
+        (190, 220, 255), (90, 140, 210),
+        ((255, 255, 255), (200, 230, 255), (255, 220, 240)),
+        ("gradient", "bokeh"),
+    ),
+    "festival_newyear": Palette(
+        (230, 40, 40), (140, 10, 20),
+        ((255, 215, 90), (255, 180, 60), (255, 240, 180)),
+        ("gradient", "floral", "bokeh"),
+    ),
+    "festival_christmas": Palette(
+        (30, 90, 60), (10, 40, 30),
+        ((255, 240, 200), (230, 60, 60), (255, 255, 255)),
+        ("gradient", "bokeh"),
+    ),
+    "festival_lantern": Palette(
+        (60, 20, 60), (20, 10, 40),
+        ((255, 160, 60), (255, 90, 50), (255, 220, 120)),
+        ("gradient", "bokeh"),
+    ),
+    "festival_midautumn": Palette(
+        (30, 40, 90), (10, 15, 40),
+        ((255, 230, 150), (255, 250, 220), (230, 200, 120)),
+        ("gradient", "sunrays", "bokeh"),
+    ),
+    "festival_common": Palette(
+        (255, 200, 220), (220, 100, 150),
+        ((255, 240, 250), (255, 220, 120), (255, 160, 200)),
+        ("gradient", "floral", "bokeh"),
+    ),
+    # 彩蛋主題沒有素材，直接用這裡的配色
+    "programmer": Palette(
+        (10, 30, 15), (0, 0, 0),
+        ((0, 255, 80), (0, 180, 60), (120, 255, 160)),
+        ("gradient", "bokeh"),
+    ),
+    "lotus": Palette(
+        (255, 230, 240), (240, 170, 200),
+        ((255, 120, 170), (255, 250, 250), (255, 200, 120)),
+        ("gradient", "sunrays", "floral"),
+    ),
+    "rebel": Palette(
+        (40, 0, 0), (0, 0, 0),
+        ((255, 40, 40), (255, 120, 0), (255, 220, 220)),
+        ("gradient", "sunrays", "bokeh"),
+    ),
+}
+
+DEFAULT_PALETTE = Palette(
+    (255, 240, 220), (240, 200, 170),
+    ((255, 255, 255), (255, 220, 180), (255, 200, 200)),
+    ("gradient", "bokeh"),
+)
+
+
+def has_palette(theme: str) -> bool:
+    return theme in THEME_PALETTES
+
+
+# ===== 圖層 =====
+#
+# 每個圖層拿到 (H, W, 3) float32 的畫布（0~1），直接就地修改。
+
+def _color(rgb: RGB) -> np.ndarray:
+    return np.asarray(rgb, dtype=np.float32) / 255.0
+
+
+def _grid(h: int, w: int) -> Tuple[np.ndarray, np.ndarray]:
+    """0~1 的座標，形狀是 (h, 1) 和 (1, w)，靠 broadcasting 組成整張圖。"""
+    ys = np.linspace(0.0, 1.0, h, dtype=np.float32)[:, None]
+    xs = np.linspace(0.0, 1.0, w, dtype=np.float32)[None, :]
+    return ys, xs
+
+
+def _blend(canvas: np.ndarray, color: np.ndarray, alpha: np.ndarray) -> None:
+    """canvas = canvas * (1 - alpha) + color * alpha"""
+    canvas += (color - canvas) * alpha[..., None]
+
+
+def _screen(canvas: np.ndarray, color: np.ndarray, alpha: np.ndarray) -> None:
+    """濾色：只會變亮，光斑 / 光芒用。"""
+    light = color * alpha[..., None]
+    canvas += light - canvas * light
+
+
+def layer_gradient(canvas: np.ndarray, palette: Palette, rng: np.random.Generator) -> None:
+    h, w, _ = canvas.shape
+    ys, xs = _grid(h, w)
+    angle = rng.uniform(-0.6, 0.6)
+    t = ys * np.cos(angle) + xs * np.sin(angle)
+    t = (t - t.min()) / max(float(t.max() - t.min()), 1e-6)
+    top, bottom = _color(palette.top), _color(palette.bottom)
+    canvas[:] = top + (bottom - top) * t[..., None]
+
+    # 暗角，讓中間的字更突出
+    dist = (ys - 0.5) ** 2 + (xs - 0.5) ** 2
+    canvas *= (1.0 - 0.35 * np.clip(dist * 2.0, 0.0, 1.0))[..., None]
+
+
+def layer_bokeh(canvas: np.ndarray, palette: Palette, rng: np.random.Generator) -> None:
+    h, w, _ = canvas.shape
+    count = int(rng.integers(18, 32))
+    centers_y = rng.uniform(0, h, count)
+    centers_x = rng.uniform(0, w, count)
+    radii = rng.uniform(0.03, 0.12, count) * min(h, w)
+    strengths = rng.uniform(0.25, 0.6, count)
+    colors = rng.integers(0, len(palette.accents), count)
+
+    ys = np.arange(h, dtype=np.float32)[:, None]
+    xs = np.arange(w, dtype=np.float32)[None, :]
+    for cy, cx, r, s, c in zip(centers_y, centers_x, radii, strengths, colors):
+        # 只算光斑所在的方框
+        y0, y1 = max(0, int(cy - r)), min(h, int(cy + r) + 1)
+        x0, x1 = max(0, int(cx - r)), min(w, int(cx + r) + 1)
+        if y0 >= y1 or x0 >= x1:
+            continue
+        d = np.sqrt((ys[y0:y1] - cy) ** 2 + (xs[:, x0:x1] - cx) ** 2) / r
+        # 邊緣稍亮的柔焦圓
+        alpha = np.clip((1.0 - d) * 4.0, 0.0, 1.0) * (0.6 + 0.4 * d) * s
+        _screen(canvas[y0:y1, x0:x1], _color(palette.accents[c]), alpha)
+
+
+def layer_sunrays(canvas: np.ndarray, palette: Palette, rng: np.random.Generator) -> None:
+    h, w, _ = canvas.shape
+    ys, xs = _grid(h, w)
+    sun_y, sun_x = rng.uniform(-0.1, 0.3), rng.uniform(0.2, 0.8)
+    dy, dx = ys - sun_y, xs - sun_x
+    theta = np.arctan2(dy, dx)
+    dist = np.sqrt(dy ** 2 + dx ** 2)
+
+    rays = int(rng.integers(10, 18))
+    beams = 0.5 + 0.5 * np.cos(theta * rays + rng.uniform(0, np.pi))
+    beams = beams ** 6
+    glow = np.exp(-dist * 3.0)
+    alpha = np.clip(beams * np.exp(-dist * 1.2) * 0.45 + glow * 0.5, 0.0, 1.0)
+    _screen(canvas, _color(palette.accents[0]), alpha)
+
+
+def _value_noise(h: int, w: int, rng: np.random.Generator, octaves: int = 4) -> np.ndarray:
+    """分形雜訊：隨機小格子用 Pillow 平滑放大後疊加，值域 0~1。"""
+    total = np.zeros((h, w), dtype=np.float32)
+    amplitude, weight = 1.0, 0.0
+    for octave in range(octaves):
+        cells = 4 * 2 ** octave
+        grid = rng.random((cells, cells), dtype=np.float32)
+        smooth = Image.fromarray(grid).resize((w, h), Image.BICUBIC)
+        total += np.asarray(smooth, dtype=np.float32) * amplitude
+        weight += amplitude
+        amplitude *= 0.5
+    return np.clip(total / weight, 0.0, 1.0)
+
+
+def layer_floral(canvas: np.ndarray, palette: Palette, rng: np.random.Generator) -> None:
+    h, w, _ = canvas.shape
+
+    # 雜訊底紋
+    noise = _value_noise(h, w, rng)
+    _blend(canvas, _color(palette.accents[-1]), (noise - 0.5).clip(0, 0.5) * 0.5)
+
+    # 幾朵花：極座標的 rose curve 當花瓣遮罩
+    ys = np.arange(h, dtype=np.float32)[:, None]
+    xs = np.arange(w, dtype=np.float32)[None, :]
+    for _ in range(int(rng.integers(4, 8))):
+        cy, cx = rng.uniform(0, h), rng.uniform(0, w)
+        r = rng.uniform(0.06, 0.14) * min(h, w)
+        petals = int(rng.integers(5, 9))
+        spin = rng.uniform(0, np.pi)
+        color = _color(palette.accents[int(rng.integers(0, len(palette.accents)))])
+
+        y0, y1 = max(0, int(cy - r)), min(h, int(cy + r) + 1)
+        x0, x1 = max(0, int(cx - r)), min(w, int(cx + r) + 1)
+        if y0 >= y1 or x0 >= x1:
+            continue
+        dy, dx = ys[y0:y1] - cy, xs[:, x0:x1] - cx
+        d = np.sqrt(dy ** 2 + dx ** 2) / r
+        shape = 0.55 + 0.45 * np.abs(np.cos(np.arctan2(dy, dx) * petals / 2 + spin))
+        alpha = np.clip((shape - d) * 6.0, 0.0, 1.0) * 0.7
+        # 花心
+        alpha = np.maximum(alpha, np.clip((0.18 - d) * 12.0, 0.0, 1.0) * 0.9)
+        _blend(canvas[y0:y1, x0:x1], color, alpha)
+
+
+LAYERS: Dict[str, Callable[[np.ndarray, Palette, np.random.Generator], None]] = {
+    "gradient": layer_gradient,
+    "bokeh": layer_bokeh,
+    "sunrays": layer_sunrays,
+    "floral": layer_floral,
+}
+
+
+# ===== 對外 =====
+
+def render_background(theme: str, size: Tuple[int, int], seed: int) -> Image.Image:
+    """不經快取直接產生一張 RGB 背景。"""
+    palette = THEME_PALETTES.get(theme, DEFAULT_PALETTE)
+    # 同一個 seed 在不同主題也會長得不一樣
+    rng = np.random.default_rng([seed, zlib.crc32(theme.encode("utf-8"))])
+
+    width, height = size
+    scale = min(1.0, WORK_SIDE / max(width, height))
+    work_w, work_h = max(1, round(width * scale)), max(1, round(height * scale))
+
+    canvas = np.zeros((work_h, work_w, 3), dtype=np.float32)
+    for name in palette.layers:
+        LAYERS[name](canvas, palette, rng)
+
+    pixels = (np.clip(canvas, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+    img = Image.fromarray(pixels)
+    if img.size != size:
+        img = img.resize(size, Image.BICUBIC)
+    return img
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _cached_background(theme: str, size: Tuple[int, int], seed: int) -> Image.Image:
+    return render_background(theme, size, seed)
+
+
+def generate_background(
+    theme: str,
+    size: Tuple[int, int] = (1024, 1024),
+    seed: int | None = None,
+    rng: random.Random | None = None,
+) -> Image.Image:
+    """
+    回傳主題配色的 RGB 背景（共用快取，請不要直接在上面畫，先 copy / convert）。
+    沒給 seed 就從固定的幾個變化裡隨機挑一個，才吃得到快取。
+    """
+    if seed is None:
+        seed = (rng or random).randrange(VARIANTS_PER_THEME)
+    return _cached_background(theme, tuple(size), seed)
@@ -0,0 +1,249 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+from zoneinfo import ZoneInfo
+
+from .file_lock import locked
+from .structured_logging import get_logger
+
+log = get_logger("quota")
+
+
+# ===== Gemini 額度控管 =====
+#
+# 以前是每個請求直接打 Gemini，吃到 429 才知道額度用完，而且一個模型一個模型試，
+# 白白浪費好幾秒。這裡在呼叫之前就先算好：
+# - rpm / tpm：token bucket（每分鐘補滿），
+# - rpd：每日計數（Gemini 的每日額度在太平洋時間午夜重置），
+# - 429 之後整個模型冷卻一段時間，不再去撞牆。
+#
+# 額度設定在 config/gemini_quota.json。
+# 預設狀態只存在這個 process；設定 GEMINI_QUOTA_STATE（例如
+# /dev/shm/elder_card_quota.json）就改成所有 worker 共用同一份狀態（檔案鎖保護）。
+
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+# 吃到 429 但 API 沒說要等多久時，先冷卻這麼久
+DEFAULT_COOLDOWN_SECONDS = 30.0
+
+
+@dataclass(frozen=True)
+class ModelQuota:
+    rpm: int
+    tpm: int
+    rpd: int
+
+
+@dataclass(frozen=True)
+class QuotaDecision:
+    model: str | None   # 可以用的模型；None = 改用 local
+    wait: float         # 要先等幾秒（0 = 馬上送）
+
+
+def _quota_day(now: float) -> str:
+    return datetime.fromtimestamp(now, QUOTA_TIMEZONE).strftime("%Y-%m-%d")
+
+
+# ===== 狀態存放 =====
+# 狀態格式（每個模型一份）：
+#   {"requests": [剩餘請求, 上次補充時間], "tokens": [剩餘 token, 上次補充時間],
+#    "day": [日期, 今天用了幾次], "blocked_until": 時間}
+
+
+class _MemoryStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, dict] = {}
+
+    @contextmanager
+    def transaction(self) -> Iterator[Dict[str, dict]]:
+        with self._lock:
+            yield self._state
+
+
+class _FileStore:
+    """多個 worker 共用：整份狀態放在一個小 JSON 檔，讀寫時用檔案鎖鎖住。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self) -> Iterator[Dict[str, dict]]:
+        with self._lock, open(self.path, "a+", encoding="utf-8") as f, locked(f):
+            f.seek(0)
+            raw = f.read()
+            try:
+                state = json.loads(raw) if raw else {}
+            except ValueError:
+                state = {}
+            yield state
+            f.seek(0)
+            f.truncate()
+            json.dump(state, f)
+            f.flush()
+
+
+class QuotaGovernor:
+    def __init__(self, config_path: str, state_path: str | None = None):
+        with open(config_path, encoding="utf-8") as f:
+            config = json.load(f)
+
+        self.quotas: Dict[str, ModelQuota] = {
+            name: ModelQuota(**limits)
+            for name, limits in config.get("models", {}).items()
+        }
+        self.default_quota = self.quotas.pop(
+            "default", ModelQuota(rpm=5, tpm=250000, rpd=100)
+        )
+        # 最多願意排隊等多久；要等更久就換模型或改用 local
+        self.max_queue_seconds = float(config.get("max_queue_seconds", 2.0))
+
+        self.store = _FileStore(state_path) if state_path else _MemoryStore()
+        if state_path:
+            log.info("Sharing quota state", extra={"path": state_path})
+
+    def quota_for(self, model: str) -> ModelQuota:
+        return self.quotas.get(model, self.default_quota)
+
+    # ===== token bucket =====
+
+    def _model_state(self, state: Dict[str, dict], model: str, now: float) -> dict:
+        quota = self.quota_for(model)
+        entry = state.setdefault(model, {
+            "requests": [quota.rpm, now],
+            "tokens": [quota.tpm, now],
+            "day": [_quota_day(now), 0],
+            "blocked_until": 0.0,
+        })
+        # 依經過的時間補充 bucket（每分鐘補滿一次的速度）
+        for key, capacity in (("requests", quota.rpm), ("tokens", quota.tpm)):
+            level, last = entry[key]
+            level = min(capacity, level + (now - last) * capacity / 60.0)
+            entry[key] = [level, now]
+        if entry["day"][0] != _quota_day(now):
+            entry["day"] = [_quota_day(now), 0]
+        return entry
+
+    def _wait_time(self, entry: dict, quota: ModelQuota, tokens: int, now: float) -> float:
+        """還要等幾秒才能送；今天額度用完或單次超過上限就是 inf。"""
+        if entry["day"][1] >= quota.rpd or tokens > quota.tpm:
+            return math.inf
+        wait = max(0.0, entry["blocked_until"] - now)
+        for key, need, capacity in (
+            ("requests", 1, quota.rpm),
+            ("tokens", tokens, quota.tpm),
+        ):
+            level = entry[key][0]
+            if level < need:
+                wait = max(wait, (need - level) * 60.0 / capacity)
+        return wait
+
+    # ===== 對外 =====
+
+    def plan(self, models: List[str], tokens: int) -> QuotaDecision:
+        """
+        依序看每個模型（越後面越便宜 / 額度越多）：
+        - 第一個馬上可以送的就用它，並先扣掉額度
+        - 都不行的話，挑等最短的那個；等待時間在 max_queue_seconds 內就排隊
+        - 再不行就回 model=None，讓呼叫端改用 local 文案
+        """
+        now = time.time()
+        best: Tuple[float, str | None] = (math.inf, None)
+        with self.store.transaction() as state:
+            for model in models:
+                quota = self.quota_for(model)
+                entry = self._model_state(state, model, now)
+                wait = self._wait_time(entry, quota, tokens, now)
+                if wait == 0.0:
+                    self._consume(entry, tokens)
+                    return QuotaDecision(model=model, wait=0.0)
+                if wait < best[0]:
+                    best = (wait, model)
+
+            wait, model = best
+            if model is None or wait > self.max_queue_seconds:
+                return QuotaDecision(model=None, wait=0.0)
+            # 先把額度預約下來（bucket 可以暫時是負的），等 wait 秒之後再送
+            self._consume(self._model_state(state, model, now), tokens)
+            return QuotaDecision(model=model, wait=wait)
+
+    @staticmethod
+    def _consume(entry: dict, tokens: int) -> None:
+        entry["requests"][0] -= 1
+        entry["tokens"][0] -= tokens
+        entry["day"][1] += 1
+
+    def record_usage(self, model: str, estimated: int, actual: int | None) -> None:
+        """呼叫完用實際的 token 數修正預估（多扣的還回去、少扣的補扣）。"""
+        if actual is None or actual == estimated:
+            return
+        now = time.time()
+        with self.store.transaction() as state:
+            entry = self._model_state(state, model, now)
+            entry["tokens"][0] -= actual - estimated
+
+    def penalize(self, model: str, retry_after: float | None = None) -> None:
+        """吃到 429：這個模型先冷卻一段時間，期間 plan() 直接跳過它。"""
+        now = time.time()
+        with self.store.transaction() as state:
+            entry = self._model_state(state, model, now)
+            entry["blocked_until"] = max(
+                entry["blocked_until"],
+                now + (retry_after or DEFAULT_COOLDOWN_SECONDS),
+            )
+            entry["requests"][0] = min(entry["requests"][0], 0)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """目前每個模型的剩餘額度（給 log / 監控用）。"""
+        now = time.time()
+        with self.store.transaction() as state:
+            result = {}
+            for model in list(state):
+                entry = self._model_state(state, model, now)
+                quota = self.quota_for(model)
+                result[model] = {
+                    "requests_left": round(entry["requests"][0], 2),
+                    "tokens_left": int(entry["tokens"][0]),
+                    "today": entry["day"][1],
+                    "daily_limit": quota.rpd,
+                    "blocked_for": round(max(0.0, entry["blocked_until"] - now), 1),
+                }
+            return result
+
+
+def estimate_tokens(prompt: str, max_output_tokens: int) -> int:
+    """
+    粗估一次呼叫會用掉的 token：中文大約一字一 token，
+    輸出算 JSON 長度的上限（不用整個 max_output_tokens，不然會扣太多）。
+    """
+    return len(prompt) + min(max_output_tokens, 256)
+
+
+def is_quota_error(error: Exception) -> bool:
+    text = str(error)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    """從 429 的錯誤訊息裡找 retryDelay（例如 "retryDelay": "21s"）。"""
+    text = str(error)
+    marker = "retryDelay"
+    index = text.find(marker)
+    if index < 0:
+        return None
+    digits = ""
+    for ch in text[index + len(marker):]:
+        if ch.isdigit() or (ch == "." and digits):
+            digits += ch
+        elif digits:
+            break
+    try:
+        return float(digits) if digits else None
+    except ValueError:
+        return None
@@ -0,0 +1,126 @@
+import base64
+import io
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Tuple
+
+from PIL import Image
+
+from .structured_logging import get_logger, log_duration, run_in_context
+
+log = get_logger("renditions")
+
+
+# ===== 多尺寸輸出 =====
+#
+# 一次合成好的畫布，直接縮放 / 編碼成好幾種版本（原圖、LINE 預覽、網頁縮圖），
+# 不用為了不同尺寸重新解背景或重畫文字。
+# Pillow 的 resize / encode 在 C 裡會放掉 GIL，所以用 thread 平行編碼。
+
+
+@dataclass(frozen=True)
+class RenditionSpec:
+    name: str
+    max_side: int | None = None   # None = 跟畫布一樣大
+    format: str = "PNG"
+    quality: int = 90             # JPEG / WEBP 才有用
+    animated: bool = False        # 動畫版（飄雪 / 燈籠），見 animation.py
+
+
+@dataclass
+class Rendition:
+    name: str
+    width: int
+    height: int
+    format: str
+    data: bytes
+
+    @property
+    def mime(self) -> str:
+        return Image.MIME.get(self.format.upper(), "application/octet-stream")
+
+    @property
+    def extension(self) -> str:
+        return {"JPEG": "jpg"}.get(self.format.upper(), self.format.lower())
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.data).decode("utf-8")
+
+
+@dataclass
+class ComposeResult:
+    theme: str
+    layout: str
+    renditions: Dict[str, Rendition] = field(default_factory=dict)
+    seed: int | None = None   # 用同一個 seed 可以重畫出同一張
+
+    def __getitem__(self, name: str) -> Rendition:
+        return self.renditions[name]
+
+
+FULL = RenditionSpec("full", None, "PNG")
+# LINE 的 preview_image_url 建議 240px、上限 1MB
+LINE_PREVIEW = RenditionSpec("preview", 240, "JPEG", 85)
+# 網頁圖庫縮圖
+THUMBNAIL = RenditionSpec("thumbnail", 320, "WEBP", 80)
+# 會動的版本（主題沒有對應的動畫時輸出同格式的靜態圖）
+ANIMATED_WEBP = RenditionSpec("animated_webp", 512, "WEBP", 75, animated=True)
+ANIMATED_GIF = RenditionSpec("animated_gif", 400, "GIF", animated=True)
+
+RENDITION_PRESETS: Dict[str, RenditionSpec] = {
+    spec.name: spec
+    for spec in (FULL, LINE_PREVIEW, THUMBNAIL, ANIMATED_WEBP, ANIMATED_GIF)
+}
+DEFAULT_RENDITIONS: Tuple[RenditionSpec, ...] = (FULL,)
+
+_ENCODE_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rendition")
+
+
+def _encode_one(canvas: Image.Image, spec: RenditionSpec) -> Rendition:
+    img = canvas
+    if spec.max_side and max(canvas.size) > spec.max_side:
+        ratio = spec.max_side / max(canvas.size)
+        size = (
+            max(1, round(canvas.width * ratio)),
+            max(1, round(canvas.height * ratio)),
+        )
+        # reducing_gap 先用整數倍快速縮小，再做高品質重取樣
+        img = canvas.resize(size, Image.LANCZOS, reducing_gap=2.0)
+
+    fmt = spec.format.upper()
+    params = {}
+    if fmt in ("JPEG", "WEBP"):
+        params["quality"] = spec.quality
+
+    buffer = io.BytesIO()
+    with log_duration(log, "Encoded rendition", rendition=spec.name, format=fmt):
+        img.save(buffer, format=fmt, **params)
+    return Rendition(
+        name=spec.name,
+        width=img.width,
+        height=img.height,
+        format=fmt,
+        data=buffer.getvalue(),
+    )
+
+
+def encode_renditions(
+    canvas: Image.Image,
+    specs: Iterable[RenditionSpec],
+) -> Dict[str, Rendition]:
+    """把同一張 RGB 畫布平行編碼成多個版本。"""
+    specs = list(specs)
+    if canvas.mode != "RGB":
+        canvas = canvas.convert("RGB")
+
+    if len(specs) == 1:
+        rendition = _encode_one(canvas, specs[0])
+        return {rendition.name: rendition}
+
+    # 編碼 thread 也帶著呼叫端的 correlation id
+    futures = [
+        _ENCODE_POOL.submit(run_in_context(_encode_one), canvas, spec)
+        for spec in specs
+    ]
+    renditions = [f.result() for f in futures]
+    return {r.name: r for r in renditions}
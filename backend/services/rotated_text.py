@@ -0,0 +1,140 @@
+import threading
+from collections import OrderedDict
+from typing import Mapping, Sequence, Tuple
+
+from PIL import Image, ImageDraw
+
+from .font_fallback import draw_text
+from .layout_spec import GlyphRun
+from .text_layout import font_key
+
+
+# ===== 斜斜的字（diagonal 版面） =====
+#
+# 旋轉整張畫布又慢又會把背景弄糊，這裡只轉字：
+# 1. 把這一塊（可能好幾行）的描邊文字畫在剛好包住字的透明圖層上
+# 2. 只旋轉這個小圖層（BILINEAR，字本身已經反鋸齒，效果差不多但快很多）
+# 3. 以原本文字區的中心貼回畫布
+# 轉好的圖層依（文字、相對位置、字型、顏色、角度）快取；同一組祝福語常常重複出現，
+# 預先產生 / 多尺寸輸出時也會一直畫同樣的字。
+
+# 快取上限（位元組），一塊 1024 畫布上的斜字大約 0.5 ~ 1.5 MB
+ROTATED_CACHE_BYTES = 48 * 1024 * 1024
+
+# 圖層四周多留幾 px，旋轉時邊緣的反鋸齒才不會被切掉
+LAYER_PADDING = 2
+
+
+def _ink_box(run: GlyphRun) -> Tuple[int, int, int, int]:
+    left, top, right, bottom = run.font.getbbox(run.text, stroke_width=run.stroke)
+    return run.x + left, run.y + top, run.x + right, run.y + bottom
+
+
+class RotatedTextCache:
+    def __init__(self, max_bytes: int = ROTATED_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._layers: "OrderedDict[tuple, Image.Image]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def draw(
+        self,
+        canvas: Image.Image,
+        runs: Sequence[GlyphRun],
+        angle: float,
+        fills: Mapping[str, Tuple[int, int, int, int]],
+        strokes: Mapping[str, Tuple[int, int, int, int]],
+    ) -> None:
+        """把 runs 當成一整塊，以它的中心旋轉 angle 度（逆時針）後畫到 canvas 上。"""
+        runs = [run for run in runs if run.text]
+        if not runs:
+            return
+        boxes = [_ink_box(run) for run in runs]
+        x1 = min(b[0] for b in boxes) - LAYER_PADDING
+        y1 = min(b[1] for b in boxes) - LAYER_PADDING
+        x2 = max(b[2] for b in boxes) + LAYER_PADDING
+        y2 = max(b[3] for b in boxes) + LAYER_PADDING
+
+        # 用相對座標當 key：同樣的字換個位置也能用同一張
+        key = (angle, tuple(
+            (
+                run.text,
+                run.x - x1,
+                run.y - y1,
+                font_key(run.font),
+                fills[run.color],
+                run.stroke,
+                strokes[run.stroke_color],
+            )
+            for run in runs
+        ))
+        layer = self._get(key)
+        if layer is None:
+            layer = self._render(runs, (x1, y1, x2, y2), angle, fills, strokes)
+            self._put(key, layer)
+
+        # 轉完（expand）的圖層中心對齊原本文字塊的中心
+        center_x = (x1 + x2) / 2
+        center_y = (y1 + y2) / 2
+        dest = (
+            int(round(center_x - layer.width / 2)),
+            int(round(center_y - layer.height / 2)),
+        )
+        canvas.paste(layer, dest, layer)
+
+    @staticmethod
+    def _render(
+        runs: Sequence[GlyphRun],
+        box: Tuple[int, int, int, int],
+        angle: float,
+        fills: Mapping[str, Tuple[int, int, int, int]],
+        strokes: Mapping[str, Tuple[int, int, int, int]],
+    ) -> Image.Image:
+        x1, y1, x2, y2 = box
+        layer = Image.new("RGBA", (x2 - x1, y2 - y1), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(layer)
+        for run in runs:
+            draw_text(
+                layer,
+                draw,
+                (run.x - x1, run.y - y1),
+                run.text,
+                font=run.font,
+                fill=fills[run.color],
+                stroke_width=run.stroke,
+                stroke_fill=strokes[run.stroke_color],
+            )
+        if angle:
+            layer = layer.rotate(angle, resample=Image.BILINEAR, expand=True)
+        return layer
+
+    # ===== LRU =====
+
+    @staticmethod
+    def _size(layer: Image.Image) -> int:
+        return layer.width * layer.height * 4
+
+    def _get(self, key) -> Image.Image | None:
+        with self._lock:
+            layer = self._layers.get(key)
+            if layer is None:
+                self.misses += 1
+                return None
+            self._layers.move_to_end(key)
+            self.hits += 1
+            return layer
+
+    def _put(self, key, layer: Image.Image) -> None:
+        size = self._size(layer)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._layers:
+                return
+            self._layers[key] = layer
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, old = self._layers.popitem(last=False)
+                self._bytes -= self._size(old)
@@ -0,0 +1,245 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Dict, Iterable, Tuple
+
+from PIL import Image, ImageOps
+
+from .background_library import BackgroundLibrary
+from .file_lock import locked
+from .structured_logging import get_logger
+
+log = get_logger("shared_pool")
+
+
+# ===== 跨 worker 共用的已解碼背景池 =====
+#
+# 每個 uvicorn worker 各自快取解好的 1024x1024 背景會吃掉好幾 GB。
+# 這裡由一個 loader（CLI 或第一個拿到鎖的 worker）把所有背景解碼成 raw RGBX，
+# 寫進一個 mmap 檔（預設放在 /dev/shm），其他 process 只 mmap 唯讀，
+# 用 Image.frombuffer 直接包成圖片（不複製），開始畫字前才轉成自己的 RGB 畫布。
+#
+# 存 RGBX 而不是 RGB：Pillow 記憶體裡的 RGB 本來就是每像素 4 bytes，
+# frombuffer 只有 L / P / RGBX / RGBA / CMYK / I;16 能直接指向外部記憶體，
+# RGB 會默默複製一份，共用池就白做了。
+#
+# 檔案格式：MAGIC | index 長度 (uint64) | index JSON | 對齊後的 raw RGBX 資料
+# index JSON：{"version": 2, "width": 1024, "height": 1024, "mode": "RGBX",
+#              "signature": "<背景庫指紋>",
+#              "themes": {"morning": [["morning_01.jpg", offset], ...]}}
+
+POOL_MAGIC = b"ECPOOL01"
+POOL_VERSION = 2
+POOL_MODE = "RGBX"
+_HEADER = struct.Struct("<8sQ")
+_PAGE = mmap.PAGESIZE
+
+
+def _page_align(n: int) -> int:
+    return (n + _PAGE - 1) // _PAGE * _PAGE
+
+
+def default_pool_path() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "elder_card_backgrounds.pool")
+
+
+def read_rss() -> Dict[str, int]:
+    """
+    讀目前 process 的記憶體用量（bytes）。
+    RssShmem / RssFile 是共用頁面，多個 worker 只算一份實體記憶體。
+    """
+    fields = {"VmRSS": 0, "RssAnon": 0, "RssFile": 0, "RssShmem": 0}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in fields:
+                    fields[key] = int(value.split()[0]) * 1024
+    except OSError:
+        import resource
+
+        fields["VmRSS"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return fields
+
+
+def format_rss(rss: Dict[str, int]) -> str:
+    return ", ".join(f"{k}={v / 1024 / 1024:.1f}MB" for k, v in rss.items())
+
+
+def library_signature(
+    library: BackgroundLibrary, themes: Iterable[str] | None = None
+) -> str:
+    """
+    背景庫的指紋（每張圖的主題、檔名、大小 / mtime）。
+    新增背景或 ingest --renumber 之後指紋就會變，共用池要重新產生，
+    不然檔名會對到錯的像素。
+    """
+    digest = hashlib.sha1()
+    for theme in themes or library.themes():
+        for name in library.names(theme):
+            digest.update(f"{theme}/{name}={library.signature(theme, name)}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def read_pool_signature(path: str) -> str | None:
+    """讀現有池檔案的指紋；檔案不存在、格式或版本不對都回 None（要重新產生）。"""
+    try:
+        with open(path, "rb") as f:
+            magic, index_len = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != POOL_MAGIC:
+                return None
+            index = json.loads(f.read(index_len).decode("utf-8"))
+    except (OSError, ValueError, struct.error):
+        return None
+    if index.get("version") != POOL_VERSION:
+        return None
+    return index.get("signature")
+
+
+def publish_pool(
+    library: BackgroundLibrary,
+    path: str,
+    size: Tuple[int, int] = (1024, 1024),
+    themes: Iterable[str] | None = None,
+) -> int:
+    """
+    把 library 裡所有背景（或指定的主題）解碼成 size 大小的 raw RGBX，
+    寫成共用池檔案。先寫暫存檔再 rename，正在讀舊檔的 worker 不受影響。
+    回傳張數。
+    """
+    themes = list(themes or library.themes())
+    stride = size[0] * size[1] * len(POOL_MODE)
+    entries: Dict[str, list] = {}
+    offset = 0
+    for theme in themes:
+        names = library.names(theme)
+        if not names:
+            continue
+        entries[theme] = []
+        for name in names:
+            entries[theme].append([name, offset])
+            offset += _page_align(stride)
+
+    raw = json.dumps(
+        {
+            "version": POOL_VERSION,
+            "width": size[0],
+            "height": size[1],
+            "mode": POOL_MODE,
+            "signature": library_signature(library, themes),
+            "themes": entries,
+        },
+        ensure_ascii=False,
+    ).encode("utf-8")
+    data_start = _page_align(_HEADER.size + len(raw))
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    count = 0
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(POOL_MAGIC, len(raw)))
+        f.write(raw)
+        for theme, items in entries.items():
+            for name, rel_offset in items:
+                with library.open(theme, name) as src:
+                    src.draft("RGB", size)
+                    rgb = src if src.mode == "RGB" else src.convert("RGB")
+                    img = ImageOps.fit(rgb, size).convert(POOL_MODE)
+                f.seek(data_start + rel_offset)
+                f.write(img.tobytes())
+                count += 1
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    return count
+
+
+def ensure_pool(
+    library: BackgroundLibrary,
+    path: str,
+    size: Tuple[int, int] = (1024, 1024),
+) -> None:
+    """
+    多個 worker 同時啟動時，只讓一個 process 產生池檔案，其他人等它做完。
+    池檔案不存在、或跟目前背景庫的指紋不同（背景有增減 / 重新編號）就重新產生。
+    """
+    lock_path = f"{path}.lock"
+    with open(lock_path, "w") as lock_file, locked(lock_file):
+        signature = library_signature(library)
+        current = read_pool_signature(path)
+        if current != signature:
+            count = publish_pool(library, path, size)
+            log.info(
+                "Published background pool",
+                extra={"count": count, "path": path, "stale": current is not None},
+            )
+
+
+class SharedBackgroundPool:
+    """唯讀 attach 共用池，依 (theme, name) 拿到不複製的 Image。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, index_len = _HEADER.unpack_from(self._mm, 0)
+        if magic != POOL_MAGIC:
+            raise ValueError(f"Not a background pool: {path}")
+        index = json.loads(
+            self._mm[_HEADER.size:_HEADER.size + index_len].decode("utf-8")
+        )
+        if index.get("version") != POOL_VERSION:
+            raise ValueError(f"Unsupported pool version: {index.get('version')}")
+
+        self.size: Tuple[int, int] = (index["width"], index["height"])
+        self.mode: str = index["mode"]
+        self._stride = self.size[0] * self.size[1] * len(self.mode)
+        data_start = _page_align(_HEADER.size + index_len)
+        self._offsets: Dict[Tuple[str, str], int] = {
+            (theme, name): data_start + offset
+            for theme, items in index["themes"].items()
+            for name, offset in items
+        }
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def get(self, theme: str, name: str) -> Image.Image | None:
+        """
+        回傳直接指向共用記憶體的唯讀 RGBX Image（沒有複製），找不到就回 None。
+        要畫字前請先 convert("RGB")，那一次就是唯一的複製。
+        """
+        offset = self._offsets.get((theme, name))
+        if offset is None:
+            return None
+        view = memoryview(self._mm)[offset:offset + self._stride]
+        img = Image.frombuffer(self.mode, self.size, view, "raw", self.mode, 0, 1)
+        # 不是唯讀代表 Pillow 複製了一份（mode 不能直接對應外部記憶體）
+        if not img.readonly:
+            raise ValueError(f"Pool mode {self.mode} is not zero-copy")
+        return img
+
+
+def attach_pool(path: str) -> SharedBackgroundPool:
+    # mmap 還沒碰到任何頁面，這裡量 RSS 沒有意義；共用的效果看 benchmarks/bench_shared_pool.py
+    pool = SharedBackgroundPool(path)
+    log.info("Attached background pool", extra={"count": len(pool), "path": path})
+    return pool
+
+
+if __name__ == "__main__":
+    # python -m services.shared_pool [pool 路徑]：由 loader process 預先產生共用池
+    import sys
+    from pathlib import Path
+
+    backend_dir = Path(__file__).resolve().parent.parent
+    target = sys.argv[1] if len(sys.argv) > 1 else default_pool_path()
+    lib = BackgroundLibrary(
+        str(backend_dir / "assets" / "backgrounds"),
+        os.getenv("BACKGROUND_PACK", str(backend_dir / "assets" / "backgrounds.pack")),
+    )
+    n = publish_pool(lib, target)
+    print(f"[SharedPool] Published {n} backgrounds -> {target}")
@@ -0,0 +1,165 @@
+import glob
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from PIL import Image
+
+
+# 常用的畫布寬度，載入貼紙時就先縮好，其他寬度第一次用到再縮
+SUPPORTED_CANVAS_WIDTHS = (512, 768, 1024)
+
+STICKER_MAX_RATIO = 0.18   # 貼紙最大邊 = 畫布寬 * 0.18
+STICKER_MARGIN_RATIO = 0.03
+CORNERS = ("tl", "tr", "bl", "br")
+
+# 多久檢查一次資料夾有沒有變動（秒）
+RELOAD_CHECK_INTERVAL = 2.0
+
+
+def corner_positions(
+    canvas_size: Tuple[int, int],
+    sticker_size: Tuple[int, int],
+) -> Dict[str, Tuple[int, int]]:
+    """四個角落的貼上位置。"""
+    width, height = canvas_size
+    sw, sh = sticker_size
+    margin = int(width * STICKER_MARGIN_RATIO)
+    return {
+        "tl": (margin, margin),
+        "tr": (width - sw - margin, margin),
+        "bl": (margin, height - sh - margin),
+        "br": (width - sw - margin, height - sh - margin),
+    }
+
+
+class StickerAtlas:
+    """
+    貼紙圖集：
+    - 資料夾只讀一次，每張貼紙轉成 RGBA 常駐記憶體
+    - 依畫布寬度保留縮好的版本，四個角的座標也先算好
+    - 資料夾 mtime 改變（新增/刪除貼紙）就自動重新載入，不用重開服務
+    """
+
+    def __init__(
+        self,
+        sticker_dir: str,
+        widths: Tuple[int, ...] = SUPPORTED_CANVAS_WIDTHS,
+    ):
+        self.sticker_dir = sticker_dir
+        self.widths = widths
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._signature: int | None = None
+        self._last_check = 0.0
+        self._originals: List[Image.Image] = []
+        # (canvas_w, canvas_h) -> [(縮好的貼紙, {corner: pos}), ...]
+        self._variants: Dict[
+            Tuple[int, int],
+            List[Tuple[Image.Image, Dict[str, Tuple[int, int]]]],
+        ] = {}
+
+    # ===== 載入 =====
+
+    def _dir_signature(self) -> int | None:
+        try:
+            return os.stat(self.sticker_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load_originals(self) -> List[Image.Image]:
+        if not os.path.isdir(self.sticker_dir):
+            return []
+
+        paths = sorted(
+            p for p in glob.glob(os.path.join(self.sticker_dir, "*.*"))
+            if p.lower().endswith((".png", ".webp"))
+        )
+        originals = []
+        for path in paths:
+            try:
+                with Image.open(path) as im:
+                    originals.append(im.convert("RGBA"))
+            except Exception:
+                continue
+        return originals
+
+    def _build_variants(
+        self, canvas_size: Tuple[int, int]
+    ) -> List[Tuple[Image.Image, Dict[str, Tuple[int, int]]]]:
+        max_size = int(canvas_size[0] * STICKER_MAX_RATIO)
+        variants = []
+        for original in self._originals:
+            sticker = original.copy()
+            sticker.thumbnail((max_size, max_size), Image.LANCZOS)
+            variants.append(
+                (sticker, corner_positions(canvas_size, sticker.size))
+            )
+        return variants
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if self._loaded and now - self._last_check < RELOAD_CHECK_INTERVAL:
+            return
+
+        with self._lock:
+            self._last_check = now
+            signature = self._dir_signature()
+            if self._loaded and signature == self._signature:
+                return
+
+            self._signature = signature
+            self._originals = self._load_originals()
+            self._variants = {
+                (w, w): self._build_variants((w, w)) for w in self.widths
+            }
+            self._loaded = True
+
+    def reload(self) -> None:
+        """強制重新讀取貼紙資料夾。"""
+        self._loaded = False
+        self._maybe_reload()
+
+    # ===== 使用 =====
+
+    def variants_for(
+        self, canvas_size: Tuple[int, int]
+    ) -> List[Tuple[Image.Image, Dict[str, Tuple[int, int]]]]:
+        self._maybe_reload()
+        if not self._originals:
+            return []
+
+        variants = self._variants.get(canvas_size)
+        if variants is None:
+            with self._lock:
+                variants = self._variants.get(canvas_size)
+                if variants is None:
+                    variants = self._build_variants(canvas_size)
+                    self._variants[canvas_size] = variants
+        return variants
+
+    def add_to(self, bg: Image.Image, rng: random.Random | None = None) -> None:
+        """隨機挑一張貼紙貼在四個角其中一個（貼紙自己的 alpha 當遮罩，畫布 RGB / RGBA 都可以）。"""
+        variants = self.variants_for(bg.size)
+        if not variants:
+            return
+
+        rng = rng or random
+        sticker, positions = rng.choice(variants)
+        corner = rng.choice(CORNERS)
+        bg.paste(sticker, positions[corner], sticker)
+
+
+_ATLASES: Dict[str, StickerAtlas] = {}
+_ATLASES_LOCK = threading.Lock()
+
+
+def get_sticker_atlas(sticker_dir: str) -> StickerAtlas:
+    """同一個資料夾共用同一份圖集。"""
+    atlas = _ATLASES.get(sticker_dir)
+    if atlas is None:
+        with _ATLASES_LOCK:
+            atlas = _ATLASES.setdefault(sticker_dir, StickerAtlas(sticker_dir))
+    return atlas
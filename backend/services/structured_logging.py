@@ -0,0 +1,262 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Iterator, TypeVar
+
+
+# ===== 非阻塞的結構化 log =====
+#
+# 以前到處 print：每次換模型、每次失敗、每個產生的網址都同步寫 stdout，
+# 流量一大 stdout 一卡，合成也跟著卡；LINE 和網頁的 log 混在一起也對不起來。
+# 這裡：
+# - 呼叫端只把 record 丟進 queue（QueueHandler），真正格式化 / 寫出在背景 thread
+#   （QueueListener）；queue 滿了就丟掉並計數，不讓 log 拖慢請求
+# - 每個請求一個 correlation id（contextvar），LLMService / ComposeService 的 log
+#   都會自動帶上；丟到其他 thread 執行時用 run_in_context 把 id 帶過去
+# - 一行一個 JSON（LOG_FORMAT=text 改成人看的格式）
+# - DEBUG 等級的囉嗦 log 只取樣 LOG_DEBUG_SAMPLE_RATE 的比例
+#
+# 環境變數：LOG_LEVEL（預設 INFO）、LOG_FORMAT（json / text）、
+# LOG_DEBUG_SAMPLE_RATE（預設 0.1）、LOG_QUEUE_SIZE（預設 10000）
+
+ROOT_LOGGER = "elder_card"
+
+_correlation_id: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "correlation_id", default="-"
+)
+
+# LogRecord 本身的欄位；其他 extra 欄位才會輸出到 JSON
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+T = TypeVar("T")
+
+
+def get_logger(name: str) -> logging.Logger:
+    """services 用 get_logger("llm") 之類，全部掛在 elder_card 底下。"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+# ===== correlation id =====
+
+def new_correlation_id(prefix: str = "") -> str:
+    value = uuid.uuid4().hex[:12]
+    return f"{prefix}-{value}" if prefix else value
+
+
+def current_correlation_id() -> str:
+    return _correlation_id.get()
+
+
+@contextmanager
+def correlation_scope(value: str | None = None, prefix: str = "") -> Iterator[str]:
+    """在這個範圍內的 log 都帶同一個 id；沒給 value 就產生一個新的。"""
+    value = value or new_correlation_id(prefix)
+    token = _correlation_id.set(value)
+    try:
+        yield value
+    finally:
+        _correlation_id.reset(token)
+
+
+def run_in_context(fn: Callable[..., T]) -> Callable[..., T]:
+    """
+    把目前的 contextvars（correlation id）綁到 fn 上，
+    交給 ThreadPoolExecutor 之類不會自動複製 context 的地方執行。
+    """
+    context = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+# ===== filter / formatter =====
+
+class CorrelationFilter(logging.Filter):
+    """在呼叫端的 thread 把 correlation id 記到 record 上（listener thread 拿不到 contextvar）。"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "correlation_id"):
+            record.correlation_id = _correlation_id.get()
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """DEBUG 只留 rate 比例；INFO 以上全部保留。"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "correlation_id": getattr(record, "correlation_id", "-"),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and key != "correlation_id":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """開發用的單行格式；extra 欄位接在訊息後面（key=value）。"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] (%(correlation_id)s) %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "correlation_id"):
+            record.correlation_id = "-"
+        line = super().format(record)
+        fields = " ".join(
+            f"{key}={value}" for key, value in vars(record).items()
+            if key not in _RECORD_FIELDS and key != "correlation_id"
+        )
+        if not fields:
+            return line
+        # 有 traceback 時欄位放在第一行後面，不要接在 traceback 最後
+        first, sep, rest = line.partition("\n")
+        return f"{first} {fields}{sep}{rest}"
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """queue 滿了直接丟掉（計數），絕不讓請求等 log。"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# ===== 啟動 / 關閉 =====
+
+_lock = threading.Lock()
+_listener: logging.handlers.QueueListener | None = None
+_queue_handler: DroppingQueueHandler | None = None
+
+
+def setup_logging() -> logging.Logger:
+    """設定 elder_card 底下的 logger（重複呼叫沒關係），回傳 root logger。"""
+    global _listener, _queue_handler
+    root = logging.getLogger(ROOT_LOGGER)
+    with _lock:
+        if _listener is not None:
+            return root
+
+        level = os.getenv("LOG_LEVEL", "INFO").upper()
+        fmt = os.getenv("LOG_FORMAT", "json").lower()
+        sample_rate = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+        queue_size = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(TextFormatter() if fmt == "text" else JsonFormatter())
+
+        log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        _queue_handler = DroppingQueueHandler(log_queue)
+        _queue_handler.addFilter(DebugSampler(sample_rate))
+        _queue_handler.addFilter(CorrelationFilter())
+
+        root.setLevel(level)
+        root.addHandler(_queue_handler)
+        # 不要再往 Python root logger 傳，避免 uvicorn 的 handler 又同步寫一次
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(
+            log_queue, stream, respect_handler_level=True
+        )
+        _listener.start()
+        # 沒走到 lifespan 結束（例如 CLI、測試）也要把 queue 裡的 log 寫完
+        atexit.register(shutdown_logging)
+    return root
+
+
+def shutdown_logging() -> None:
+    """把 queue 裡剩下的 log 寫完再停（lifespan 結束時呼叫）。"""
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        if _queue_handler is not None:
+            if _queue_handler.dropped:
+                sys.stdout.write(
+                    f"[Logging] Dropped {_queue_handler.dropped} records (queue full)\n"
+                )
+            logging.getLogger(ROOT_LOGGER).removeHandler(_queue_handler)
+        _listener = None
+        _queue_handler = None
+
+
+class CorrelationIdMiddleware:
+    """
+    ASGI middleware：每個 HTTP 請求一個 correlation id（前面有代理給 X-Request-ID 就沿用），
+    回應 header 也帶 X-Request-ID，前端回報問題時可以直接拿來查 log。
+    用純 ASGI 寫，串流回應的 generator 也在同一個 context 裡。
+    """
+
+    def __init__(self, app, prefix: str = "web"):
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope.get("headers") or []).get(b"x-request-id", b"")
+        value = incoming.decode("latin-1")[:64] or new_correlation_id(self.prefix)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers") or [])
+                headers.append((b"x-request-id", value.encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        with correlation_scope(value):
+            await self.app(scope, receive, send_with_id)
+
+
+def dropped_records() -> int:
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+@contextmanager
+def log_duration(logger: logging.Logger, msg: str, level: int = logging.DEBUG, **fields) -> Iterator[None]:
+    """量一段程式花多久，結束時記一筆 {msg, duration_ms, ...fields}。"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if logger.isEnabledFor(level):
+            fields["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            logger.log(level, msg, extra=fields)
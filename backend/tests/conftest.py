@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 跟 CLI 一樣以 backend/ 為根目錄 import（golden_images、services...）
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
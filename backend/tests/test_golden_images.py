@@ -0,0 +1,77 @@
+"""
+config/golden.json 的案例：同一個 seed 一定畫出同一張；有參考圖的話，畫面不能跑掉。
+
+    cd backend
+    python -m pytest tests
+
+參考圖在 assets/golden/（python golden_images.py record 產生，跟本機字型 / Pillow 有關，
+不進版控）。還沒 record、或 manifest.json 跟目前環境不同時，比對那一項是 xfail，
+訊息裡有要跑的指令；pytest -rx 看得到，不會默默跳過。
+
+    pip install -r requirements-dev.txt
+"""
+import json
+
+import pytest
+from PIL import Image
+
+import golden_images
+from services.renditions import FULL
+
+CASES, DEFAULT_SIZE = golden_images.load_cases()
+
+
+@pytest.fixture(scope="module")
+def service():
+    return golden_images.create_service()
+
+
+def _render_png(service, case) -> bytes:
+    width, height = case.get("size", DEFAULT_SIZE)
+    layout = case.get("layout", "auto")
+    result = service.compose_renditions(
+        case["theme"],
+        case["title"],
+        case["subtitle"],
+        case.get("footer", ""),
+        layout=None if layout == "auto" else layout,
+        effects=case.get("effects"),
+        width=width,
+        height=height,
+        renditions=[FULL],
+        seed=case["seed"],
+    )
+    return result["full"].data
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case["name"] for case in CASES])
+def test_same_seed_renders_identical_bytes(service, case):
+    # 第二次會用到斜字圖層、placement plan 等快取，結果也要一模一樣
+    assert _render_png(service, case) == _render_png(service, case)
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case["name"] for case in CASES])
+def test_matches_golden_reference(service, case):
+    ref_path = golden_images.GOLDEN_DIR / f"{case['name']}.png"
+    if not ref_path.exists():
+        pytest.xfail(f"no reference for {case['name']}; run: python golden_images.py record")
+    manifest_path = golden_images.GOLDEN_DIR / "manifest.json"
+    if manifest_path.exists():
+        with open(manifest_path, encoding="utf-8") as f:
+            recorded = json.load(f)
+        if recorded != golden_images.environment(service):
+            pytest.xfail(
+                f"references were recorded with {recorded}; "
+                "run: python golden_images.py record"
+            )
+
+    actual = golden_images.render(service, case, DEFAULT_SIZE)
+    with Image.open(ref_path) as ref:
+        reference = ref.convert("RGB")
+    scored = golden_images.score(reference, actual)
+    assert scored is not None, f"size {actual.size} != {reference.size}"
+    mean, bad_ratio, _ = scored
+    assert golden_images.within_limits(mean, bad_ratio), (
+        f"mean {mean:.2f}, bad {bad_ratio * 100:.3f}% "
+        f"(python golden_images.py check --only {case['name']} for a diff image)"
+    )